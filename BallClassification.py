@@ -1,6 +1,27 @@
-import pandas as pd
+import os
+import threading
+
 import numpy as np
 
+BALL_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "random_forest_model.pkl")
+
+_ball_model = None
+_ball_model_lock = threading.Lock()
+
+def get_ball_model():
+    """
+    取得球路分類模型 (隨機森林)。第一次呼叫時才載入 (需要匯入 sklearn，約 2 秒)，
+    同一行程只載入一次；啟動預熱的執行緒與第一個請求同時呼叫時也不會重複載入。
+    """
+    global _ball_model
+    if _ball_model is None:
+        with _ball_model_lock:
+            if _ball_model is None:
+                import joblib
+                _ball_model = joblib.load(BALL_MODEL_PATH)
+    return _ball_model
+
+
 def classify_ball_quality(ball_json, model, target_length=239):
     """
     這個函數ball_json就是棒球api回傳的json檔案
@@ -44,6 +65,8 @@ def classify_ball_quality(ball_json, model, target_length=239):
     values = x_list + y_list
     
     # Create DataFrame. Pandas can handle None, which will become NaN.
+    # pandas 匯入約需 0.3 秒，延後到第一次分類 (或啟動預熱) 時才匯入，縮短冷啟動
+    import pandas as pd
     df = pd.DataFrame([values], columns=columns)
 
     # Note: Many machine learning models, including RandomForest, do not natively
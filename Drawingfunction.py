@@ -2,7 +2,10 @@ import cv2
 import os
 import math
 import numpy as np
-from typing import Tuple # 導入 Tuple 以正確標註回傳型別
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple # 導入 Tuple 以正確標註回傳型別
+from pose_stream import PoseTrack
 
 """
 畫投手骨架的函數
@@ -80,18 +83,326 @@ def draw_pitcher_on_frame(image, pitcher_data, kpt_thr=0.3, line_thickness=1, po
 
     return image
 
+"""
+批次繪製：先把整份骨架資料轉成整數座標與可見度陣列，每幀只需以少數幾次 OpenCV 呼叫完成繪製
+(結果與 draw_pitcher_on_frame 逐點繪製完全相同)
+"""
+# 依顏色分組的骨架連線 (SKELETON_CONNECTIONS 中同色的連線是連續的，分組後繪製順序不變)
+_LIMB_GROUPS = []
+for _i, _color in enumerate(LIMB_COLORS):
+    if _LIMB_GROUPS and _LIMB_GROUPS[-1][0] == _color:
+        _LIMB_GROUPS[-1][1].append(_i)
+    else:
+        _LIMB_GROUPS.append((_color, [_i]))
+_LIMB_GROUPS = [(color, np.array(indices)) for color, indices in _LIMB_GROUPS]
+_CONNECTIONS = np.array(SKELETON_CONNECTIONS)
+
+
+@dataclass
+class PoseOverlay:
+    """整段影片的骨架繪製資料 (N = 有骨架資料的幀數)。"""
+    rows: dict                  # frame_idx -> 列索引
+    segments: np.ndarray        # (N, 連線數, 2, 2) int32 連線兩端點
+    segment_visible: np.ndarray # (N, 連線數) bool 兩端點的信心分數都超過門檻
+    points: np.ndarray          # (N, 17, 2) int32
+    point_visible: np.ndarray   # (N, 17) bool
+    bboxes: np.ndarray          # (N, 4) int32
+    has_bbox: np.ndarray        # (N,) bool
+    has_skeleton: np.ndarray    # (N,) bool 資料格式正確、可以畫骨架
+
+
+def precompute_pose_overlay(pose_json, kpt_thr=0.3, scale: float = 1.0) -> PoseOverlay:
+    """
+    將 pose_json (Pose API 回應的 dict 或 PoseTrack) 一次轉成繪製用的整數陣列，
+    判斷規則與 draw_pitcher_on_frame 相同 (第一個人、bbox 解包、分數門檻、int() 截斷)。
+    scale 為輸出影片相對原始影片的縮放比例 (縮小輸出時座標一併縮放)。
+    """
+    if isinstance(pose_json, PoseTrack):
+        frame_ids = pose_json.frame_idx.tolist()
+        keypoints = pose_json.keypoints[:, :, :2]
+        scores = pose_json.keypoint_scores
+        bboxes = pose_json.bboxes
+        has_skeleton = ~np.isnan(scores).all(axis=1)
+    else:
+        frame_ids, keypoint_rows, score_rows, bbox_rows, skeleton_flags = [], [], [], [], []
+        for frame in pose_json.get('frames', []):
+            predictions = frame.get('predictions', [])
+            if not predictions or not predictions[0]:
+                continue
+            pitcher_data = predictions[0]
+            bbox_data = pitcher_data.get('bbox')
+            while isinstance(bbox_data, list) and len(bbox_data) > 0 and isinstance(bbox_data[0], list):
+                bbox_data = bbox_data[0]
+            valid_bbox = bbox_data and len(bbox_data) == 4 and all(isinstance(c, (int, float)) for c in bbox_data)
+
+            keypoints_data = pitcher_data.get('keypoints')
+            keypoint_scores_data = pitcher_data.get('keypoint_scores')
+            kpts = np.full((17, 2), np.nan)
+            kpt_scores = np.full(17, np.nan)
+            ok = False
+            if keypoints_data and keypoint_scores_data:
+                array = np.array(keypoints_data)
+                score_array = np.array(keypoint_scores_data)
+                if array.ndim == 2 and array.shape[1] == 2 and score_array.ndim == 1:
+                    n = min(len(array), len(score_array), 17)
+                    kpts[:n] = array[:n]
+                    kpt_scores[:n] = score_array[:n]
+                    ok = True
+                else:
+                    print(f"⚠️ 數據格式不正確，無法繪製骨架。Keypoints shape: {array.shape}, Scores shape: {score_array.shape}")
+
+            frame_ids.append(frame['frame_idx'])
+            keypoint_rows.append(kpts)
+            score_rows.append(kpt_scores)
+            bbox_rows.append(bbox_data if valid_bbox else [np.nan] * 4)
+            skeleton_flags.append(ok)
+        keypoints = np.array(keypoint_rows, dtype=np.float64).reshape(-1, 17, 2)
+        scores = np.array(score_rows, dtype=np.float64).reshape(-1, 17)
+        bboxes = np.array(bbox_rows, dtype=np.float64).reshape(-1, 4)
+        has_skeleton = np.array(skeleton_flags, dtype=bool)
+
+    if scale != 1.0:
+        keypoints = keypoints * scale
+        bboxes = bboxes * scale
+    with np.errstate(invalid='ignore'):
+        point_visible = (scores > kpt_thr) & has_skeleton[:, None]
+    points = np.nan_to_num(keypoints).astype(np.int32)  # 與 int() 相同，向 0 截斷
+    has_bbox = ~np.isnan(bboxes).any(axis=1)
+    segments = points[:, _CONNECTIONS]                   # (N, 連線數, 2, 2)
+    segment_visible = point_visible[:, _CONNECTIONS[:, 0]] & point_visible[:, _CONNECTIONS[:, 1]]
+    return PoseOverlay(
+        rows={frame_idx: row for row, frame_idx in enumerate(frame_ids)},
+        segments=np.ascontiguousarray(segments),
+        segment_visible=segment_visible,
+        points=points,
+        point_visible=point_visible,
+        bboxes=np.nan_to_num(bboxes).astype(np.int32),
+        has_bbox=has_bbox,
+        has_skeleton=has_skeleton,
+    )
+
+
+@lru_cache(maxsize=8)
+def _disk_offsets(radius: int) -> Tuple[np.ndarray, np.ndarray]:
+    """cv2.circle 實心圓的像素位移 (一次畫好後重複蓋印，結果與逐點呼叫 cv2.circle 相同)。"""
+    size = 2 * radius + 3
+    canvas = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(canvas, (radius + 1, radius + 1), radius, 255, -1)
+    ys, xs = np.nonzero(canvas)
+    return ys - (radius + 1), xs - (radius + 1)
+
+
+def draw_pose_overlay(image, overlay: PoseOverlay, frame_idx: int, line_thickness=1, point_radius=3):
+    """以預先計算的陣列繪製一幀的邊界框、骨架與關節點。"""
+    row = overlay.rows.get(frame_idx)
+    if row is None:
+        return image
+
+    if overlay.has_bbox[row]:
+        x1, y1, x2, y2 = overlay.bboxes[row].tolist()
+        cv2.rectangle(image, (x1, y1), (x2, y2), BBOX_COLOR, line_thickness)
+    if not overlay.has_skeleton[row]:
+        return image
+
+    visible = overlay.segment_visible[row]
+    for color, indices in _LIMB_GROUPS:
+        segments = overlay.segments[row, indices[visible[indices]]]
+        if len(segments):
+            cv2.polylines(image, segments, False, color, line_thickness)
+
+    points = overlay.points[row, overlay.point_visible[row]]
+    if len(points):
+        dy, dx = _disk_offsets(point_radius)
+        ys = (points[:, 1, None] + dy).ravel()
+        xs = (points[:, 0, None] + dx).ravel()
+        inside = (ys >= 0) & (ys < image.shape[0]) & (xs >= 0) & (xs < image.shape[1])
+        image[ys[inside], xs[inside]] = KEYPOINT_COLOR
+    return image
+
+
+class SpeedLabel:
+    """
+    左上角的最大球速標籤。數值改變時才在黑底上排版一次並快取整塊影像，其餘幀直接複製。
+    文字 (反鋸齒) 常會超出黑底框右緣幾個像素，超出的部分仍以 putText 畫在框外的小區域上，
+    結果與每幀重畫完全相同；框太小或文字往其他方向超出時改回直接繪製。
+    """
+    BOX_TOP_LEFT = (30, 30)
+    BOX_BOTTOM_RIGHT = (360, 80)
+    TEXT_ORIGIN = (40, 65)
+    FONT_SCALE = 1
+    THICKNESS = 2
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._text = None
+        self._patch = None
+        self._overflow_right = 0
+
+    def _layout(self, text: str):
+        (x1, y1), (x2, y2) = self.BOX_TOP_LEFT, self.BOX_BOTTOM_RIGHT
+        (text_w, text_h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, self.FONT_SCALE, self.THICKNESS)
+        tx, ty = self.TEXT_ORIGIN
+        pad = self.THICKNESS + 2  # 筆畫粗細與反鋸齒的外緣
+        self._text = text
+        self._patch = None
+        if not (tx - pad >= x1 and ty - text_h - pad >= y1 and ty + baseline + pad <= y2
+                and x2 < self.width and y2 < self.height):
+            return
+        # 以原本的座標在全黑畫布上繪製，再切出黑底框的範圍
+        canvas = np.zeros((y2 + 1, x2 + 1, 3), dtype=np.uint8)
+        cv2.putText(canvas, text, self.TEXT_ORIGIN, cv2.FONT_HERSHEY_SIMPLEX,
+                    self.FONT_SCALE, (255, 255, 255), self.THICKNESS)
+        self._patch = canvas[y1:y2 + 1, x1:x2 + 1].copy()
+        self._overflow_right = min(self.width, tx + text_w + pad + 1)
+
+    def draw(self, frame, max_speed_kmh: float):
+        label = f"Max Speed: {max_speed_kmh:.1f} km/h"
+        if label != self._text:
+            self._layout(label)
+        (x1, y1), (x2, y2) = self.BOX_TOP_LEFT, self.BOX_BOTTOM_RIGHT
+        if self._patch is None:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 0), -1)  # 黑底
+            cv2.putText(frame, label, self.TEXT_ORIGIN, cv2.FONT_HERSHEY_SIMPLEX,
+                        self.FONT_SCALE, (255, 255, 255), self.THICKNESS)  # 白字
+            return frame
+
+        frame[y1:y2 + 1, x1:x2 + 1] = self._patch
+        if self._overflow_right > x2 + 1:
+            # 超出框右緣的文字畫在框外的小區域上 (座標平移，點陣化結果不變)
+            overflow = frame[y1:y2 + 1, x2 + 1:self._overflow_right]
+            tx, ty = self.TEXT_ORIGIN
+            cv2.putText(overflow, label, (tx - (x2 + 1), ty - y1), cv2.FONT_HERSHEY_SIMPLEX,
+                        self.FONT_SCALE, (255, 255, 255), self.THICKNESS)
+        return frame
+
+
+@dataclass(frozen=True)
+class RenderProfile:
+    """
+    渲染設定。完整影片逐幀重新編碼最耗 CPU，多數使用者只看出手前後一兩秒，
+    預覽設定可只輸出 landing / release 附近的片段、縮小解析度並抽幀。
+    """
+    name: str
+    trim: bool = False                    # 只輸出 landing 到 release 前後的片段 (缺少關鍵幀時輸出整段)
+    seconds_before: float = 1.0           # 片段從 min(landing, release) 往前幾秒開始
+    seconds_after: float = 1.0            # 到 max(landing, release) 往後幾秒結束
+    max_height: Optional[int] = None      # 輸出高度上限，超過時等比例縮小
+    frame_step: int = 1                   # 每幾幀輸出一幀 (輸出 fps 隨之降低)
+    codecs: Tuple[str, ...] = ("avc1", "mp4v")  # 依序嘗試的編碼器 (fourcc)
+    quality: Optional[int] = None         # 0-100，只有支援 VIDEOWRITER_PROP_QUALITY 的編碼器有效
+
+    def frame_window(self, key_frames: Optional[dict], fps: float, frame_count: int) -> Tuple[int, Optional[int]]:
+        """回傳要輸出的幀範圍 [start, end)；end 為 None 代表讀到影片結尾。"""
+        anchors = [idx for idx in (key_frames or {}).values() if idx is not None and idx >= 0]
+        if not self.trim or not anchors or not fps:
+            return 0, None
+        start = max(0, int(min(anchors) - self.seconds_before * fps))
+        end = int(max(anchors) + self.seconds_after * fps) + 1
+        if frame_count > 0:
+            end = min(end, frame_count)
+        return start, max(start, end)
+
+    def output_size(self, width: int, height: int) -> Tuple[int, int]:
+        if not self.max_height or height <= self.max_height:
+            return width, height
+        out_height = self.max_height - self.max_height % 2
+        out_width = max(2, int(round(width * out_height / height / 2)) * 2)  # 多數編碼器要求偶數尺寸
+        return out_width, out_height
+
+
+RENDER_PROFILES = {
+    "full": RenderProfile("full"),
+    "preview": RenderProfile("preview", trim=True, seconds_before=1.0, seconds_after=1.0, max_height=720),
+    "fast": RenderProfile("fast", trim=True, seconds_before=0.5, seconds_after=0.5, max_height=480, frame_step=2),
+}
+
+
+def get_render_profile(name: str) -> RenderProfile:
+    profile = RENDER_PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"未知的渲染設定：{name} (可用：{', '.join(RENDER_PROFILES)})")
+    return profile
+
+
+def _open_video_writer(output_video_path: str, profile: RenderProfile, fps: float, size: Tuple[int, int]):
+    out = None
+    for i, codec in enumerate(profile.codecs):
+        out = cv2.VideoWriter(output_video_path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if out.isOpened():
+            break
+        if i + 1 < len(profile.codecs):
+            # 部分 OpenCV 版本 (例如 pip 的 headless 版) 沒有 H.264 編碼器，改用下一個以免默默輸出空檔案
+            print(f"⚠️ 無法使用 {codec} 編碼器，改用 {profile.codecs[i + 1]}")
+    if out is None or not out.isOpened():
+        raise RuntimeError(f"無法建立輸出影片 (編碼器：{', '.join(profile.codecs)})")
+    if profile.quality is not None and not out.set(cv2.VIDEOWRITER_PROP_QUALITY, profile.quality):
+        print(f"⚠️ 編碼器不支援調整品質，忽略 quality={profile.quality}")
+    return out
+
+
+class BallSpeedTracker:
+    """依幀序累計最大球速 (影片渲染與 calculate_max_ball_speed 共用同一套計算)。"""
+
+    def __init__(self, fps: float, pixel_to_meter: float = 0.04,
+                 min_valid_speed_kmh: float = 30, max_valid_speed_kmh: float = 200):
+        self.fps = fps
+        self.pixel_to_meter = pixel_to_meter
+        self.min_valid_speed_kmh = min_valid_speed_kmh
+        self.max_valid_speed_kmh = max_valid_speed_kmh
+        self.prev_center = None
+        self.prev_frame_idx = None
+        self.max_speed_kmh = 0
+
+    def update(self, frame_idx: int, ball_box) -> Optional[Tuple[int, int, int, int]]:
+        """加入一幀的球框 (None 代表沒偵測到)，回傳取整後的球框。"""
+        if ball_box is None:
+            return None
+        x1, y1, x2, y2 = map(int, ball_box)
+        cx = (x1 + x2) // 2
+        cy = (y1 + y2) // 2
+
+        if self.prev_center is not None and self.prev_frame_idx is not None:
+            dx = cx - self.prev_center[0]
+            dy = cy - self.prev_center[1]
+            distance_pixels = math.sqrt(dx**2 + dy**2)
+            dt = (frame_idx - self.prev_frame_idx) / self.fps
+
+            if dt > 0:
+                distance_m = distance_pixels * self.pixel_to_meter
+                speed_mps = distance_m / dt
+                speed_kmh = speed_mps * 3.6
+
+                if self.min_valid_speed_kmh <= speed_kmh <= self.max_valid_speed_kmh:
+                    self.max_speed_kmh = max(self.max_speed_kmh, speed_kmh)
+
+        self.prev_center = (cx, cy)
+        self.prev_frame_idx = frame_idx
+        return x1, y1, x2, y2
+
+
 def render_video_with_pose_and_max_ball_speed(input_video_path: str,
                                               pose_json: dict,
                                               ball_json: dict,
                                               pixel_to_meter: float = 0.04,
                                               min_valid_speed_kmh: float = 30,
-                                              max_valid_speed_kmh: float = 200) -> Tuple[str, float]:
+                                              max_valid_speed_kmh: float = 200,
+                                              key_frames: Optional[dict] = None,
+                                              profile: Optional[RenderProfile] = None,
+                                              output_dir: str = "temp_rendered_videos") -> Tuple[str, float]:
+    """
+    畫上骨架、球框與最大球速後輸出影片。profile 預設為完整影片；
+    key_frames ({"release": int, "landing": int}) 用於裁切片段。回傳的最大球速一律以整段影片計算。
+    output_dir 為輸出目錄 (分析流程傳入請求自己的暫存目錄)。
+    """
+    profile = profile or RENDER_PROFILES["full"]
+
     # Define a temporary directory for rendered videos
-    output_dir = "temp_rendered_videos"
     os.makedirs(output_dir, exist_ok=True) # Ensure this directory exists
 
     # Construct the output video path within the temporary directory
-    output_video_path = os.path.join(output_dir, f"temp_rendered_{os.path.basename(input_video_path)}")
+    prefix = "temp_rendered_" if profile.name == "full" else f"temp_rendered_{profile.name}_"
+    output_video_path = os.path.join(output_dir, f"{prefix}{os.path.basename(input_video_path)}")
 
     cap = cv2.VideoCapture(input_video_path)
     if not cap.isOpened():
@@ -100,74 +411,93 @@ def render_video_with_pose_and_max_ball_speed(input_video_path: str,
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
-    #fourcc = cv2.VideoWriter_fourcc(*'X264') # <-- 修改這一行
-    fourcc = cv2.VideoWriter_fourcc(*'avc1') # <-- 修改這一行
-    out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
-    
-    # 確保 pose_frames 和 ball_frames 被正確初始化
-    pose_frames = {f['frame_idx']: f.get('predictions', []) for f in pose_json.get('frames', [])}
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    start, end = profile.frame_window(key_frames, fps, frame_count)
+    out_width, out_height = profile.output_size(width, height)
+    scale = out_width / width if width else 1.0
+    frame_step = max(1, profile.frame_step)
+    try:
+        out = _open_video_writer(output_video_path, profile, fps / frame_step, (out_width, out_height))
+    except Exception:
+        cap.release()
+        raise
+
+    # 骨架一次轉成整數陣列，速度標籤只在數值改變時重新排版
+    pose_overlay = precompute_pose_overlay(pose_json, scale=scale)
+    speed_label = SpeedLabel(out_width, out_height)
     ball_frames = {frame_idx: box for frame_idx, box in ball_json.get('results', [])}
-
-    prev_center = None
-    prev_frame_idx = None
-    max_speed_kmh = 0
+    speed = BallSpeedTracker(fps, pixel_to_meter, min_valid_speed_kmh, max_valid_speed_kmh)
 
     frame_idx = 0
-    while True:
+    while end is None or frame_idx < end:
+        # 片段之前與抽掉的幀只前進不轉換畫面，球速照常累計
+        if frame_idx < start or (frame_idx - start) % frame_step:
+            if not cap.grab():
+                break
+            speed.update(frame_idx, ball_frames.get(frame_idx))
+            frame_idx += 1
+            continue
+
         ret, frame = cap.read()
         if not ret:
             break
-        
+        if scale != 1.0:
+            frame = cv2.resize(frame, (out_width, out_height), interpolation=cv2.INTER_AREA)
+
         # --- 畫骨架 ---
-        # 整合進來的繪圖邏輯
-        pose_predictions_for_frame = pose_frames.get(frame_idx, [])
-        if pose_predictions_for_frame:
-            pitcher_data = pose_predictions_for_frame[0]
-            # 直接呼叫本檔案內的繪圖函式
-            draw_pitcher_on_frame(frame, pitcher_data)
+        draw_pose_overlay(frame, pose_overlay, frame_idx)
 
         # --- 畫棒球 + 計算速度 ---
-        if frame_idx in ball_frames:
-            current_ball_box = ball_frames[frame_idx]
-            # 確保 current_ball_box 不是 None 才能進行 map(int, ...)
-            if current_ball_box is not None:
+        current_ball_box = ball_frames.get(frame_idx)
+        # 確保 current_ball_box 不是 None 才能進行 map(int, ...)
+        if speed.update(frame_idx, current_ball_box) is not None:
+            if scale != 1.0:
+                x1, y1, x2, y2 = (int(c * scale) for c in current_ball_box)
+            else:
                 x1, y1, x2, y2 = map(int, current_ball_box)
-                cx = (x1 + x2) // 2
-                cy = (y1 + y2) // 2
-                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                cv2.putText(frame, "Baseball", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-
-                if prev_center is not None and prev_frame_idx is not None:
-                    dx = cx - prev_center[0]
-                    dy = cy - prev_center[1]
-                    distance_pixels = math.sqrt(dx**2 + dy**2)
-                    dt = (frame_idx - prev_frame_idx) / fps
-
-                    if dt > 0:
-                        distance_m = distance_pixels * pixel_to_meter
-                        speed_mps = distance_m / dt
-                        speed_kmh = speed_mps * 3.6
-
-                        if min_valid_speed_kmh <= speed_kmh <= max_valid_speed_kmh:
-                            max_speed_kmh = max(max_speed_kmh, speed_kmh)
-
-                prev_center = (cx, cy)
-                prev_frame_idx = frame_idx
-            # 如果 current_ball_box 是 None，則跳過棒球框繪製和速度計算
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+            cv2.putText(frame, "Baseball", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        # 如果 current_ball_box 是 None，則跳過棒球框繪製和速度計算
 
         # --- 畫最大球速 ---
-        label = f"Max Speed: {max_speed_kmh:.1f} km/h"
-        cv2.rectangle(frame, (30, 30), (360, 80), (0, 0, 0), -1)  # 黑底
-        cv2.putText(frame, label, (40, 65), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)  # 白字
+        speed_label.draw(frame, speed.max_speed_kmh)
 
         out.write(frame)
         frame_idx += 1
 
     cap.release()
     out.release()
-    return output_video_path, float(np.round(max_speed_kmh,2))
 
-def save_specific_frames(input_video_path: str, frame_indices: dict) -> dict:
+    # 裁切時片段之後的球路不必解碼影片，直接由軌跡補算
+    if end is not None:
+        for later_idx in sorted(i for i in ball_frames if i >= frame_idx and (frame_count <= 0 or i < frame_count)):
+            speed.update(later_idx, ball_frames[later_idx])
+    return output_video_path, float(np.round(speed.max_speed_kmh,2))
+
+def calculate_max_ball_speed(ball_json: dict,
+                             fps: float,
+                             frame_count: int = None,
+                             pixel_to_meter: float = 0.04,
+                             min_valid_speed_kmh: float = 30,
+                             max_valid_speed_kmh: float = 200) -> float:
+    """
+    不讀影片、只由球路軌跡計算最大球速，計算方式與 render_video_with_pose_and_max_ball_speed 相同
+    (用於由保存的軌跡重新分析)。frame_count 為影片實際幀數，超出的偵測結果不列入。
+    """
+    if not fps:
+        return 0.0
+    ball_frames = {frame_idx: box for frame_idx, box in ball_json.get('results', [])}
+
+    speed = BallSpeedTracker(fps, pixel_to_meter, min_valid_speed_kmh, max_valid_speed_kmh)
+    for frame_idx in sorted(ball_frames):
+        if frame_idx < 0 or (frame_count is not None and frame_idx >= frame_count):
+            continue
+        speed.update(frame_idx, ball_frames[frame_idx])
+    return float(np.round(speed.max_speed_kmh, 2))
+
+def save_specific_frames(input_video_path: str, frame_indices: dict,
+                         output_dir: str = "temp_rendered_videos") -> dict:
     """
     從影片中儲存特定影格為圖片檔案。
     Args:
@@ -175,12 +505,12 @@ def save_specific_frames(input_video_path: str, frame_indices: dict) -> dict:
         frame_indices: 包含要儲存的影格名稱和影格編號的字典，例如
                        {"release": 100, "landing": 50, "shoulder": 70}。
                        如果影格編號為 None，則該影格不會被儲存。
+        output_dir: 圖片輸出目錄 (預設與渲染影片相同的暫存目錄)。
     Returns:
         一個字典，包含儲存的圖片路徑，例如
         {"release_frame_path": "path/to/release.jpg", ...}。
     """
     saved_image_paths = {}
-    output_dir = "temp_rendered_videos" # 使用相同的暫存目錄
     os.makedirs(output_dir, exist_ok=True)
 
     cap = cv2.VideoCapture(input_video_path)
@@ -3,6 +3,7 @@ import os
 import json
 import numpy as np
 import cv2
+from pose_stream import PoseTrack
 # landing.py
 """
 落地那一幀
@@ -251,8 +252,11 @@ def extract_pitching_biomechanics(result):
         dict: 包含 release、landing、shoulder 三幀與總長度
     """
 
-    # ✅ 先手動轉成 pose_sequence
-    pose_sequence = load_pose_from_response(result)
+    # ✅ 先手動轉成 pose_sequence (串流解析的 PoseTrack 已經是陣列，直接取用)
+    if isinstance(result, PoseTrack):
+        pose_sequence = result.to_pose_sequence()
+    else:
+        pose_sequence = load_pose_from_response(result)
     
     if not pose_sequence:
         print("❌ pose_sequence 為空")
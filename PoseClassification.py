@@ -1,4 +1,14 @@
-from typing import Dict, Tuple
+import numbers
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def is_feature_value(value) -> bool:
+    """可以納入計分的特徵值：實數 (含 NumPy 數值)，不含 None、布林與字串等其他型別。"""
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
 
 def calculate_score_from_comparison(features: dict, profile_data: dict) -> Tuple[int, Dict]:
     """
@@ -27,8 +37,8 @@ def calculate_score_from_comparison(features: dict, profile_data: dict) -> Tuple
         # 在 profile_data 中尋找對應的鍵 (轉為小寫以確保匹配)
         profile_stats = profile_data.get(key.lower())
         
-        # 如果模型中沒有這個特徵或使用者沒有此數值，則跳過
-        if not profile_stats or user_value is None:
+        # 如果模型中沒有這個特徵或使用者沒有可比較的數值，則跳過
+        if not profile_stats or not is_feature_value(user_value):
             continue
 
         mean = profile_stats.get('mean')
@@ -67,4 +77,168 @@ def calculate_score_from_comparison(features: dict, profile_data: dict) -> Tuple
     # 最終分數是所有特徵分數的平均值
     final_score = int(total_score / feature_count)
     
-    return final_score, comparison_details
\ No newline at end of file
+    return final_score, comparison_details
+
+"""
+向量化評分引擎：一次計算 N 筆特徵 × M 個基準模型的所有 Z-score 與分數
+"""
+
+@dataclass
+class ScoreMatrix:
+    """
+    calculate_score_matrix 的結果 (N = 紀錄數, M = 模型數, F = 特徵數)。
+    - z_scores / feature_scores: (N, M, F)，無法比較的位置為 NaN
+    - valid: (N, M, F) 布林遮罩，對應 calculate_score_from_comparison 中「有被納入計分」的特徵
+    - final_scores: (N, M) 整數綜合分數，沒有任何可比較特徵時為 0
+    - feature_counts: (N, M) 納入計分的特徵數
+    """
+    feature_keys: List[str]
+    z_scores: np.ndarray
+    feature_scores: np.ndarray
+    valid: np.ndarray
+    final_scores: np.ndarray
+    feature_counts: np.ndarray
+
+
+def collect_feature_keys(features_list: Sequence[dict]) -> List[str]:
+    """依首次出現順序取得所有紀錄的特徵鍵 (與單筆函式逐鍵計分的順序一致)。"""
+    keys = {}
+    for features in features_list:
+        for key in features:
+            keys.setdefault(key, None)
+    return list(keys)
+
+
+def build_feature_matrix(features_list: Sequence[dict], feature_keys: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    將多筆特徵字典轉成 (N, F) 矩陣。
+    回傳 (values, present)：缺值或不是實數 (None、布林、字串等) 的位置 present 為 False、values 為 NaN。
+    """
+    values = np.full((len(features_list), len(feature_keys)), np.nan, dtype=np.float64)
+    present = np.zeros(values.shape, dtype=bool)
+    for i, features in enumerate(features_list):
+        for j, key in enumerate(feature_keys):
+            value = features.get(key)
+            if is_feature_value(value):
+                values[i, j] = value
+                present[i, j] = True
+    return values, present
+
+
+def build_profile_matrix(profiles_data: Sequence[dict], feature_keys: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    將多個模型的 profile_data 轉成 (M, F) 的平均值與標準差矩陣。
+    與單筆函式相同，以 key.lower() 查找模型統計；缺少統計、mean 或 std 時 present 為 False。
+    回傳 (means, stds, present)。
+    """
+    shape = (len(profiles_data), len(feature_keys))
+    means = np.full(shape, np.nan, dtype=np.float64)
+    stds = np.full(shape, np.nan, dtype=np.float64)
+    present = np.zeros(shape, dtype=bool)
+    for m, profile_data in enumerate(profiles_data):
+        if not profile_data:
+            continue
+        for j, key in enumerate(feature_keys):
+            profile_stats = profile_data.get(key.lower())
+            if not profile_stats:
+                continue
+            mean = profile_stats.get('mean')
+            std = profile_stats.get('std')
+            if mean is None or std is None:
+                continue
+            means[m, j] = mean
+            stds[m, j] = std
+            present[m, j] = True
+    return means, stds, present
+
+
+def calculate_score_matrix(values: np.ndarray, means: np.ndarray, stds: np.ndarray,
+                           value_present: Optional[np.ndarray] = None,
+                           profile_present: Optional[np.ndarray] = None,
+                           feature_keys: Optional[List[str]] = None) -> ScoreMatrix:
+    """
+    以單次 NumPy 運算計算 (N, F) 特徵對 (M, F) 模型的所有分數，規則與 calculate_score_from_comparison 相同：
+    z = |x - mean| / std (std 為 0 時 z = 0)、單項分數 = max(0, 100 - 25z)、綜合分數 = int(單項平均)。
+
+    未提供 present 遮罩時以 NaN 視為缺值。
+    記憶體用量為 N × M × F 個 float64，資料量大時請由呼叫端分塊呼叫。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    means = np.asarray(means, dtype=np.float64)
+    stds = np.asarray(stds, dtype=np.float64)
+    if value_present is None:
+        value_present = ~np.isnan(values)
+    if profile_present is None:
+        profile_present = ~(np.isnan(means) | np.isnan(stds))
+
+    valid = value_present[:, None, :] & profile_present[None, :, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.abs((values[:, None, :] - means[None, :, :]) / stds[None, :, :])
+    z_scores = np.where(stds[None, :, :] == 0, 0.0, z_scores)
+    raw_scores = 100 - z_scores * 25
+    # 與 max(0, score) 相同：NaN 或非正數一律視為 0
+    feature_scores = np.where(raw_scores > 0, raw_scores, 0.0)
+
+    z_scores = np.where(valid, z_scores, np.nan)
+    feature_scores = np.where(valid, feature_scores, np.nan)
+
+    # 依特徵順序逐欄累加，確保浮點數加總順序與單筆函式完全相同
+    total = np.zeros(valid.shape[:2], dtype=np.float64)
+    for j in range(valid.shape[2]):
+        total += np.where(valid[:, :, j], feature_scores[:, :, j], 0.0)
+    counts = valid.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        final_scores = np.where(counts > 0, total / np.maximum(counts, 1), 0.0).astype(np.int64)
+
+    return ScoreMatrix(
+        feature_keys=list(feature_keys) if feature_keys is not None else [],
+        z_scores=z_scores,
+        feature_scores=feature_scores,
+        valid=valid,
+        final_scores=final_scores,
+        feature_counts=counts,
+    )
+
+
+def score_records_against_profiles(features_list: Sequence[dict], profiles_data: Sequence[dict]) -> ScoreMatrix:
+    """從特徵字典與 profile_data 直接建立矩陣並計分。"""
+    feature_keys = collect_feature_keys(features_list)
+    values, value_present = build_feature_matrix(features_list, feature_keys)
+    means, stds, profile_present = build_profile_matrix(profiles_data, feature_keys)
+    return calculate_score_matrix(values, means, stds, value_present, profile_present, feature_keys)
+
+
+def comparison_details_from_matrix(result: ScoreMatrix, features: dict, profile_data: dict,
+                                   record_index: int, profile_index: int) -> Tuple[int, Dict]:
+    """
+    從矩陣結果還原單筆 (紀錄, 模型) 的 (final_score, comparison_details)，
+    輸出與 calculate_score_from_comparison(features, profile_data) 相同。
+    """
+    valid = result.valid[record_index, profile_index]
+    if not valid.any():
+        return 0, {}
+    details = {}
+    for j in np.flatnonzero(valid):
+        key = result.feature_keys[j]
+        profile_stats = profile_data[key.lower()]
+        details[key] = {
+            "user_value": features[key],
+            "mean": profile_stats.get('mean'),
+            "std": profile_stats.get('std'),
+            "z_score": float(result.z_scores[record_index, profile_index, j]),
+            "score": int(result.feature_scores[record_index, profile_index, j])
+        }
+    return int(result.final_scores[record_index, profile_index]), details
+
+
+def calculate_scores_from_comparison_batch(features_list: Sequence[dict], profiles_data: Sequence[dict]) -> List[List[Tuple[int, Dict]]]:
+    """
+    calculate_score_from_comparison 的批次版本：回傳 results[i][m] = 第 i 筆特徵對第 m 個模型的結果。
+    只需要分數時請直接使用 score_records_against_profiles 以省去組裝明細字典的成本。
+    """
+    result = score_records_against_profiles(features_list, profiles_data)
+    return [
+        [comparison_details_from_matrix(result, features, profile_data, i, m)
+         for m, profile_data in enumerate(profiles_data)]
+        for i, features in enumerate(features_list)
+    ]
@@ -0,0 +1,149 @@
+# 檔案: admission.py
+# 職責: 分析請求的准入控制 (admission control)：依上傳大小估計記憶體成本，在並行數與記憶體預算內才開始分析。
+#
+#   每支分析同時持有多份影片位元組 (Pose / Ball 各一份、代理影片) 與 OpenCV 解碼 / 編碼緩衝，
+#   原本沒有任何上限，一波上傳就會讓容器 OOM。
+#   - 成本估計：固定開銷 + 上傳大小 × 倍數 (單一請求的成本最多視為整個預算，避免永遠排不到)
+#   - 並行數與記憶體預算都有餘裕才放行 (admitted)，否則依到達順序排隊 (queued)
+#   - 排隊已滿或排隊超過 queue_timeout_s 就拒絕 (AdmissionRejected，API 回 429 + Retry-After)
+#   Retry-After 以近期每支分析的平均耗時 × (排隊數 + 1) / 並行上限估計。
+#   一般以 async with admit(...) 包住分析；名額要跨過回應邊界 (串流回應) 時用 acquire() 取得 AdmissionSlot，
+#   由串流結束時 release()。
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, List
+
+from metrics import Counter, Gauge
+
+DECISIONS = Counter("admission_requests_total",
+                    "准入控制的結果 (admitted = 直接放行, queued = 需要排隊, rejected = 拒絕)",
+                    ("controller", "decision"))
+ACTIVE = Gauge("admission_active", "執行中的請求數", ("controller",))
+QUEUED = Gauge("admission_queue_depth", "排隊中的請求數", ("controller",))
+RESERVED_BYTES = Gauge("admission_reserved_bytes", "執行中請求的估計記憶體總和", ("controller",))
+
+
+class AdmissionRejected(Exception):
+    """排隊已滿或等待逾時。retry_after 為建議的重試秒數。"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"伺服器忙碌中 ({reason})，約 {retry_after:.0f} 秒後再試")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionSlot:
+    """已放行的名額。release() 可以重複呼叫，只會歸還一次。"""
+
+    def __init__(self, controller: "AdmissionController", cost: int):
+        self._controller = controller
+        self._cost = cost
+        self._start = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        controller = self._controller
+        controller._avg_hold_s = 0.8 * controller._avg_hold_s + 0.2 * (time.monotonic() - self._start)
+        controller._release(self._cost)
+
+
+class AdmissionController:
+    def __init__(self, name: str, max_concurrency: int, memory_budget_bytes: int, max_queue: int,
+                 queue_timeout_s: float, base_cost_bytes: int, cost_per_upload_byte: float):
+        self.name = name
+        self.max_concurrency = max_concurrency          # 0 代表不限
+        self.memory_budget_bytes = memory_budget_bytes  # 0 代表不限
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s          # 0 代表不限
+        self.base_cost_bytes = base_cost_bytes
+        self.cost_per_upload_byte = cost_per_upload_byte
+        self.active = 0
+        self.reserved_bytes = 0
+        self._waiters: Deque[List] = deque()            # [成本, future]
+        self._avg_hold_s = 10.0                         # 每支分析耗時的指數移動平均 (初始值為粗估)
+
+    def estimate_cost(self, upload_bytes: int) -> int:
+        cost = int(self.base_cost_bytes + self.cost_per_upload_byte * upload_bytes)
+        return min(cost, self.memory_budget_bytes) if self.memory_budget_bytes > 0 else cost
+
+    def retry_after(self) -> float:
+        slots = self.max_concurrency if self.max_concurrency > 0 else max(1, self.active)
+        return max(1.0, math.ceil(self._avg_hold_s * (len(self._waiters) + 1) / slots))
+
+    def _fits(self, cost: int) -> bool:
+        if self.max_concurrency > 0 and self.active >= self.max_concurrency:
+            return False
+        return self.memory_budget_bytes <= 0 or self.reserved_bytes + cost <= self.memory_budget_bytes
+
+    def _update_gauges(self):
+        ACTIVE.set(self.active, controller=self.name)
+        QUEUED.set(len(self._waiters), controller=self.name)
+        RESERVED_BYTES.set(self.reserved_bytes, controller=self.name)
+
+    def _acquire(self, cost: int):
+        self.active += 1
+        self.reserved_bytes += cost
+
+    def _release(self, cost: int):
+        self.active -= 1
+        self.reserved_bytes -= cost
+        self._wake()
+
+    def _wake(self):
+        # 依到達順序放行，排頭放不下就停 (避免大檔案一直被小檔案插隊)
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, future = self._waiters.popleft()
+            self._acquire(cost)
+            future.set_result(None)
+        self._update_gauges()
+
+    def _abandon(self, waiter: List):
+        cost, future = waiter
+        if future.done():
+            # 已經被放行才取消：歸還名額
+            self._release(cost)
+            return
+        future.cancel()
+        self._waiters.remove(waiter)
+        self._wake()
+
+    async def acquire(self, upload_bytes: int) -> AdmissionSlot:
+        """等到放行後回傳名額 (呼叫端負責 release)；排隊已滿或逾時拋出 AdmissionRejected。"""
+        cost = self.estimate_cost(upload_bytes)
+        if not self._waiters and self._fits(cost):
+            self._acquire(cost)
+            self._update_gauges()
+            DECISIONS.inc(controller=self.name, decision="admitted")
+        else:
+            if len(self._waiters) >= self.max_queue:
+                DECISIONS.inc(controller=self.name, decision="rejected")
+                raise AdmissionRejected("排隊已滿", self.retry_after())
+            waiter = [cost, asyncio.get_running_loop().create_future()]
+            self._waiters.append(waiter)
+            self._update_gauges()
+            DECISIONS.inc(controller=self.name, decision="queued")
+            try:
+                await asyncio.wait({waiter[1]}, timeout=self.queue_timeout_s or None)
+            except BaseException:
+                self._abandon(waiter)
+                raise
+            if not waiter[1].done():
+                self._abandon(waiter)
+                DECISIONS.inc(controller=self.name, decision="rejected")
+                raise AdmissionRejected("排隊逾時", self.retry_after())
+        return AdmissionSlot(self, cost)
+
+    @asynccontextmanager
+    async def admit(self, upload_bytes: int):
+        slot = await self.acquire(upload_bytes)
+        try:
+            yield
+        finally:
+            slot.release()
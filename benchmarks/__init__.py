@@ -0,0 +1,6 @@
+# 職責: 效能基準測試套件 (合成資料產生器 + 計時器 + 基準線比較)。
+#
+# 使用方式 (於專案根目錄執行):
+#   python -m benchmarks.run_benchmarks --quick
+#   python -m benchmarks.run_benchmarks --save-baseline benchmarks/results/baseline.json
+#   python -m benchmarks.run_benchmarks --baseline benchmarks/results/baseline.json --threshold 0.2
@@ -0,0 +1,236 @@
+# 職責: 產生與外部 API 回傳格式一致的合成資料，供基準測試使用 (不需連網、不需資料庫)。
+
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 常用的影片長度 (幀數) 與解析度組合
+FRAME_COUNTS = [120, 300, 600]
+RESOLUTIONS = [(640, 360), (1280, 720), (1920, 1080)]
+
+# 一次投球動作在整段影片中所佔的比例 (前後為靜止的準備 / 收尾畫面)
+MOTION_START_RATIO = 0.3
+MOTION_END_RATIO = 0.7
+
+FEATURE_NAMES = [
+    "Trunk_flexion_excursion",
+    "Pelvis_obliquity_at_FC",
+    "Trunk_rotation_at_BR",
+    "Shoulder_abduction_at_BR",
+    "Trunk_flexion_at_BR",
+    "Trunk_lateral_flexion_at_HS",
+]
+
+
+def _motion_phase(frame_idx: int, n_frames: int) -> float:
+    """回傳 0~1 的投球動作進度；動作區間以外固定為 0 或 1。"""
+    start = n_frames * MOTION_START_RATIO
+    end = n_frames * MOTION_END_RATIO
+    if frame_idx <= start:
+        return 0.0
+    if frame_idx >= end:
+        return 1.0
+    return (frame_idx - start) / (end - start)
+
+
+def synthetic_keypoints(frame_idx: int, n_frames: int, width: int, height: int,
+                        rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    產生一幀右投投手的 COCO-17 關節點 (17, 2)。
+    右手以右肩為圓心由身體後下方 (約 200 度) 甩到前下方 (約 -60 度)，
+    中途會經過「手腕高於肩膀、手肘在手腕後方」的出手條件，讓 KinematicsModule 的偵測邏輯能找到關鍵幀。
+    """
+    phase = _motion_phase(frame_idx, n_frames)
+    body_h = height * 0.6
+    cx = width * 0.45 + phase * width * 0.05
+    hip_y = height * 0.6
+
+    open_ratio = 0.5 + 0.5 * math.sin(phase * math.pi)  # 動作中段肩膀最開
+    shoulder_y = hip_y - body_h * (0.35 - 0.05 * phase)  # 出手後軀幹前傾
+    ls = (cx - body_h * 0.08 * open_ratio, shoulder_y + body_h * 0.01)
+    rs = (cx + body_h * 0.08 * open_ratio, shoulder_y)
+
+    arm_len = body_h * 0.32
+    wrist_angle = math.radians(200 - 260 * phase)
+    elbow_angle = math.radians(200 - 260 * max(0.0, phase - 0.08))
+    re = (rs[0] + 0.5 * arm_len * math.cos(elbow_angle), rs[1] - 0.5 * arm_len * math.sin(elbow_angle))
+    rw = (rs[0] + arm_len * math.cos(wrist_angle), rs[1] - arm_len * math.sin(wrist_angle))
+    le = (ls[0] - body_h * 0.06, ls[1] + body_h * 0.12)
+    lw = (ls[0] - body_h * 0.02, ls[1] + body_h * 0.22)
+
+    lh = (cx - body_h * 0.06, hip_y + body_h * 0.01 * phase)
+    rh = (cx + body_h * 0.06, hip_y)
+    stride = body_h * 0.25 * phase
+    lk = (lh[0] - stride * 0.5, hip_y + body_h * 0.22)
+    rk = (rh[0], hip_y + body_h * 0.22)
+    la = (lh[0] - stride, hip_y + body_h * 0.45)
+    ra = (rh[0], hip_y + body_h * 0.45)
+
+    head_y = shoulder_y - body_h * 0.12
+    nose = (cx, head_y)
+    l_eye, r_eye = (cx - body_h * 0.015, head_y - body_h * 0.01), (cx + body_h * 0.015, head_y - body_h * 0.01)
+    l_ear, r_ear = (cx - body_h * 0.035, head_y), (cx + body_h * 0.035, head_y)
+
+    points = np.array([nose, l_eye, r_eye, l_ear, r_ear, ls, rs, le, re, lw, rw,
+                       lh, rh, lk, rk, la, ra], dtype=np.float64)
+    if rng is not None:
+        points += rng.normal(0.0, height * 0.002, size=points.shape)
+    return points
+
+
+def make_pose_json(n_frames: int, width: int = 1280, height: int = 720, seed: int = 0,
+                   extra_predictions: int = 1) -> Dict:
+    """
+    產生 MMPose 風格的 POSE API 回傳內容：
+    {"frames": [{"frame_idx": int, "predictions": [{"keypoints", "keypoint_scores", "bbox", "bbox_score"}, ...]}]}
+    extra_predictions 會在每幀加入額外 (非投手) 的人物，模擬真實畫面中的捕手 / 打者。
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(n_frames):
+        kpts = synthetic_keypoints(i, n_frames, width, height, rng)
+        scores = np.clip(rng.normal(0.85, 0.08, size=17), 0.0, 1.0)
+        x1, y1 = kpts.min(axis=0) - 10
+        x2, y2 = kpts.max(axis=0) + 10
+        predictions = [{
+            "keypoints": kpts.round(2).tolist(),
+            "keypoint_scores": scores.round(4).tolist(),
+            "bbox": [[float(x1), float(y1), float(x2), float(y2)]],
+            "bbox_score": 0.95,
+        }]
+        for j in range(extra_predictions):
+            other = kpts + np.array([width * 0.25 * (j + 1), 0.0])
+            predictions.append({
+                "keypoints": other.round(2).tolist(),
+                "keypoint_scores": (scores * 0.7).round(4).tolist(),
+                "bbox": [[float(x1 + width * 0.25), float(y1), float(x2 + width * 0.25), float(y2)]],
+                "bbox_score": 0.6,
+            })
+        frames.append({"frame_idx": i, "predictions": predictions})
+    return {"frames": frames}
+
+
+def make_ball_json(n_frames: int, width: int = 1280, height: int = 720, seed: int = 0,
+                   pitch_type: str = "FF") -> Dict:
+    """
+    產生 BALL API 回傳內容：{"results": [[frame_idx, [x1, y1, x2, y2] 或 None], ...], "predicted_pitch_type": str}
+    球在動作後段出現並由左往右飛行，其餘幀為 None。
+    """
+    rng = np.random.default_rng(seed)
+    results: List[list] = []
+    flight_start = int(n_frames * (MOTION_START_RATIO + 0.75 * (MOTION_END_RATIO - MOTION_START_RATIO)))
+    flight_len = max(10, n_frames // 10)
+    size = max(6.0, height * 0.012)
+    for i in range(n_frames):
+        t = i - flight_start
+        if 0 <= t < flight_len and rng.random() > 0.1:
+            cx = width * 0.55 + t * width * 0.4 / flight_len
+            cy = height * 0.35 + t * height * 0.1 / flight_len
+            results.append([i, [cx - size, cy - size, cx + size, cy + size]])
+        else:
+            results.append([i, None])
+    return {"results": results, "predicted_pitch_type": pitch_type}
+
+
+def make_profile_data(seed: int = 0, include_frames: bool = False) -> Dict:
+    """產生與 pitch_model.profile_data 同結構的基準模型 (鍵值為小寫特徵名)。"""
+    rng = np.random.default_rng(seed)
+    names = list(FEATURE_NAMES)
+    if include_frames:
+        names += ["release_frame", "landing_frame", "shoulder_frame", "total_frames"]
+    profile = {}
+    for name in names:
+        mean = float(rng.normal(0, 50))
+        std = float(abs(rng.normal(10, 3)))
+        profile[name.lower()] = {
+            "mean": mean,
+            "std": std,
+            "min": mean - 3 * std,
+            "max": mean + 3 * std,
+            "p10": mean - 1.28 * std,
+            "p50_median": mean,
+            "p90": mean + 1.28 * std,
+        }
+    return profile
+
+
+def make_features(seed: int = 0) -> Dict:
+    """產生與 extract_pitching_biomechanics 輸出同結構的特徵字典。"""
+    rng = np.random.default_rng(seed)
+    features = {
+        "release_frame": int(rng.integers(100, 200)),
+        "landing_frame": int(rng.integers(80, 100)),
+        "shoulder_frame": int(rng.integers(60, 80)),
+        "total_frames": 300,
+    }
+    for name in FEATURE_NAMES:
+        features[name] = float(rng.normal(0, 60))
+    return features
+
+
+def make_video(path: str, n_frames: int, width: int, height: int, fps: float = 30.0,
+               seed: int = 0) -> str:
+    """
+    以 OpenCV 寫出一段合成 MP4：帶雜訊的背景上畫出與 make_pose_json 相同的投手動作，
+    前後段靜止、中段有動作，讓解碼 / 繪圖 / 動作偵測等步驟都有接近真實的負載。
+    """
+    import cv2
+
+    from Drawingfunction import SKELETON_CONNECTIONS
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"無法建立合成影片：{path}")
+
+    background = rng.integers(40, 90, size=(height, width, 3), dtype=np.uint8)
+    thickness = max(2, height // 120)
+    for i in range(n_frames):
+        frame = background.copy()
+        kpts = synthetic_keypoints(i, n_frames, width, height).astype(np.int32)
+        for p1, p2 in SKELETON_CONNECTIONS:
+            cv2.line(frame, tuple(int(v) for v in kpts[p1]), tuple(int(v) for v in kpts[p2]),
+                     (220, 220, 220), thickness)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def make_session_video(path: str, n_pitches: int, pitch_frames: int = 90, gap_frames: int = 150,
+                       width: int = 640, height: int = 360, fps: float = 30.0, seed: int = 0) -> str:
+    """
+    合成一段牛棚練投影片：n_pitches 次與 make_video 相同的投球動作，每次之後靜止 gap_frames 幀。
+    第 i 次投球的動作區間為 i * (pitch_frames + gap_frames) 加上 pitch_frames 的 30%~70%。
+    """
+    import cv2
+
+    from Drawingfunction import SKELETON_CONNECTIONS
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"無法建立合成影片：{path}")
+
+    background = rng.integers(40, 90, size=(height, width, 3), dtype=np.uint8)
+    thickness = max(2, height // 120)
+    for _ in range(n_pitches):
+        for i in range(pitch_frames + gap_frames):
+            frame = background.copy()
+            kpts = synthetic_keypoints(min(i, pitch_frames - 1), pitch_frames, width, height).astype(np.int32)
+            for p1, p2 in SKELETON_CONNECTIONS:
+                cv2.line(frame, tuple(int(v) for v in kpts[p1]), tuple(int(v) for v in kpts[p2]),
+                         (220, 220, 220), thickness)
+            writer.write(frame)
+    writer.release()
+    return path
+
+
+def video_matrix(quick: bool = False) -> List[Tuple[int, Tuple[int, int]]]:
+    """回傳要測試的 (幀數, 解析度) 組合；quick 模式只跑最小的組合。"""
+    if quick:
+        return [(FRAME_COUNTS[0], RESOLUTIONS[0])]
+    return [(n, res) for n in FRAME_COUNTS for res in RESOLUTIONS]
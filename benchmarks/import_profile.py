@@ -0,0 +1,60 @@
+# 職責: 匯入時間分析。以 python -X importtime 在新的行程中匯入指定模組 (預設 main)，列出累計耗時最多的模組，
+#       找出冷啟動時不必要的重量級匯入 (例如 sklearn / pandas / google.cloud.storage)。
+#
+#   python -m benchmarks.import_profile                 # 匯入 main 的前 25 名
+#   python -m benchmarks.import_profile --module services --top 40 --direct
+#
+#   cumulative 包含子模組；--direct 只列出目標模組直接匯入的模組 (逐一檢查哪一行 import 最貴)。
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_imports(module: str) -> List[Tuple[str, int, int, int]]:
+    """回傳 [(模組, 自身微秒, 累計微秒, 層級)]，順序與 -X importtime 的輸出相同。"""
+    env = {**os.environ}
+    # crud / database 在匯入時需要 DATABASE_URL
+    env.setdefault("DATABASE_URL", "sqlite://")
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"匯入 {module} 失敗:\n{completed.stderr[-2000:]}")
+    rows = []
+    for line in completed.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="列出匯入時累計耗時最多的模組")
+    parser.add_argument("--module", default="main", help="要匯入的模組 (預設 main)")
+    parser.add_argument("--top", type=int, default=25, help="列出前幾名")
+    parser.add_argument("--direct", action="store_true", help="只列出目標模組直接匯入的模組")
+    args = parser.parse_args(argv)
+
+    rows = profile_imports(args.module)
+    total_us = next((cumulative for name, _, cumulative, _ in rows if name == args.module), 0)
+    if args.direct:
+        rows = [row for row in rows if row[3] == 1]
+    rows.sort(key=lambda row: row[2], reverse=True)
+
+    print(f"匯入 {args.module} 共 {total_us / 1e6:.3f} 秒")
+    print(f"{'累計 (ms)':>10} {'自身 (ms)':>10}  模組")
+    for name, self_us, cumulative_us, _ in rows[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f} {self_us / 1000:10.1f}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# 職責: 端到端壓力測試產生器，對執行中的後端送出並行請求，回報每個端點的吞吐量與 p50 / p95 / p99 延遲。
+#
+# 離線完整流程 (替身推論服務 + SQLite + 本機儲存)：
+#   python -m benchmarks.stub_services --port 8001 &
+#   export POSE_API_URL=http://127.0.0.1:8001/pose_video BALL_API_URL=http://127.0.0.1:8001/predict
+#   export DATABASE_URL=sqlite:///loadtest.db STORAGE_BACKEND=local
+#   python -c "from database import Base, engine; Base.metadata.create_all(engine)"
+#   python main.py &
+#   python -m benchmarks.load_test --base-url http://127.0.0.1:9000 --concurrency 8 --requests 200 \
+#       --mix analyze=1,history=3,models=1
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """線性內插百分位數 (與 numpy.percentile 預設一致)，避免壓測工具依賴 numpy。"""
+    if not sorted_values:
+        return float("nan")
+    k = (len(sorted_values) - 1) * p / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+# --- 端點定義：每個函式送出一次請求並回傳 httpx.Response ---
+
+async def _analyze(client: httpx.AsyncClient, args, video_bytes: bytes) -> httpx.Response:
+    files = {"video_file": (os.path.basename(args.video or "loadtest.mp4"), video_bytes, "video/mp4")}
+    data = {"player_name": args.player_name, "benchmark_name": args.benchmark_name,
+            "compare_average": str(args.compare_average).lower()}
+    return await client.post("/analyze-pitch/", files=files, data=data)
+
+
+async def _batch(client: httpx.AsyncClient, args, video_bytes: bytes) -> httpx.Response:
+    files = [("video_files", (f"loadtest_{i}.mp4", video_bytes, "video/mp4")) for i in range(args.batch_size)]
+    data = {"player_name": args.player_name, "benchmark_name": args.benchmark_name,
+            "compare_average": str(args.compare_average).lower()}
+    # NDJSON 串流回應：讀完整個串流才算一次請求完成
+    async with client.stream("POST", "/analyze-pitch/batch/", files=files, data=data) as response:
+        await response.aread()
+    return response
+
+
+async def _history(client: httpx.AsyncClient, args, video_bytes: bytes) -> httpx.Response:
+    return await client.get("/history/", params={"player_name": args.player_name})
+
+
+async def _models(client: httpx.AsyncClient, args, video_bytes: bytes) -> httpx.Response:
+    return await client.get("/models/")
+
+
+ENDPOINTS: Dict[str, Callable[[httpx.AsyncClient, argparse.Namespace, bytes], Awaitable[httpx.Response]]] = {
+    "analyze": _analyze,
+    "batch": _batch,
+    "history": _history,
+    "models": _models,
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"未知的端點 '{name}'，可用：{', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def run_load(args, video_bytes: bytes) -> Dict:
+    weights = parse_mix(args.mix)
+    names, probs = list(weights), list(weights.values())
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    rng = random.Random(args.seed)
+    remaining = args.requests
+    deadline = time.monotonic() + args.duration if args.duration else None
+
+    def take_ticket() -> bool:
+        nonlocal remaining
+        if deadline is not None:
+            return time.monotonic() < deadline
+        if remaining <= 0:
+            return False
+        remaining -= 1
+        return True
+
+    async def worker(client: httpx.AsyncClient):
+        while take_ticket():
+            name = rng.choices(names, probs)[0]
+            start = time.perf_counter()
+            try:
+                response = await ENDPOINTS[name](client, args, video_bytes)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies[name].append(time.perf_counter() - start)
+            statuses[name][status] += 1
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        wall = time.perf_counter() - wall_start
+
+    report = {"concurrency": args.concurrency, "wall_s": wall, "endpoints": {}}
+    total = 0
+    for name, values in latencies.items():
+        values.sort()
+        total += len(values)
+        ok = sum(c for s, c in statuses[name].items() if s.startswith("2"))
+        report["endpoints"][name] = {
+            "requests": len(values),
+            "ok": ok,
+            "statuses": dict(statuses[name]),
+            "throughput_rps": len(values) / wall if wall else 0.0,
+            "p50_s": percentile(values, 50),
+            "p95_s": percentile(values, 95),
+            "p99_s": percentile(values, 99),
+            "max_s": values[-1],
+        }
+    report["total_requests"] = total
+    report["throughput_rps"] = total / wall if wall else 0.0
+    return report
+
+
+def _load_video(args) -> bytes:
+    if args.video:
+        with open(args.video, "rb") as f:
+            return f.read()
+    # 未指定影片時產生一段合成影片
+    from benchmarks import fixtures
+    with tempfile.TemporaryDirectory() as tmp:
+        path = fixtures.make_video(os.path.join(tmp, "loadtest.mp4"), args.frames, 1280, 720)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="後端端到端壓力測試")
+    parser.add_argument("--base-url", default="http://127.0.0.1:9000")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50, help="總請求數 (與 --duration 擇一)")
+    parser.add_argument("--duration", type=float, default=None, help="持續秒數")
+    parser.add_argument("--mix", default="analyze=1", help="端點與權重，例如 analyze=1,history=3")
+    parser.add_argument("--video", help="要上傳的影片；未指定則產生合成影片")
+    parser.add_argument("--frames", type=int, default=300, help="合成影片的幀數")
+    parser.add_argument("--batch-size", type=int, default=10, help="batch 端點每次上傳的影片數")
+    parser.add_argument("--player-name", default="loadtest_player")
+    parser.add_argument("--benchmark-name", default="")
+    parser.add_argument("--compare-average", action="store_true")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", help="將報告寫成 JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(args, _load_video(args)))
+
+    print(f"總請求 {report['total_requests']}，耗時 {report['wall_s']:.1f}s，"
+          f"吞吐量 {report['throughput_rps']:.2f} req/s (並行 {args.concurrency})")
+    for name, r in report["endpoints"].items():
+        print(f"  {name:<10} n={r['requests']:<5} ok={r['ok']:<5} {r['throughput_rps']:.2f} req/s  "
+              f"p50={r['p50_s'] * 1000:.0f}ms p95={r['p95_s'] * 1000:.0f}ms p99={r['p99_s'] * 1000:.0f}ms  "
+              f"{r['statuses']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+# 職責: 執行所有基準測試案例，輸出機器可讀的 JSON 結果，並可與已儲存的基準線比較、在效能退步時失敗。
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 讓 `python benchmarks/run_benchmarks.py` 與 `python -m benchmarks.run_benchmarks` 都能匯入專案模組
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+# crud / database 在匯入時需要 DATABASE_URL；基準測試只使用自建的 SQLite 記憶體資料庫
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from benchmarks import fixtures  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(REPO_ROOT, "benchmarks", "results", "latest.json")
+DEFAULT_THRESHOLD = 0.20
+
+# 每個案例產生器回傳 (case_id, params, setup, fn, inner_loops)
+# setup 會在計時前執行一次並把回傳值交給 fn；inner_loops 用於極短的函式以降低計時誤差
+# 需要額外計算的 params (例如準確度比較) 由 setup 填入，--filter 排除的案例不會執行
+CaseSpec = Tuple[str, Dict, Callable[[], object], Callable[[object], object], int]
+CASE_GENERATORS: List[Callable[[argparse.Namespace, str], Iterator[CaseSpec]]] = []
+
+
+def benchmark_case(func):
+    """註冊一個案例產生器。"""
+    CASE_GENERATORS.append(func)
+    return func
+
+
+@contextmanager
+def working_directory(path: str):
+    """暫時切換工作目錄 (渲染函式會把輸出寫到相對路徑 temp_rendered_videos/)。"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _video_path(workdir: str, n_frames: int, width: int, height: int) -> str:
+    """取得 (必要時產生) 指定規格的合成影片，同一次執行中重複使用。"""
+    path = os.path.join(workdir, "fixtures", f"synthetic_{n_frames}f_{width}x{height}.mp4")
+    if not os.path.exists(path):
+        fixtures.make_video(path, n_frames, width, height)
+    return path
+
+
+# --- 案例定義 ---
+
+@benchmark_case
+def kinematics_cases(args, workdir):
+    from KinematicsModule import extract_pitching_biomechanics
+
+    for n in fixtures.FRAME_COUNTS[:1] if args.quick else fixtures.FRAME_COUNTS:
+        yield (f"kinematics.extract_pitching_biomechanics[{n}f]", {"frames": n},
+               lambda n=n: fixtures.make_pose_json(n),
+               extract_pitching_biomechanics, 1)
+
+
+@benchmark_case
+def ball_cases(args, workdir):
+    import joblib
+    from BallClassification import classify_ball_quality
+
+    model = joblib.load(os.path.join(REPO_ROOT, "random_forest_model.pkl"))
+    for n in fixtures.FRAME_COUNTS[:1] if args.quick else fixtures.FRAME_COUNTS:
+        yield (f"ball.classify_ball_quality[{n}f]", {"frames": n},
+               lambda n=n: fixtures.make_ball_json(n),
+               lambda ball_json: classify_ball_quality(ball_json, model), 5)
+
+
+@benchmark_case
+def pose_score_cases(args, workdir):
+    from PoseClassification import calculate_score_from_comparison
+
+    yield ("pose.calculate_score_from_comparison", {},
+           lambda: (fixtures.make_features(), fixtures.make_profile_data(include_frames=True)),
+           lambda data: calculate_score_from_comparison(data[0], data[1]), 2000)
+
+
+@benchmark_case
+def pose_score_matrix_cases(args, workdir):
+    from PoseClassification import calculate_score_from_comparison, score_records_against_profiles
+
+    n_records, n_profiles = (200, 50) if args.quick else (1000, 200)
+    params = {"records": n_records, "profiles": n_profiles}
+
+    def setup():
+        return ([fixtures.make_features(seed=i) for i in range(n_records)],
+                [fixtures.make_profile_data(seed=m) for m in range(n_profiles)])
+
+    def python_loop(data):
+        return [[calculate_score_from_comparison(f, p)[0] for p in data[1]] for f in data[0]]
+
+    yield (f"pose.score_loop[{n_records}x{n_profiles}]", params, setup, python_loop, 1)
+    yield (f"pose.score_matrix[{n_records}x{n_profiles}]", params, setup,
+           lambda data: score_records_against_profiles(data[0], data[1]).final_scores, 1)
+
+
+def _peak_memory_kib(fn, data) -> int:
+    """以 tracemalloc 量測單次呼叫期間 Python 配置記憶體的峰值 (不含輸入本身)。"""
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        fn(data)
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+@benchmark_case
+def pose_parse_cases(args, workdir):
+    import json
+
+    from KinematicsModule import load_pose_from_response
+    from pose_stream import parse_pose_bytes
+
+    # 長片段 (60 fps 約 30 秒) 才看得出完整解析與串流解析的差距
+    for n in (120,) if args.quick else (600, 1800):
+        body = json.dumps(fixtures.make_pose_json(n, extra_predictions=2)).encode("utf-8")
+
+        def current(data):
+            # 目前的路徑：response.json() 建出整棵物件樹，再逐幀轉成陣列
+            return load_pose_from_response(json.loads(data))
+
+        def streaming(data, n=n):
+            return parse_pose_bytes(data, expected_frames=n)
+
+        for name, fn in (("json", current), ("stream", streaming)):
+            params = {"frames": n, "body_bytes": len(body), "peak_kib": _peak_memory_kib(fn, body)}
+            yield (f"pose.parse_response_{name}[{n}f]", params, lambda body=body: body, fn, 3)
+
+
+@benchmark_case
+def render_cases(args, workdir):
+    from Drawingfunction import render_video_with_pose_and_max_ball_speed
+
+    for n, (w, h) in fixtures.video_matrix(args.quick):
+        def setup(n=n, w=w, h=h):
+            return (_video_path(workdir, n, w, h),
+                    fixtures.make_pose_json(n, w, h), fixtures.make_ball_json(n, w, h))
+
+        yield (f"render.render_video_with_pose_and_max_ball_speed[{n}f@{w}x{h}]",
+               {"frames": n, "width": w, "height": h}, setup,
+               lambda data: render_video_with_pose_and_max_ball_speed(data[0], data[1], data[2]), 1)
+
+
+@benchmark_case
+def overlay_cases(args, workdir):
+    """只比較逐幀繪製骨架與球速標籤 (不含影片解碼 / 編碼)。"""
+    import cv2
+    import numpy as np
+    from Drawingfunction import SpeedLabel, draw_pitcher_on_frame, draw_pose_overlay, precompute_pose_overlay
+
+    for n, (w, h) in fixtures.video_matrix(args.quick):
+        def setup(n=n, w=w, h=h):
+            pose_json = fixtures.make_pose_json(n, w, h)
+            return np.zeros((h, w, 3), dtype=np.uint8), pose_json, n
+
+        def per_frame(data):
+            frame, pose_json, n_frames = data
+            pose_frames = {f["frame_idx"]: f.get("predictions", []) for f in pose_json["frames"]}
+            for frame_idx in range(n_frames):
+                predictions = pose_frames.get(frame_idx)
+                if predictions:
+                    draw_pitcher_on_frame(frame, predictions[0])
+                cv2.rectangle(frame, (30, 30), (360, 80), (0, 0, 0), -1)
+                cv2.putText(frame, "Max Speed: 123.4 km/h", (40, 65), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+
+        def precomputed(data):
+            frame, pose_json, n_frames = data
+            overlay = precompute_pose_overlay(pose_json)
+            label = SpeedLabel(frame.shape[1], frame.shape[0])
+            for frame_idx in range(n_frames):
+                draw_pose_overlay(frame, overlay, frame_idx)
+                label.draw(frame, 123.4)
+
+        params = {"frames": n, "width": w, "height": h}
+        yield (f"render.overlay_per_frame[{n}f@{w}x{h}]", params, setup, per_frame, 1)
+        yield (f"render.overlay_precomputed[{n}f@{w}x{h}]", params, setup, precomputed, 1)
+
+
+@benchmark_case
+def keyframe_cases(args, workdir):
+    from Drawingfunction import save_specific_frames
+
+    for n, (w, h) in fixtures.video_matrix(args.quick):
+        indices = {"release": int(n * 0.6), "landing": int(n * 0.55), "shoulder": int(n * 0.5)}
+        yield (f"render.save_specific_frames[{n}f@{w}x{h}]",
+               {"frames": n, "width": w, "height": h},
+               lambda n=n, w=w, h=h: _video_path(workdir, n, w, h),
+               lambda path, indices=indices: save_specific_frames(path, indices), 1)
+
+
+@benchmark_case
+def packaging_cases(args, workdir):
+    import shutil
+    from mp4_packaging import make_faststart, segment_hls
+
+    def faststart_copy(path):
+        # faststart 會就地改寫檔案，每次計時都從原始合成影片複製一份 (含複製時間)
+        target = path + ".faststart.mp4"
+        shutil.copyfile(path, target)
+        return make_faststart(target)
+
+    for n, (w, h) in fixtures.video_matrix(args.quick):
+        params = {"frames": n, "width": w, "height": h}
+        yield (f"packaging.faststart[{n}f@{w}x{h}]", params,
+               lambda n=n, w=w, h=h: _video_path(workdir, n, w, h), faststart_copy, 1)
+        yield (f"packaging.segment_hls[{n}f@{w}x{h}]", params,
+               lambda n=n, w=w, h=h: _video_path(workdir, n, w, h),
+               lambda path: segment_hls(path, path + "_hls"), 1)
+
+
+@benchmark_case
+def motion_window_cases(args, workdir):
+    """
+    動作區間偵測的耗時，以及只送區間時與整段分析的差異 (記在 params)：
+    區間外的骨架 / 球框視為沒有送去推論，比較關鍵幀、運動學特徵與最大球速。
+    """
+    import json
+
+    from Drawingfunction import calculate_max_ball_speed
+    from KinematicsModule import extract_pitching_biomechanics
+    from motion_window import detect_motion_window
+    from pose_stream import parse_pose_bytes
+    from track_store import probe_video
+
+    def compare_with_full(meta, window, params):
+        n = meta["frame_count"]
+        w, h = params["width"], params["height"]
+        pose = parse_pose_bytes(json.dumps(fixtures.make_pose_json(n, w, h)).encode("utf-8"), n)
+        ball = fixtures.make_ball_json(n, w, h)
+        inside = (pose.frame_idx >= window.start_frame) & (pose.frame_idx < window.end_frame)
+        windowed_pose = type(pose)(pose.frame_idx[inside], pose.keypoints[inside],
+                                   pose.keypoint_scores[inside], pose.bboxes[inside],
+                                   pose.bbox_scores[inside], pose.total_frames)
+        windowed_ball = {**ball, "results": [r for r in ball["results"]
+                                             if window.start_frame <= r[0] < window.end_frame]}
+        full_features = extract_pitching_biomechanics(pose)
+        window_features = extract_pitching_biomechanics(windowed_pose)
+        params.update({
+            "window": [window.start_frame, window.end_frame],
+            "coverage": round(window.coverage, 3),
+            "key_frame_diff": {k: window_features.get(k) - full_features.get(k)
+                               for k in ("release_frame", "landing_frame", "shoulder_frame")
+                               if full_features.get(k) is not None and window_features.get(k) is not None},
+            "max_feature_diff": max((abs(window_features[k] - v) for k, v in full_features.items()
+                                     if k in fixtures.FEATURE_NAMES and v is not None
+                                     and window_features.get(k) is not None), default=None),
+            "total_frames": [full_features.get("total_frames"), window_features.get("total_frames")],
+            "max_speed_diff_kmh": calculate_max_ball_speed(windowed_ball, meta["fps"], n)
+            - calculate_max_ball_speed(ball, meta["fps"], n),
+        })
+
+    n = fixtures.FRAME_COUNTS[-1]       # 30 fps 約 20 秒，前後都有靜止畫面
+    for w, h in fixtures.RESOLUTIONS[:1] if args.quick else fixtures.RESOLUTIONS:
+        params = {"frames": n, "width": w, "height": h, "window": None, "coverage": 1.0}
+
+        def setup(w=w, h=h, params=params):
+            path = _video_path(workdir, n, w, h)
+            meta = probe_video(path)
+            window = detect_motion_window(path, meta)
+            if window is not None:
+                compare_with_full(meta, window, params)
+            return path, meta
+
+        yield (f"motion.detect_window[{n}f@{w}x{h}]", params, setup,
+               lambda data: detect_motion_window(data[0], data[1]), 1)
+
+
+@benchmark_case
+def session_segment_cases(args, workdir):
+    """
+    長時間練投影片的投球偵測：每次投球 3 秒 + 靜止 5 秒。
+    params 記錄偵測到的區段數 (應等於投球次數) 與 Python 配置記憶體的峰值 (不應隨影片長度增加)。
+    """
+    from motion_window import iter_pitch_segments
+    from track_store import probe_video
+
+    def scan(data):
+        return list(iter_pitch_segments(data[0], data[1]))
+
+    for n_pitches in ([5] if args.quick else [5, 20]):
+        params = {"pitches": n_pitches}
+
+        def setup(n_pitches=n_pitches, params=params):
+            path = os.path.join(workdir, "fixtures", f"session_{n_pitches}p.mp4")
+            if not os.path.exists(path):
+                fixtures.make_session_video(path, n_pitches)
+            meta = probe_video(path)
+            params.update({"frames": meta["frame_count"],
+                           "segments": len(scan((path, meta))),
+                           "peak_python_kib": _peak_memory_kib(scan, (path, meta))})
+            return path, meta
+
+        yield (f"session.segment[{n_pitches}p]", params, setup, scan, 1)
+
+
+@benchmark_case
+def chunk_split_cases(args, workdir):
+    """分段骨架推論前的切割：在關鍵幀直接切開 MP4 與解碼後重新編碼的比較 (每段 10 秒、重疊 0.5 秒)。"""
+    from video_proxy import _split_at_keyframes, _split_reencode, plan_chunks
+
+    n = fixtures.FRAME_COUNTS[-1]
+    for w, h in fixtures.RESOLUTIONS[:1] if args.quick else fixtures.RESOLUTIONS:
+        params = {"frames": n, "width": w, "height": h}
+        plan = plan_chunks(n, 300, 15)
+
+        def setup(w=w, h=h):
+            return _video_path(workdir, n, w, h)
+
+        yield (f"chunks.split_keyframes[{n}f@{w}x{h}]", params, setup,
+               lambda path, plan=plan: _split_at_keyframes(path, plan, path + "_kf"), 1)
+        yield (f"chunks.split_reencode[{n}f@{w}x{h}]", params, setup,
+               lambda path, plan=plan: _split_reencode(path, plan, 30.0, path + "_re"), 1)
+
+
+@benchmark_case
+def crud_cases(args, workdir):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+
+    import crud
+    from database import Base, PitchAnalyses
+
+    for rows in (100,) if args.quick else (100, 1000):
+        def setup(rows=rows):
+            engine = create_engine("sqlite://", connect_args={"check_same_thread": False},
+                                   poolclass=StaticPool)
+            Base.metadata.create_all(bind=engine)
+            session = sessionmaker(bind=engine)()
+            session.add_all([
+                PitchAnalyses(player_name="bench_player", pose_score=80, ball_score=0.5,
+                              biomechanics_features=fixtures.make_features(seed=i))
+                for i in range(rows)
+            ])
+            session.commit()
+            return session
+
+        yield (f"crud.calculate_user_average_profile[{rows}rows]", {"rows": rows}, setup,
+               lambda session: crud.calculate_user_average_profile(session, "bench_player"), 1)
+
+
+@benchmark_case
+def keypoint_storage_cases(args, workdir):
+    import json
+
+    import numpy as np
+    from keypoint_codec import KeypointSequence, encode_keypoints_json
+
+    for n in fixtures.FRAME_COUNTS[:1] if args.quick else fixtures.FRAME_COUNTS:
+        rng = np.random.default_rng(n)
+        frames = [
+            [[float(x), float(y), float(s)] for (x, y), s in
+             zip(fixtures.synthetic_keypoints(i, n, 1920, 1080, rng), rng.uniform(0.3, 1.0, 17))]
+            for i in range(n)
+        ]
+        json_text = json.dumps(frames)
+        blob = encode_keypoints_json(frames)
+        params = {"frames": n, "json_bytes": len(json_text), "blob_bytes": len(blob),
+                  "ratio": round(len(json_text) / len(blob), 1)}
+
+        # 目前的讀取方式：解析 JSON 後轉成陣列
+        yield (f"storage.keypoints_json_load[{n}f]", params, lambda json_text=json_text: json_text,
+               lambda text: np.asarray(json.loads(text), dtype=np.float32), 20)
+        yield (f"storage.keypoints_blob_load[{n}f]", params, lambda blob=blob: blob,
+               lambda data: KeypointSequence(data).keypoints, 20)
+        yield (f"storage.keypoints_blob_encode[{n}f]", params, lambda frames=frames: frames,
+               encode_keypoints_json, 5)
+
+
+
+@benchmark_case
+def startup_cases(args, workdir):
+    """
+    冷啟動：新的 Python 行程匯入 main (服務開始接受請求前的工作)，
+    以及匯入後同步完成預熱 (球路模型、延後匯入的模組、菁英模型目錄) 的總時間。
+    """
+    import subprocess
+
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'startup.db')}",
+        "STORAGE_BACKEND": "local",
+        "LOCAL_STORAGE_DIR": os.path.join(workdir, "local_storage"),
+        "SCRATCH_DIR": os.path.join(workdir, "scratch"),
+    }
+
+    def run_python(code: str):
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def setup():
+        run_python("from database import Base, engine; Base.metadata.create_all(engine)")
+
+    yield ("startup.import_main", {}, setup, lambda _: run_python("import main"), 1)
+    yield ("startup.import_main_and_warm_up", {}, setup,
+           lambda _: run_python("import main, services; services.warm_up()"), 1)
+
+
+# --- 執行與比較 ---
+
+def run_case(case: CaseSpec, repeat: int) -> Dict:
+    case_id, params, setup, fn, inner_loops = case
+    data = setup()
+    fn(data)  # 暖身，排除第一次匯入 / 快取的影響
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(inner_loops):
+            fn(data)
+        samples.append((time.perf_counter() - start) / inner_loops)
+    return {
+        "params": params,
+        "repeat": repeat,
+        "inner_loops": inner_loops,
+        "min_s": min(samples),
+        "median_s": statistics.median(samples),
+        "mean_s": statistics.fmean(samples),
+        "max_s": max(samples),
+    }
+
+
+def run_all(args) -> Dict:
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="baseball_bench_") as workdir, working_directory(workdir):
+        for generator in CASE_GENERATORS:
+            for case in generator(args, workdir):
+                case_id = case[0]
+                if args.filter and not any(f in case_id for f in args.filter):
+                    continue
+                print(f"▶ {case_id} ...", flush=True)
+                results[case_id] = run_case(case, args.repeat)
+                print(f"  median {results[case_id]['median_s'] * 1000:.3f} ms", flush=True)
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def compare_with_baseline(current: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """
+    以 median 比較兩次結果；ratio = 目前 / 基準線，ratio > 1 + threshold 視為退步。
+    只比較兩邊都有的案例。
+    """
+    report = []
+    for case_id, result in current["results"].items():
+        base = baseline.get("results", {}).get(case_id)
+        if not base:
+            continue
+        ratio = result["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+        report.append({
+            "case": case_id,
+            "baseline_s": base["median_s"],
+            "current_s": result["median_s"],
+            "ratio": ratio,
+            "regression": ratio > 1 + threshold,
+        })
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="棒球分析後端效能基準測試")
+    parser.add_argument("--quick", action="store_true", help="只跑最小的資料規格 (適合 CI)")
+    parser.add_argument("--repeat", type=int, default=5, help="每個案例重複計時次數")
+    parser.add_argument("--filter", action="append", help="只執行 case_id 含有此字串的案例 (可重複)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="結果 JSON 輸出路徑")
+    parser.add_argument("--baseline", help="要比較的基準線 JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="容許的退步比例 (0.2 代表慢 20%% 以上即失敗)")
+    parser.add_argument("--save-baseline", help="將本次結果另存為基準線")
+    args = parser.parse_args(argv)
+
+    current = run_all(args)
+
+    for path in filter(None, [args.output, args.save_baseline]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"結果已寫入 {path}")
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    report = compare_with_baseline(current, baseline, args.threshold)
+    current["comparison"] = report
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+
+    regressions = [r for r in report if r["regression"]]
+    for r in report:
+        mark = "❌" if r["regression"] else "✅"
+        print(f"{mark} {r['case']}: {r['baseline_s'] * 1000:.3f} ms → {r['current_s'] * 1000:.3f} ms "
+              f"(x{r['ratio']:.2f})")
+    if regressions:
+        print(f"效能退步超過 {args.threshold:.0%} 的案例共 {len(regressions)} 個")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# 職責: 本機替身 (stub) 的 POSE / BALL 推論服務，回放錄製或合成的回應，並可設定延遲與錯誤分佈。
+#
+# 啟動 (同一個 port 同時提供 /pose_video 與 /predict)：
+#   python -m benchmarks.stub_services --port 8001 --pose-latency-ms 800 --pose-error-rate 0.02
+# 讓後端改打替身服務：
+#   export POSE_API_URL=http://127.0.0.1:8001/pose_video
+#   export BALL_API_URL=http://127.0.0.1:8001/predict
+#
+# 也可以錄下真實 API 的回應 JSON，以 --pose-fixture / --ball-fixture 回放。
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks import fixtures  # noqa: E402
+
+
+@dataclass
+class StubBehavior:
+    """單一端點的延遲與錯誤設定 (時間單位皆為毫秒)。"""
+    latency_ms: float = 200.0
+    jitter_ms: float = 50.0
+    distribution: str = "normal"       # fixed / uniform / normal / lognormal
+    error_rate: float = 0.0            # 回傳 503 的機率
+    timeout_rate: float = 0.0          # 卡住 hang_ms 後才回應的機率 (模擬逾時)
+    hang_ms: float = 30000.0
+    cold_start_rate: float = 0.0       # 額外加上 cold_start_ms 的機率 (模擬 Cloud Run 冷啟動)
+    cold_start_ms: float = 5000.0
+    per_mb_ms: float = 0.0             # 每 MB 上傳內容額外的延遲 (模擬推論時間與影片長度成正比)
+
+    def sample_delay_s(self, rng: random.Random, upload_bytes: int = 0) -> float:
+        if self.distribution == "fixed":
+            delay = self.latency_ms
+        elif self.distribution == "uniform":
+            delay = rng.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+        elif self.distribution == "lognormal":
+            # 以 latency_ms 為中位數、jitter_ms / latency_ms 為離散程度的長尾分佈
+            sigma = self.jitter_ms / self.latency_ms if self.latency_ms > 0 else 0.0
+            delay = self.latency_ms * rng.lognormvariate(0.0, sigma)
+        else:
+            delay = rng.gauss(self.latency_ms, self.jitter_ms)
+        if self.cold_start_rate and rng.random() < self.cold_start_rate:
+            delay += self.cold_start_ms
+        delay += self.per_mb_ms * upload_bytes / 1e6
+        return max(0.0, delay) / 1000.0
+
+
+def _load_or_build_response(fixture_path: Optional[str], builder) -> bytes:
+    """回應內容只序列化一次，避免替身服務本身的 CPU 成本干擾量測。"""
+    if fixture_path:
+        with open(fixture_path, "rb") as f:
+            return f.read()
+    return json.dumps(builder()).encode("utf-8")
+
+
+def create_stub_app(pose_behavior: StubBehavior, ball_behavior: StubBehavior,
+                    pose_body: bytes, ball_body: bytes, seed: Optional[int] = None) -> FastAPI:
+    app = FastAPI(title="pose / ball stub services")
+    rng = random.Random(seed)
+    stats: Dict[str, Dict[str, int]] = {
+        "pose": {"requests": 0, "errors": 0, "timeouts": 0},
+        "ball": {"requests": 0, "errors": 0, "timeouts": 0},
+    }
+
+    async def respond(name: str, behavior: StubBehavior, body: bytes, file: UploadFile) -> Response:
+        stats[name]["requests"] += 1
+        upload = await file.read()  # 和真實服務一樣把上傳內容讀完
+        if behavior.timeout_rate and rng.random() < behavior.timeout_rate:
+            stats[name]["timeouts"] += 1
+            await asyncio.sleep(behavior.hang_ms / 1000.0)
+        else:
+            await asyncio.sleep(behavior.sample_delay_s(rng, len(upload)))
+        if behavior.error_rate and rng.random() < behavior.error_rate:
+            stats[name]["errors"] += 1
+            return JSONResponse(status_code=503, content={"detail": f"stub {name} injected error"})
+        return Response(content=body, media_type="application/json")
+
+    @app.post("/pose_video")
+    async def pose_video(file: UploadFile = File(...)):
+        return await respond("pose", pose_behavior, pose_body, file)
+
+    @app.post("/predict")
+    async def predict(file: UploadFile = File(...)):
+        return await respond("ball", ball_behavior, ball_body, file)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def _add_behavior_args(parser: argparse.ArgumentParser, prefix: str, default_latency: float):
+    defaults = StubBehavior(latency_ms=default_latency)
+    group = parser.add_argument_group(f"{prefix} 端點")
+    group.add_argument(f"--{prefix}-latency-ms", type=float, default=defaults.latency_ms)
+    group.add_argument(f"--{prefix}-jitter-ms", type=float, default=defaults.jitter_ms)
+    group.add_argument(f"--{prefix}-distribution", default=defaults.distribution,
+                       choices=["fixed", "uniform", "normal", "lognormal"])
+    group.add_argument(f"--{prefix}-error-rate", type=float, default=defaults.error_rate)
+    group.add_argument(f"--{prefix}-timeout-rate", type=float, default=defaults.timeout_rate)
+    group.add_argument(f"--{prefix}-hang-ms", type=float, default=defaults.hang_ms)
+    group.add_argument(f"--{prefix}-cold-start-rate", type=float, default=defaults.cold_start_rate)
+    group.add_argument(f"--{prefix}-cold-start-ms", type=float, default=defaults.cold_start_ms)
+    group.add_argument(f"--{prefix}-per-mb-ms", type=float, default=defaults.per_mb_ms,
+                       help="每 MB 上傳內容額外的延遲")
+    group.add_argument(f"--{prefix}-fixture", help="回放的 JSON 檔 (未指定則使用合成資料)")
+
+
+def _behavior_from_args(args: argparse.Namespace, prefix: str) -> StubBehavior:
+    def get(name):
+        return getattr(args, f"{prefix}_{name}")
+    return StubBehavior(
+        latency_ms=get("latency_ms"), jitter_ms=get("jitter_ms"), distribution=get("distribution"),
+        error_rate=get("error_rate"), timeout_rate=get("timeout_rate"), hang_ms=get("hang_ms"),
+        cold_start_rate=get("cold_start_rate"), cold_start_ms=get("cold_start_ms"),
+        per_mb_ms=get("per_mb_ms"),
+    )
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本機 POSE / BALL 推論替身服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--frames", type=int, default=300, help="合成回應的幀數")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--seed", type=int, default=None, help="固定亂數種子以重現延遲 / 錯誤序列")
+    _add_behavior_args(parser, "pose", 1500.0)
+    _add_behavior_args(parser, "ball", 800.0)
+    args = parser.parse_args(argv)
+
+    pose_body = _load_or_build_response(
+        args.pose_fixture, lambda: fixtures.make_pose_json(args.frames, args.width, args.height))
+    ball_body = _load_or_build_response(
+        args.ball_fixture, lambda: fixtures.make_ball_json(args.frames, args.width, args.height))
+    app = create_stub_app(_behavior_from_args(args, "pose"), _behavior_from_args(args, "ball"),
+                          pose_body, ball_body, seed=args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
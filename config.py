@@ -1,18 +1,159 @@
 import os
 import sys 
+import tempfile
 
 # GCS 設定
-GCS_BUCKET_NAME = "baseball_storage"
+GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME", "baseball_storage")
 
-# 外部 API 端點
-POSE_API_URL = "https://mmpose-api-new-924124779607.europe-west1.run.app/pose_video"
-BALL_API_URL = "https://base-ball-detect-api-1069614647348.us-east4.run.app/predict"
+# 外部 API 端點 (可透過環境變數覆寫，例如指向本機的替身服務 benchmarks/stub_services.py)
+POSE_API_URL = os.environ.get("POSE_API_URL", "https://mmpose-api-new-924124779607.europe-west1.run.app/pose_video")
+BALL_API_URL = os.environ.get("BALL_API_URL", "https://base-ball-detect-api-1069614647348.us-east4.run.app/predict")
 
+# 推論 API 容錯 (inference_client.py)：每次嘗試的逾時、含重試的總時間上限、重試次數與指數退避。
+# 每次嘗試的逾時預設與總時間上限相同 (原本的單次逾時 300 秒)，逾時只在剩餘時間還夠一次完整嘗試時才重試
+INFERENCE_MAX_ATTEMPTS = int(os.environ.get("INFERENCE_MAX_ATTEMPTS", "3"))
+INFERENCE_ATTEMPT_TIMEOUT = float(os.environ.get("INFERENCE_ATTEMPT_TIMEOUT", "300"))
+INFERENCE_DEADLINE_SECONDS = float(os.environ.get("INFERENCE_DEADLINE_SECONDS", "300"))
+INFERENCE_BACKOFF_BASE_SECONDS = float(os.environ.get("INFERENCE_BACKOFF_BASE_SECONDS", "0.5"))
+INFERENCE_BACKOFF_MAX_SECONDS = float(os.environ.get("INFERENCE_BACKOFF_MAX_SECONDS", "8"))
+# 超過近期成功延遲的此百分位數 (例如 95) 仍未回應就送出對沖請求；0 代表不對沖
+INFERENCE_HEDGE_PERCENTILE = float(os.environ.get("INFERENCE_HEDGE_PERCENTILE", "0"))
+INFERENCE_HEDGE_MIN_SAMPLES = int(os.environ.get("INFERENCE_HEDGE_MIN_SAMPLES", "20"))
+INFERENCE_HEDGE_MIN_DELAY_SECONDS = float(os.environ.get("INFERENCE_HEDGE_MIN_DELAY_SECONDS", "1"))
+# 連續失敗此次數後斷路器斷開 (0 代表停用)，斷開 CIRCUIT_RESET_SECONDS 秒後放一個試探請求
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
 
 # 內部 API 端點
 # POSE_API_URL = "http://localhost:8000/pose_video"
 # BALL_API_URL = "http://localhost:8080/predict"
 
+# --- 檔案儲存後端 ---
+# "gcs": 上傳到 Google Cloud Storage (正式環境)
+# "local": 寫入本機資料夾並由 FastAPI 的 /local-storage 路徑提供下載 (離線開發 / 壓力測試)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "gcs")
+LOCAL_STORAGE_DIR = os.environ.get("LOCAL_STORAGE_DIR", "local_storage")
+LOCAL_STORAGE_BASE_URL = os.environ.get("LOCAL_STORAGE_BASE_URL", "http://localhost:9000/local-storage")
+
+# --- 批次分析 ---
+# 同一批次內同時進行分析的影片數上限 (請求可指定更小的值)，以及單一批次可上傳的影片數上限
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "60"))
+
+# --- 長時間練投影片 (一支影片多次投球) ---
+# 逐段偵測每一次投球 (motion_window.iter_pitch_segments)，每段前後加 SESSION_MARGIN_SECONDS 秒緩衝；
+# 動作中斷超過 SESSION_GAP_SECONDS 秒視為結束，短於 SESSION_MIN_PITCH_SECONDS 捨棄、超過 SESSION_MAX_PITCH_SECONDS 切開；
+# 同一支影片最多 SESSION_MAX_CONCURRENCY 段同時分析
+SESSION_MAX_CONCURRENCY = int(os.environ.get("SESSION_MAX_CONCURRENCY", "4"))
+SESSION_MARGIN_SECONDS = float(os.environ.get("SESSION_MARGIN_SECONDS", "1.0"))
+SESSION_GAP_SECONDS = float(os.environ.get("SESSION_GAP_SECONDS", "0.5"))
+SESSION_MIN_PITCH_SECONDS = float(os.environ.get("SESSION_MIN_PITCH_SECONDS", "0.5"))
+SESSION_MAX_PITCH_SECONDS = float(os.environ.get("SESSION_MAX_PITCH_SECONDS", "10"))
+
+# --- 重複請求去重 ---
+# 相同影片內容 + 參數的並行分析只執行一次；帶 Idempotency-Key 的結果保留 IDEMPOTENCY_TTL_SECONDS 秒供重送
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1") == "1"
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "600"))
+# 執行中的工作與保留的結果記在資料庫 (single_flight)，pre-fork 的各工作行程共用：其他行程的相同請求每
+# SINGLE_FLIGHT_POLL_SECONDS 秒查詢一次結果；執行的行程超過 SINGLE_FLIGHT_LEASE_SECONDS 秒沒有更新租約 (行程已結束) 時由等待者接手
+SINGLE_FLIGHT_LEASE_SECONDS = float(os.environ.get("SINGLE_FLIGHT_LEASE_SECONDS", "30"))
+SINGLE_FLIGHT_POLL_SECONDS = float(os.environ.get("SINGLE_FLIGHT_POLL_SECONDS", "0.5"))
+
+# --- 准入控制 (admission.py) ---
+# 單支分析的估計記憶體 = ADMISSION_BASE_COST_MB + 上傳大小 × ADMISSION_COST_PER_UPLOAD_MB；
+# 並行數與記憶體預算 (0 代表不限) 都有餘裕才開始，否則排隊 (最多 ADMISSION_MAX_QUEUE 個、ADMISSION_QUEUE_TIMEOUT_SECONDS 秒)，
+# 超過就回 429
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", str(os.cpu_count() or 1)))
+ADMISSION_MEMORY_BUDGET_MB = float(os.environ.get("ADMISSION_MEMORY_BUDGET_MB", "2048"))
+ADMISSION_BASE_COST_MB = float(os.environ.get("ADMISSION_BASE_COST_MB", "150"))
+ADMISSION_COST_PER_UPLOAD_MB = float(os.environ.get("ADMISSION_COST_PER_UPLOAD_MB", "8"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "16"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "120"))
+
+# --- 暫存空間 (scratch_space.py) ---
+# 每個請求在 SCRATCH_DIR 下有自己的目錄 (SCRATCH_TMPFS=1 時預設放在 /dev/shm，會佔用記憶體)；
+# 每個請求預留上傳大小 × SCRATCH_RESERVE_FACTOR (延遲渲染預留 SCRATCH_RENDER_RESERVE_MB)，
+# 預留總和超過 SCRATCH_QUOTA_MB (整台機器的配額，pre-fork 時平均分給各工作行程；0 代表不限) 時最多等待 SCRATCH_WAIT_SECONDS 秒，之後回 503；
+# janitor 每 SCRATCH_JANITOR_INTERVAL_SECONDS 秒刪除擁有者已結束的目錄；名稱中沒有擁有者的項目超過 SCRATCH_ORPHAN_SECONDS 秒才刪除
+SCRATCH_TMPFS = os.environ.get("SCRATCH_TMPFS", "0") == "1"
+SCRATCH_DIR = os.environ.get("SCRATCH_DIR") or os.path.join(
+    "/dev/shm" if SCRATCH_TMPFS else tempfile.gettempdir(), "baseball_scratch")
+SCRATCH_QUOTA_MB = float(os.environ.get("SCRATCH_QUOTA_MB", "4096"))
+SCRATCH_RESERVE_FACTOR = float(os.environ.get("SCRATCH_RESERVE_FACTOR", "3"))
+SCRATCH_RENDER_RESERVE_MB = float(os.environ.get("SCRATCH_RENDER_RESERVE_MB", "200"))
+SCRATCH_WAIT_SECONDS = float(os.environ.get("SCRATCH_WAIT_SECONDS", "30"))
+SCRATCH_ORPHAN_SECONDS = float(os.environ.get("SCRATCH_ORPHAN_SECONDS", "3600"))
+SCRATCH_JANITOR_INTERVAL_SECONDS = float(os.environ.get("SCRATCH_JANITOR_INTERVAL_SECONDS", "300"))
+
+# --- 啟動 ---
+# 啟動後在背景執行緒預先載入球路模型、延後匯入的模組與菁英模型目錄 (健康檢查不需要等待)
+STARTUP_WARM_UP = os.environ.get("STARTUP_WARM_UP", "1") == "1"
+
+# --- 多工作行程 (prefork.py) ---
+# SERVER_MODE="prefork" 時 python main.py 先預熱再 fork 出 WEB_WORKERS 個工作行程 (0 代表依 CPU 與記憶體上限自動決定，
+# 每個工作行程以 WORKER_BASE_MEMORY_MB + ADMISSION_MEMORY_BUDGET_MB 估計)；
+# 工作行程處理 WORKER_MAX_REQUESTS (+ 0~WORKER_MAX_REQUESTS_JITTER) 個請求後重啟 (0 代表不重啟)
+SERVER_MODE = os.environ.get("SERVER_MODE", "single")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "0"))
+WORKER_BASE_MEMORY_MB = float(os.environ.get("WORKER_BASE_MEMORY_MB", "400"))
+WORKER_MAX_REQUESTS = int(os.environ.get("WORKER_MAX_REQUESTS", "1000"))
+WORKER_MAX_REQUESTS_JITTER = int(os.environ.get("WORKER_MAX_REQUESTS_JITTER", "100"))
+
+# --- 菁英模型目錄 (相似選手排名) ---
+# 超過此秒數後會檢查 pitch_model 是否被其他行程修改過
+PROFILE_CATALOG_TTL_SECONDS = float(os.environ.get("PROFILE_CATALOG_TTL_SECONDS", "60"))
+SIMILAR_MODELS_MAX_TOP_K = int(os.environ.get("SIMILAR_MODELS_MAX_TOP_K", "50"))
+
+# --- 背景重新計分 ---
+# 每個區塊的筆數 (記憶體與單次交易大小的上限)，以及區塊之間暫停的秒數 (讓出資源給線上流量)
+RESCORE_CHUNK_SIZE = int(os.environ.get("RESCORE_CHUNK_SIZE", "500"))
+RESCORE_PAUSE_SECONDS = float(os.environ.get("RESCORE_PAUSE_SECONDS", "0.05"))
+# 工作的進度與租約存在資料庫 (rescore_job)；執行中的行程超過 RESCORE_LEASE_SECONDS 秒沒有回報進度
+# (行程結束或被重啟) 時，由任一工作行程從 last_id 接手
+RESCORE_LEASE_SECONDS = float(os.environ.get("RESCORE_LEASE_SECONDS", "60"))
+
+# --- 菁英模型建置 ---
+# 每個 (選手, 球種) 群組至少需要的訓練樣本數，不足則不建置 (標準差沒有意義)
+MODEL_BUILD_MIN_SAMPLES = int(os.environ.get("MODEL_BUILD_MIN_SAMPLES", "3"))
+
+# --- 由保存的軌跡重新分析 ---
+# 行程池大小 (預設為 CPU 核心數) 與批次命令每次讀取的筆數
+REANALYSIS_WORKERS = int(os.environ.get("REANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+REANALYSIS_CHUNK_SIZE = int(os.environ.get("REANALYSIS_CHUNK_SIZE", "200"))
+
+# --- 分析用代理影片 ---
+# 呼叫推論 API 前先在本機縮小解析度 (高度上限)，推論結果再換算回原始影片。
+# ANALYSIS_PROXY_MAX_FPS > 0 時另外降低幀率；預設 0 不降，因為特徵以取樣點數計算 (例如 landing 往前 9 個取樣點)，
+# 降低幀率會改變特徵與 pose_score
+ANALYSIS_PROXY_ENABLED = os.environ.get("ANALYSIS_PROXY_ENABLED", "1") == "1"
+ANALYSIS_PROXY_MAX_HEIGHT = int(os.environ.get("ANALYSIS_PROXY_MAX_HEIGHT", "720"))
+ANALYSIS_PROXY_MAX_FPS = float(os.environ.get("ANALYSIS_PROXY_MAX_FPS", "0"))
+# 沒有指定裁切時，先在本機偵測投球區間，只送這段 (前後各加 MOTION_WINDOW_MARGIN_SECONDS 秒)。
+# 少了靜止畫面後以整段骨架計算的特徵與 pose_score 會改變，預設關閉，菁英模型以相同設定重建後再開啟
+MOTION_WINDOW_ENABLED = os.environ.get("MOTION_WINDOW_ENABLED", "0") == "1"
+MOTION_WINDOW_MARGIN_SECONDS = float(os.environ.get("MOTION_WINDOW_MARGIN_SECONDS", "1.0"))
+# 長影片的骨架推論切成每段 POSE_CHUNK_SECONDS 秒 (相鄰片段重疊 POSE_CHUNK_OVERLAP_SECONDS 秒) 並行送出，
+# 同一支影片最多 POSE_CHUNK_CONCURRENCY 段同時推論；0 代表不切割
+POSE_CHUNK_SECONDS = float(os.environ.get("POSE_CHUNK_SECONDS", "0"))
+POSE_CHUNK_OVERLAP_SECONDS = float(os.environ.get("POSE_CHUNK_OVERLAP_SECONDS", "0.5"))
+POSE_CHUNK_CONCURRENCY = int(os.environ.get("POSE_CHUNK_CONCURRENCY", "4"))
+
+# --- 影片渲染 ---
+# 預設渲染設定 (full / preview / fast，請求可另外指定)；
+# RENDER_CODECS 覆寫編碼器嘗試順序 (以逗號分隔的 fourcc，例如 "mp4v" 可略過本機沒有的 avc1)，
+# RENDER_QUALITY 為 0-100 的編碼品質 (僅部分編碼器支援)，未設定時使用各設定的預設值
+RENDER_PROFILE = os.environ.get("RENDER_PROFILE", "full")
+RENDER_CODECS = tuple(c.strip() for c in os.environ.get("RENDER_CODECS", "").split(",") if c.strip())
+RENDER_QUALITY = int(os.environ["RENDER_QUALITY"]) if os.environ.get("RENDER_QUALITY") else None
+# "lazy"：分析時不渲染，只保存原始影片，第一次呼叫 GET /analyses/{id}/video 時才渲染並快取網址
+# "eager"：分析時就渲染並上傳 (原本的行為)
+RENDER_MODE = os.environ.get("RENDER_MODE", "lazy")
+# 上傳前把 moov 移到檔案開頭 (邊下載邊播放)；另外輸出 HLS 分段 (fMP4) 與播放清單，分段並行上傳
+VIDEO_FASTSTART = os.environ.get("VIDEO_FASTSTART", "1") == "1"
+VIDEO_HLS = os.environ.get("VIDEO_HLS", "0") == "1"
+HLS_SEGMENT_SECONDS = float(os.environ.get("HLS_SEGMENT_SECONDS", "2"))
+HLS_UPLOAD_CONCURRENCY = int(os.environ.get("HLS_UPLOAD_CONCURRENCY", "8"))
+
 
 # --- Render PostgreSQL 資料庫 URL 的最佳實踐 ---
 # 最佳實踐：從不將生產環境的機敏資訊 (如資料庫URL) 直接寫在程式碼中。
@@ -26,4 +167,4 @@ except KeyError:
     # 當在 Google Cloud 環境中找不到名為 "DATABASE_URL" 的環境變數時，
     # 會印出這個錯誤訊息並停止程式，提醒您去設定它。
     print("錯誤：環境變數 'DATABASE_URL' 未設定。請在 Google Cloud 的服務設定中新增此變數。")
-    sys.exit(1)
\ No newline at end of file
+    sys.exit(1)
@@ -18,9 +18,10 @@ def get_pitch_analysis(db: Session, analysis_id: int) -> Optional[PitchAnalyses]
     """根據 ID 獲取單筆分析紀錄。"""
     return db.query(PitchAnalyses).filter(PitchAnalyses.id == analysis_id).first()
 
-def get_pitch_analyses(db: Session, player_name: Optional[str] = None, end_date: Optional[datetime] = None, skip: int = 0, limit: int = 100) -> List[PitchAnalyses]:
+def get_pitch_analyses(db: Session, player_name: Optional[str] = None, end_date: Optional[datetime] = None, skip: int = 0, limit: int = 100,
+                       session_id: Optional[str] = None) -> List[PitchAnalyses]:
     """
-    獲取分析紀錄列表，可選擇性地根據投手名稱和結束時間篩選。
+    獲取分析紀錄列表，可選擇性地根據投手名稱、結束時間和練投場次篩選。
     """
     
     query = db.query(PitchAnalyses).order_by(PitchAnalyses.id.desc())
@@ -30,6 +31,9 @@ def get_pitch_analyses(db: Session, player_name: Optional[str] = None, end_date:
     
     if end_date:
         query = query.filter(PitchAnalyses.created_at < end_date)
+
+    if session_id:
+        query = query.filter(PitchAnalyses.session_id == session_id)
         
     return query.offset(skip).limit(limit).all()
 
@@ -47,7 +51,15 @@ def create_pitch_analysis(db: Session, analysis_data: Dict[str, Any]) -> PitchAn
         release_frame_url=analysis_data.get("release_frame_url"),
         landing_frame_url=analysis_data.get("landing_frame_url"),
         shoulder_frame_url=analysis_data.get("shoulder_frame_url"),
-        pose_score_message=analysis_data.get("pose_score_message", "分析成功")
+        pose_score_message=analysis_data.get("pose_score_message", "分析成功"),
+        benchmark_model_name=analysis_data.get("benchmark_model_name"),
+        tracks_blob=analysis_data.get("tracks_blob"),
+        tracks_format=analysis_data.get("tracks_format"),
+        source_video_blob=analysis_data.get("source_video_blob"),
+        video_render_profile=analysis_data.get("video_render_profile"),
+        hls_url=analysis_data.get("hls_url"),
+        session_id=analysis_data.get("session_id"),
+        session_offset_seconds=analysis_data.get("session_offset_seconds")
     )
     db.add(db_analysis)
     db.commit()
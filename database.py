@@ -1,14 +1,17 @@
 import os
-from sqlalchemy import (create_engine, Column, Integer, String, Float, JSON,
-                        DateTime, ForeignKey)
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy import (create_engine, Boolean, Column, Integer, String, Float, JSON,
+                        DateTime, ForeignKey, LargeBinary, null)
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, deferred
 from sqlalchemy.sql import func
 from sqlalchemy.exc import SQLAlchemyError
 
 from config import DATABASE_URL
+from keypoint_codec import FORMAT_VERSION as KEYPOINT_FORMAT_VERSION, KeypointSequence
 
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+# SQLite (本機開發 / 壓力測試) 的連線預設不允許跨執行緒使用，而 FastAPI 會在執行緒池中建立 Session
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # --- 最終的四表架構模型定義 ---
@@ -23,11 +26,29 @@ class PitchRecording(Base):
     video_filename = Column(String, unique=True, index=True)
     description = Column(String)
     source_csv = Column(String)
-    keypoints_data = Column(JSON, nullable=True)
+    # 舊格式 (逐幀 JSON)；db_migrations.py 會轉成 keypoints_blob 後清空
+    keypoints_data = deferred(Column(JSON, nullable=True))
+    # keypoint_codec 的二進位格式；兩者皆延遲載入，列出紀錄時不會一併讀出
+    keypoints_blob = deferred(Column(LargeBinary, nullable=True))
+    keypoints_format = Column(Integer, nullable=True)  # keypoints_blob 的格式版本
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     kinematics = relationship("Kinematics", back_populates="pitch_recording", cascade="all, delete-orphan")
 
+    @property
+    def keypoints(self):
+        """回傳 KeypointSequence (第一次存取陣列時才解壓縮)；尚未轉換的舊資料直接由 JSON 轉換。"""
+        if self.keypoints_blob is not None:
+            return KeypointSequence(self.keypoints_blob)
+        if self.keypoints_data:
+            return KeypointSequence.from_json(self.keypoints_data)
+        return None
+
+    def set_keypoints(self, frame_idx, keypoints, scores=None):
+        self.keypoints_blob = KeypointSequence.from_arrays(frame_idx, keypoints, scores).to_bytes()
+        self.keypoints_format = KEYPOINT_FORMAT_VERSION
+        self.keypoints_data = null()  # SQL NULL (直接給 None 會存成 JSON 的 'null')
+
 # 表二：儲存「訓練用」的計算後運動學特徵
 class Kinematics(Base):
     __tablename__ = 'kinematics'
@@ -63,6 +84,24 @@ class PitchAnalyses(Base):
     landing_frame_url = Column(String, index=True)
     shoulder_frame_url = Column(String, index=True)
     pose_score_message = Column(String, default="分析成功")
+    # pose_score 所比對的菁英模型名稱 (比對個人平均或沒有模型時為 None)，模型重建後據此重新計分
+    benchmark_model_name = Column(String, index=True, nullable=True)
+    # 原始骨架 / 球路軌跡 (track_store 格式)，可不經推論重新分析；延遲載入
+    tracks_blob = deferred(Column(LargeBinary, nullable=True))
+    tracks_format = Column(Integer, nullable=True)
+    reanalyzed_at = Column(DateTime(timezone=True), nullable=True)
+    # 延遲渲染：原始影片在儲存空間中的路徑、渲染設定與完成時間 (video_path 為渲染後影片網址的快取)
+    source_video_blob = Column(String, nullable=True)
+    video_render_profile = Column(String, nullable=True)
+    video_rendered_at = Column(DateTime(timezone=True), nullable=True)
+    # HLS 播放清單網址 (有啟用 VIDEO_HLS 時)
+    hls_url = Column(String, nullable=True)
+    # 其他渲染設定事後渲染的影片：{設定名稱: {"video_url", "hls_url", "rendered_at"}}
+    # (video_path / hls_url 只保存 video_render_profile 的影片，不會被其他設定覆蓋)
+    rendered_videos = Column(JSON, nullable=True)
+    # 由長時間練投影片切出的投球：所屬場次與片段在原始影片中的起點 (秒)
+    session_id = Column(String, index=True, nullable=True)
+    session_offset_seconds = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
 # 表四：儲存計算後的統計模型
@@ -74,6 +113,47 @@ class PitchModel(Base):
     method = Column(String, default='percentile')
     profile_data = Column(JSON, nullable=False)
     source_feature_count = Column(Integer)
+    # 由 model_builder.py 建置時寫入：來源 kinematics 資料的雜湊，資料沒變就不重建
+    source_fingerprint = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# 背景重新計分工作 (rescoring.py)：進度與租約存在資料庫，多個工作行程都查得到，工作行程結束後也能由其他行程接手
+class RescoreJob(Base):
+    __tablename__ = 'rescore_job'
+
+    job_id = Column(String, primary_key=True)
+    model_name = Column(String, index=True, nullable=False)
+    # 進行中 (pending / running) 時等於 model_name、結束後清空；唯一索引保證同一個模型同時只有一個工作
+    active_model = Column(String, unique=True, nullable=True)
+    status = Column(String, nullable=False, default='pending')
+    total = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    updated = Column(Integer, nullable=False, default=0)
+    last_id = Column(Integer, nullable=False, default=0)
+    chunk_size = Column(Integer, nullable=False)
+    error = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    # 租約：執行中的行程每個區塊更新 heartbeat_at，超過 RESCORE_LEASE_SECONDS 沒更新就可被其他行程接手
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# single_flight 的跨行程紀錄：執行中的工作 (租約) 與完成後保留供重送的結果
+class FlightRecord(Base):
+    __tablename__ = 'single_flight'
+
+    # key 的 SHA-256 (Idempotency-Key 由用戶端提供，長度不固定)
+    key_hash = Column(String(64), primary_key=True)
+    flight = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False, default='')
+    status = Column(String, nullable=False)             # running / completed
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    result = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 # --- 3. 執行資料庫操作的函式 ---
@@ -0,0 +1,153 @@
+# 檔案: db_migrations.py
+# 職責: 將既有資料庫升級到 database.py 中最新的資料表定義。
+#       每個步驟都可以重複執行 (已存在的欄位 / 索引會略過)，部署新版本前執行一次即可：
+#           python db_migrations.py
+
+import json
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import Column, Index, bindparam, inspect, null, select, text, update
+from sqlalchemy.engine import Engine
+
+from database import Base, engine, PitchAnalyses, PitchModel, PitchRecording
+from keypoint_codec import FORMAT_VERSION as KEYPOINT_FORMAT_VERSION, encode_keypoints_json
+
+logger = logging.getLogger(__name__)
+
+# (名稱, 執行函式) 依序執行
+MIGRATIONS: List[Tuple[str, Callable[[Engine], None]]] = []
+
+
+def migration(name: str):
+    """註冊一個升級步驟。"""
+    def decorator(func):
+        MIGRATIONS.append((name, func))
+        return func
+    return decorator
+
+
+def add_column_if_missing(bind: Engine, model_class, column_name: str):
+    """依 ORM 模型上的欄位定義補上缺少的欄位 (型別依資料庫方言編譯)。"""
+    table_name = model_class.__tablename__
+    existing = {c["name"] for c in inspect(bind).get_columns(table_name)}
+    if column_name in existing:
+        return False
+    column: Column = model_class.__table__.c[column_name]
+    column_type = column.type.compile(dialect=bind.dialect)
+    with bind.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}'))
+    logger.info(f"已新增欄位 {table_name}.{column_name} ({column_type})")
+    return True
+
+
+def create_index_if_missing(bind: Engine, model_class, column_name: str):
+    """建立 ORM 欄位上 index=True 所對應的索引。"""
+    table = model_class.__table__
+    for index in table.indexes:
+        if [c.name for c in index.columns] == [column_name]:
+            index.create(bind=bind, checkfirst=True)
+            return
+    Index(f"ix_{table.name}_{column_name}", table.c[column_name]).create(bind=bind, checkfirst=True)
+
+
+# --- 升級步驟 ---
+
+@migration("create missing tables")
+def create_missing_tables(bind: Engine):
+    # 只建立尚不存在的資料表，既有資料表不受影響
+    Base.metadata.create_all(bind=bind)
+
+
+@migration("pitch_analyses.benchmark_model_name")
+def add_benchmark_model_name(bind: Engine):
+    add_column_if_missing(bind, PitchAnalyses, "benchmark_model_name")
+    create_index_if_missing(bind, PitchAnalyses, "benchmark_model_name")
+
+
+@migration("pitch_model.source_fingerprint / updated_at")
+def add_pitch_model_build_columns(bind: Engine):
+    add_column_if_missing(bind, PitchModel, "source_fingerprint")
+    add_column_if_missing(bind, PitchModel, "updated_at")
+
+
+@migration("pitch_record.keypoints_data → keypoints_blob")
+def convert_keypoints_to_blob(bind: Engine, batch_size: int = 100):
+    add_column_if_missing(bind, PitchRecording, "keypoints_blob")
+    add_column_if_missing(bind, PitchRecording, "keypoints_format")
+
+    # 依 id 分批轉換，每批一個交易；中斷後重跑會從尚未轉換的紀錄繼續
+    table = PitchRecording.__table__
+    pending = table.c.keypoints_data.isnot(None) & table.c.keypoints_blob.is_(None)
+    converted = json_bytes = blob_bytes = 0
+    last_id = 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.keypoints_data)
+                .where(pending & (table.c.id > last_id)).order_by(table.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            changes = []
+            for row in rows:
+                last_id = row.id
+                if row.keypoints_data is None:  # JSON 的 'null'
+                    continue
+                blob = encode_keypoints_json(row.keypoints_data)
+                json_bytes += len(json.dumps(row.keypoints_data))
+                blob_bytes += len(blob)
+                changes.append({"row_id": row.id, "blob": blob})
+            if changes:
+                conn.execute(
+                    update(table).where(table.c.id == bindparam("row_id")).values(
+                        keypoints_blob=bindparam("blob"), keypoints_format=KEYPOINT_FORMAT_VERSION,
+                        keypoints_data=null()),
+                    changes
+                )
+            converted += len(changes)
+    if converted:
+        logger.info(f"已轉換 {converted} 筆關節點資料：JSON {json_bytes / 1e6:.1f} MB → {blob_bytes / 1e6:.1f} MB")
+
+
+@migration("pitch_analyses.tracks_blob / tracks_format / reanalyzed_at")
+def add_analysis_track_columns(bind: Engine):
+    add_column_if_missing(bind, PitchAnalyses, "tracks_blob")
+    add_column_if_missing(bind, PitchAnalyses, "tracks_format")
+    add_column_if_missing(bind, PitchAnalyses, "reanalyzed_at")
+
+
+@migration("pitch_analyses.source_video_blob / video_render_profile / video_rendered_at")
+def add_lazy_render_columns(bind: Engine):
+    add_column_if_missing(bind, PitchAnalyses, "source_video_blob")
+    add_column_if_missing(bind, PitchAnalyses, "video_render_profile")
+    add_column_if_missing(bind, PitchAnalyses, "video_rendered_at")
+
+
+@migration("pitch_analyses.hls_url")
+def add_hls_url(bind: Engine):
+    add_column_if_missing(bind, PitchAnalyses, "hls_url")
+
+
+@migration("pitch_analyses.session_id / session_offset_seconds")
+def add_session_columns(bind: Engine):
+    add_column_if_missing(bind, PitchAnalyses, "session_id")
+    add_column_if_missing(bind, PitchAnalyses, "session_offset_seconds")
+    create_index_if_missing(bind, PitchAnalyses, "session_id")
+
+
+@migration("pitch_analyses.rendered_videos")
+def add_rendered_videos(bind: Engine):
+    add_column_if_missing(bind, PitchAnalyses, "rendered_videos")
+
+
+def run_migrations(bind: Engine = engine):
+    for name, func in MIGRATIONS:
+        logger.info(f"執行升級步驟：{name}")
+        func(bind)
+    logger.info("✅ 資料庫已是最新結構")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    run_migrations()
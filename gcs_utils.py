@@ -1,11 +1,28 @@
-from google.cloud import storage
+import os
+import shutil
+from functools import lru_cache
 
-def upload_video_to_gcs(bucket_name, source_file_path, destination_blob_name):
-    # 初始化 GCS 客戶端
+from config import STORAGE_BACKEND, LOCAL_STORAGE_DIR, LOCAL_STORAGE_BASE_URL
+
+@lru_cache(maxsize=1)
+def get_storage_client():
+    """
+    取得整個行程共用的 GCS 客戶端。
+    建立客戶端需要取得憑證與建立連線池，每次上傳都重建會浪費時間 (批次分析時尤其明顯)。
+    """
     # 本地端使用金鑰
-    #client = storage.Client.from_service_account_json("bustling-joy-463213-u1-8cf4fd648779.json")
+    #return storage.Client.from_service_account_json("bustling-joy-463213-u1-8cf4fd648779.json")
     # cloud run不需要金鑰
-    client = storage.Client(project='jojo-463304')
+    # google.cloud.storage 匯入約需 0.3 秒，延後到第一次使用 (本機儲存後端完全不需要)
+    from google.cloud import storage
+    return storage.Client(project='jojo-463304')
+
+def upload_video_to_gcs(bucket_name, source_file_path, destination_blob_name):
+    # 離線開發 / 壓力測試時改寫入本機資料夾，不需要 GCS 憑證
+    if STORAGE_BACKEND == "local":
+        return _upload_to_local_storage(bucket_name, source_file_path, destination_blob_name)
+
+    client = get_storage_client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(destination_blob_name)
 
@@ -22,3 +39,24 @@ def upload_video_to_gcs(bucket_name, source_file_path, destination_blob_name):
     print(f"公開網址：{public_url}")
     return public_url
 
+def download_from_gcs(bucket_name, blob_name, destination_file_path):
+    """下載儲存空間中的檔案到本機 (延遲渲染時取回原始影片)。"""
+    if STORAGE_BACKEND == "local":
+        shutil.copyfile(os.path.join(LOCAL_STORAGE_DIR, bucket_name, blob_name), destination_file_path)
+        return destination_file_path
+
+    client = get_storage_client()
+    client.bucket(bucket_name).blob(blob_name).download_to_filename(destination_file_path)
+    return destination_file_path
+
+def _upload_to_local_storage(bucket_name, source_file_path, destination_blob_name):
+    """
+    本機檔案系統儲存後端：複製到 LOCAL_STORAGE_DIR/<bucket>/<blob>，
+    並回傳由 main.py 掛載的 /local-storage 靜態路徑所提供的網址。
+    """
+    destination_path = os.path.join(LOCAL_STORAGE_DIR, bucket_name, destination_blob_name)
+    os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+    shutil.copyfile(source_file_path, destination_path)
+    public_url = f"{LOCAL_STORAGE_BASE_URL.rstrip('/')}/{bucket_name}/{destination_blob_name}"
+    print(f"檔案已寫入本機儲存：{destination_path}")
+    return public_url
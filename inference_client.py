@@ -0,0 +1,240 @@
+# 檔案: inference_client.py
+# 職責: 呼叫遠端推論 API (Pose / Ball) 的容錯層：重試與退避、對沖請求 (hedging)、斷路器，以及每次嘗試的指標。
+#
+#   Cloud Run 上的推論服務偶爾冷啟動或回 5xx，原本一次失敗 / 逾時就讓整個分析失敗 (最多等 300 秒)。
+#   - 重試：連線錯誤、逾時、429 / 5xx 會以指數退避 (含隨機抖動) 重試，總時間不超過 deadline；
+#           逾時只在剩餘時間還夠一次完整嘗試時才重試 (慢的請求不會因重試而被砍成更短的逾時)
+#   - 對沖：一次嘗試超過近期成功延遲的百分位數 (例如 p95) 仍未回應時，再送一份相同的請求，先成功者勝出，另一份取消
+#   - 斷路器：連續失敗達門檻即「斷開」，在冷卻時間內直接失敗 (BackendUnavailableError)，
+#             冷卻後只放一個試探請求，成功才恢復
+#   每次嘗試都記錄在 metrics (GET /metrics 的 inference_*)。
+#
+#   attempt_fn 是「送出一次完整請求並回傳結果」的 coroutine function，每次嘗試都會重新呼叫，
+#   因此串流解析的 PoseStreamParser 等狀態必須在 attempt_fn 內建立。
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+ATTEMPTS = Counter("inference_attempts_total", "推論 API 的每次嘗試 (含重試與對沖)", ("backend", "outcome", "hedge"))
+ATTEMPT_SECONDS = Histogram("inference_attempt_seconds", "推論 API 每次嘗試的耗時", ("backend", "outcome"))
+RETRIES = Counter("inference_retries_total", "推論 API 的重試次數", ("backend",))
+HEDGES = Counter("inference_hedges_total", "送出的對沖請求數", ("backend",))
+HEDGE_WINS = Counter("inference_hedge_wins_total", "對沖請求先於原請求成功的次數", ("backend",))
+CIRCUIT_STATE = Gauge("inference_circuit_state", "斷路器狀態 (0 = 關閉, 1 = 半開, 2 = 斷開)", ("backend",))
+CIRCUIT_REJECTIONS = Counter("inference_circuit_rejections_total", "斷路器斷開時直接拒絕的呼叫數", ("backend",))
+
+
+class BackendUnavailableError(Exception):
+    """斷路器斷開中，未送出請求。retry_after 為距離下一次試探的秒數。"""
+
+    def __init__(self, backend: str, retry_after: float):
+        super().__init__(f"推論服務 {backend} 暫時無法使用 (斷路器斷開)，約 {retry_after:.0f} 秒後再試")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+    backoff_base_s: float = 0.5
+    backoff_max_s: float = 8.0
+    attempt_timeout_s: float = 300.0
+    deadline_s: float = 300.0           # 含所有重試的總時間上限
+
+    def backoff(self, retry: int) -> float:
+        """第 retry 次重試前的等待時間 (full jitter)。"""
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** (retry - 1))))
+
+
+@dataclass
+class HedgePolicy:
+    percentile: float = 0.0             # 0 代表不對沖；例如 95 代表超過近期 p95 延遲就送對沖請求
+    min_samples: int = 20               # 成功樣本數不足時不對沖 (百分位數不可靠)
+    min_delay_s: float = 1.0
+    window: int = 200                   # 只看最近 window 次成功的延遲
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, backend: str, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.backend = backend
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        CIRCUIT_STATE.set(self.state, backend=backend)
+
+    def _set_state(self, state: int):
+        if state != self.state:
+            logger.warning(f"推論服務 {self.backend} 斷路器：{self.state} → {state}")
+        self.state = state
+        CIRCUIT_STATE.set(state, backend=self.backend)
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout_s - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.failure_threshold <= 0 or self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self._set_state(self.HALF_OPEN)
+        # 半開：同時只放一個試探請求
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_in_flight = False
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.failure_threshold > 0 and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+    def release(self):
+        """嘗試被取消 (沒有結果) 時歸還試探名額。"""
+        self._probe_in_flight = False
+
+
+def _is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def _is_timeout(error: BaseException) -> bool:
+    return isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException))
+
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"http_{error.response.status_code}"
+    if _is_timeout(error):
+        return "timeout"
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    if isinstance(error, httpx.TransportError):
+        return "transport_error"
+    return "error"
+
+
+class InferenceBackend:
+    """單一推論服務 (例如 pose / ball) 的容錯呼叫器，同一個行程內共用 (延遲統計與斷路器狀態跨請求累積)。"""
+
+    def __init__(self, name: str, retry: Optional[RetryPolicy] = None, hedge: Optional[HedgePolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.name = name
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge or HedgePolicy()
+        self.breaker = breaker or CircuitBreaker(name)
+        self._latencies = deque(maxlen=self.hedge.window)
+
+    def hedge_delay(self) -> Optional[float]:
+        if self.hedge.percentile <= 0 or len(self._latencies) < self.hedge.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(round(self.hedge.percentile / 100.0 * (len(ordered) - 1))))
+        return max(self.hedge.min_delay_s, ordered[index])
+
+    async def _run_attempt(self, attempt_fn: Callable[[], Awaitable[T]], hedge: bool, timeout: float) -> T:
+        start = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            result = await asyncio.wait_for(attempt_fn(), timeout=timeout)
+        except BaseException as e:
+            error = e
+            raise
+        else:
+            self._latencies.append(time.perf_counter() - start)
+            self.breaker.record_success()
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            outcome = _outcome(error)
+            ATTEMPTS.inc(backend=self.name, outcome=outcome, hedge=str(hedge).lower())
+            ATTEMPT_SECONDS.observe(elapsed, backend=self.name, outcome=outcome)
+            if isinstance(error, asyncio.CancelledError):
+                # 對沖中落後的一方被取消，不算失敗
+                self.breaker.release()
+            elif error is not None:
+                if _is_retryable(error):
+                    self.breaker.record_failure()
+                else:
+                    # 4xx 等非暫時性錯誤：服務本身正常
+                    self.breaker.record_success()
+                logger.info(f"推論服務 {self.name} 嘗試失敗 ({outcome}{', 對沖' if hedge else ''}, "
+                            f"{elapsed:.2f}s): {error!r}")
+
+    async def _attempt_with_hedge(self, attempt_fn: Callable[[], Awaitable[T]], timeout: float) -> T:
+        primary = asyncio.ensure_future(self._run_attempt(attempt_fn, False, timeout))
+        tasks = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and delay < timeout:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.breaker.allow():
+                    HEDGES.inc(backend=self.name)
+                    tasks.add(asyncio.ensure_future(self._run_attempt(attempt_fn, True, timeout - delay)))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            HEDGE_WINS.inc(backend=self.name)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, attempt_fn: Callable[[], Awaitable[T]]) -> T:
+        deadline = time.monotonic() + self.retry.deadline_s
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self.breaker.allow():
+                CIRCUIT_REJECTIONS.inc(backend=self.name)
+                raise BackendUnavailableError(self.name, self.breaker.retry_after())
+            remaining = deadline - time.monotonic()
+            try:
+                return await self._attempt_with_hedge(attempt_fn, min(self.retry.attempt_timeout_s, remaining))
+            except Exception as e:
+                if not _is_retryable(e) or attempt >= self.retry.max_attempts:
+                    raise
+                wait = self.retry.backoff(attempt)
+                if time.monotonic() + wait >= deadline:
+                    raise
+                if _is_timeout(e) and deadline - time.monotonic() - wait < self.retry.attempt_timeout_s:
+                    raise
+                RETRIES.inc(backend=self.name)
+                logger.warning(f"推論服務 {self.name} 第 {attempt} 次嘗試失敗，{wait:.2f} 秒後重試: {e!r}")
+                await asyncio.sleep(wait)
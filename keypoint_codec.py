@@ -0,0 +1,227 @@
+# 檔案: keypoint_codec.py
+# 職責: 關節點序列的精簡二進位格式 (取代 JSON 的逐幀 17×3 巢狀串列)。
+#
+#   檔頭 (固定 20 bytes，不壓縮，可不解壓就讀出幀數等資訊)
+#       magic "KPSQ" | 格式版本 uint8 | 旗標 uint8 | 關節點數 uint16 | 幀數 uint32 | 座標倍率 float32 | 保留 uint32
+#   內容 (zlib 壓縮)
+#       frame_idx   int32  (N,)      差分編碼 (連續幀時幾乎全是 1，壓縮率高)
+#       座標        int16  (N, K, 2) 像素座標 × 座標倍率 後四捨五入；缺值為 -32768
+#       信心分數    float16 (N, K)   旗標 HAS_SCORES 時才有
+#
+# 只儲存有偵測到人的幀，frame_idx 記錄它們在原影片中的位置。
+
+import json
+import math
+import struct
+import zlib
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"KPSQ"
+FORMAT_VERSION = 1
+FLAG_HAS_SCORES = 0x01
+
+_HEADER = struct.Struct("<4sBBHIfI")
+_MISSING = np.iinfo(np.int16).min
+# 座標倍率上限 (1/64 像素已遠小於姿態模型本身的誤差)
+_MAX_COORD_SCALE = 64.0
+
+
+def _coord_scale(coords: np.ndarray) -> float:
+    """選擇 2 的次方倍率，讓最大座標剛好放得進 int16，且倍率可精確以 float32 表示。"""
+    finite = coords[np.isfinite(coords)]
+    max_abs = float(np.abs(finite).max()) if finite.size else 0.0
+    if max_abs == 0.0:
+        return _MAX_COORD_SCALE
+    scale = 2.0 ** math.floor(math.log2((np.iinfo(np.int16).max - 1) / max_abs))
+    return min(scale, _MAX_COORD_SCALE)
+
+
+def encode_keypoints(frame_idx: np.ndarray, keypoints: np.ndarray,
+                     scores: Optional[np.ndarray] = None, level: int = 6) -> bytes:
+    """
+    frame_idx: (N,) 幀號；keypoints: (N, K, 2) 像素座標 (NaN 表示缺值)；scores: (N, K) 或 None。
+    """
+    frame_idx = np.asarray(frame_idx, dtype=np.int64)
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    if keypoints.ndim != 3 or keypoints.shape[2] != 2 or keypoints.shape[0] != frame_idx.shape[0]:
+        raise ValueError(f"關節點陣列形狀錯誤：{keypoints.shape} / frame_idx {frame_idx.shape}")
+    n_frames, n_keypoints = keypoints.shape[:2]
+
+    scale = _coord_scale(keypoints)
+    quantized = np.round(keypoints * scale)
+    quantized = np.where(np.isfinite(quantized), quantized, _MISSING).astype("<i2")
+
+    deltas = np.diff(frame_idx, prepend=0).astype("<i4")
+    parts = [deltas.tobytes(), quantized.tobytes()]
+    flags = 0
+    if scores is not None:
+        scores = np.asarray(scores, dtype=np.float64).reshape(n_frames, n_keypoints)
+        parts.append(scores.astype("<f2").tobytes())
+        flags |= FLAG_HAS_SCORES
+
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, flags, n_keypoints, n_frames, scale, 0)
+    return header + zlib.compress(b"".join(parts), level)
+
+
+def keypoints_from_json(data: Any) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    將既有 JSON 格式轉成 (frame_idx, keypoints, scores)。支援：
+    - 逐幀串列，每幀為 K 個 [x, y] 或 [x, y, score]；沒偵測到人的幀為 null 或空串列
+    - 逐幀串列，每幀為 {"frame_idx", "keypoints", "keypoint_scores"}
+    - MMPose API 回應 {"frames": [{"frame_idx", "predictions": [...]}]} (只取第一個人)
+    """
+    if isinstance(data, str):
+        data = json.loads(data)
+    if isinstance(data, dict):
+        data = data.get("frames") or []
+
+    frame_indices, points, point_scores = [], [], []
+    has_scores = False
+    for position, frame in enumerate(data):
+        if not frame:
+            continue
+        frame_idx = position
+        scores = None
+        if isinstance(frame, dict):
+            frame_idx = frame.get("frame_idx", position)
+            if "predictions" in frame:
+                predictions = frame.get("predictions") or []
+                if not predictions:
+                    continue
+                frame = predictions[0]
+            keypoints = frame.get("keypoints")
+            scores = frame.get("keypoint_scores")
+        else:
+            keypoints = frame
+        if not keypoints:
+            continue
+
+        array = np.array(keypoints, dtype=np.float64)
+        if array.shape[-1] == 3 and scores is None:
+            scores = array[:, 2]
+        frame_indices.append(frame_idx)
+        points.append(array[:, :2])
+        point_scores.append(scores)
+        has_scores = has_scores or scores is not None
+
+    if not points:
+        return np.empty(0, dtype=np.int64), np.empty((0, 17, 2)), None
+
+    keypoints = np.stack(points)
+    scores = None
+    if has_scores:
+        scores = np.stack([
+            np.asarray(s, dtype=np.float64) if s is not None else np.full(keypoints.shape[1], np.nan)
+            for s in point_scores
+        ])
+    return np.asarray(frame_indices, dtype=np.int64), keypoints, scores
+
+
+def encode_keypoints_json(data: Any, level: int = 6) -> bytes:
+    return encode_keypoints(*keypoints_from_json(data), level=level)
+
+
+class KeypointSequence:
+    """
+    二進位關節點序列。建立時只解析檔頭，第一次存取 frame_idx / keypoints / scores 時才解壓縮，
+    之後直接回傳快取的 NumPy 陣列 (唯讀)。
+    """
+
+    __slots__ = ("_blob", "version", "flags", "n_keypoints", "n_frames", "coord_scale",
+                 "_frame_idx", "_keypoints", "_scores")
+
+    def __init__(self, blob: bytes):
+        if len(blob) < _HEADER.size:
+            raise ValueError("關節點資料長度不足")
+        magic, version, flags, n_keypoints, n_frames, scale, _ = _HEADER.unpack_from(blob)
+        if magic != MAGIC:
+            raise ValueError("不是關節點序列格式")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"不支援的關節點格式版本：{version}")
+        self._blob = blob
+        self.version = version
+        self.flags = flags
+        self.n_keypoints = n_keypoints
+        self.n_frames = n_frames
+        self.coord_scale = scale
+        self._frame_idx = None
+        self._keypoints = None
+        self._scores = None
+
+    @classmethod
+    def from_arrays(cls, frame_idx, keypoints, scores=None) -> "KeypointSequence":
+        return cls(encode_keypoints(frame_idx, keypoints, scores))
+
+    @classmethod
+    def from_json(cls, data: Any) -> "KeypointSequence":
+        return cls(encode_keypoints_json(data))
+
+    def to_bytes(self) -> bytes:
+        return self._blob
+
+    @property
+    def has_scores(self) -> bool:
+        return bool(self.flags & FLAG_HAS_SCORES)
+
+    def _decode(self):
+        payload = zlib.decompress(memoryview(self._blob)[_HEADER.size:])
+        n, k = self.n_frames, self.n_keypoints
+        offset = 0
+        deltas = np.frombuffer(payload, dtype="<i4", count=n, offset=offset)
+        offset += deltas.nbytes
+        quantized = np.frombuffer(payload, dtype="<i2", count=n * k * 2, offset=offset).reshape(n, k, 2)
+        offset += quantized.nbytes
+
+        keypoints = quantized.astype(np.float32)
+        keypoints[quantized == _MISSING] = np.nan
+        keypoints /= np.float32(self.coord_scale)
+        frame_idx = np.cumsum(deltas, dtype=np.int64)
+        scores = None
+        if self.has_scores:
+            scores = np.frombuffer(payload, dtype="<f2", count=n * k, offset=offset).reshape(n, k).astype(np.float32)
+            scores.flags.writeable = False
+
+        keypoints.flags.writeable = False
+        frame_idx.flags.writeable = False
+        self._frame_idx, self._keypoints, self._scores = frame_idx, keypoints, scores
+
+    @property
+    def frame_idx(self) -> np.ndarray:
+        if self._frame_idx is None:
+            self._decode()
+        return self._frame_idx
+
+    @property
+    def keypoints(self) -> np.ndarray:
+        """(N, K, 2) float32 像素座標。"""
+        if self._keypoints is None:
+            self._decode()
+        return self._keypoints
+
+    @property
+    def scores(self) -> Optional[np.ndarray]:
+        """(N, K) float32 信心分數；沒有分數時為 None。"""
+        if self._keypoints is None:
+            self._decode()
+        return self._scores
+
+    def to_frame_list(self) -> List[Optional[List[List[float]]]]:
+        """還原成逐幀 [x, y(, score)] 串列 (沒偵測到人的幀為 None)，供仍使用 JSON 格式的程式。"""
+        total = int(self.frame_idx[-1]) + 1 if self.n_frames else 0
+        frames: List[Optional[List[List[float]]]] = [None] * total
+        columns = [self.keypoints]
+        if self.scores is not None:
+            columns.append(self.scores[..., None])
+        merged = np.concatenate(columns, axis=2).astype(np.float64)
+        for i, frame_idx in enumerate(self.frame_idx):
+            frames[int(frame_idx)] = merged[i].tolist()
+        return frames
+
+    def __len__(self) -> int:
+        return self.n_frames
+
+    def __repr__(self) -> str:
+        return (f"KeypointSequence(v{self.version}, frames={self.n_frames}, keypoints={self.n_keypoints}, "
+                f"bytes={len(self._blob)})")
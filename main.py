@@ -1,11 +1,18 @@
 # 職責: 作為 API 的入口點，接收請求並完全轉交給服務層處理。
 
+import asyncio
+import json
 import logging
+import os
+import threading
+import uuid
+from contextlib import asynccontextmanager
 from typing import Optional, List
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Query, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Query, Body, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
@@ -17,8 +24,20 @@ import uvicorn
 from crud import create_pitch_analysis
 import crud
 import services
+import rescoring
+import reanalysis
+import video_renderer
+import metrics
+from inference_client import BackendUnavailableError
+from single_flight import IdempotencyKeyConflict
+from admission import AdmissionRejected
+from scratch_space import ScratchQuotaExceeded
+from config import STORAGE_BACKEND, LOCAL_STORAGE_DIR, BATCH_MAX_FILES, SCRATCH_JANITOR_INTERVAL_SECONDS, STARTUP_WARM_UP
+from config import SERVER_MODE, WEB_WORKERS, WORKER_MAX_REQUESTS, WORKER_MAX_REQUESTS_JITTER
+from config import SESSION_MAX_CONCURRENCY
 from database import get_db, PitchAnalyses
-from models import PitchAnalysisUpdate
+from models import PitchAnalysisUpdate, SimilarModelsRequest
+from profile_catalog import format_model_display_name
 
 # --- 全域設定 ---
 logging.basicConfig(
@@ -28,7 +47,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動：背景執行緒預熱 (模型與延後匯入的模組)，不等它完成就開始接受請求 (健康檢查立即通過)；
+    # pre-fork 模式的工作行程已由父行程預熱過
+    if STARTUP_WARM_UP and not services.warm_up_status["done"]:
+        threading.Thread(target=services.warm_up, name="warm-up", daemon=True).start()
+    # 定期清掉中斷的請求 / 已結束的行程留下的暫存目錄，並更新磁碟用量指標
+    scratch_janitor = asyncio.ensure_future(services.analysis_scratch.run_janitor(
+        SCRATCH_JANITOR_INTERVAL_SECONDS, services.LEGACY_SCRATCH_PATTERNS))
+    # 接手原本執行的行程已結束 (重啟、pre-fork 工作行程輪替) 的重新計分工作
+    rescore_supervisor = asyncio.ensure_future(rescoring.run_job_supervisor())
+    try:
+        yield
+    finally:
+        scratch_janitor.cancel()
+        rescore_supervisor.cancel()
+        # 本行程的重新計分工作處理完目前的區塊後交出租約，由其他工作行程立即接手
+        await asyncio.to_thread(rescoring.stop_local_jobs)
+        reanalysis.shutdown_process_pool()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _scratch_unavailable(e: ScratchQuotaExceeded) -> HTTPException:
+    # 暫存空間配額已滿且等待逾時
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
 
 # --- CORS 設置更新 ---
 # 為了提高安全性與瀏覽器相容性，我們將允許所有來源 ("*")
@@ -48,48 +93,263 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 使用本機儲存後端時，由本服務直接提供渲染影片與關鍵影格的下載
+if STORAGE_BACKEND == "local":
+    os.makedirs(LOCAL_STORAGE_DIR, exist_ok=True)
+    app.mount("/local-storage", StaticFiles(directory=LOCAL_STORAGE_DIR), name="local-storage")
+
 # --- API 路由 (您的既有程式碼維持不變) ---
 
+def _validate_render_profile(render_profile: Optional[str]):
+    if render_profile:
+        try:
+            services.resolve_render_profile(render_profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+
+def _trim_seconds(trim_start: Optional[float], trim_end: Optional[float]):
+    if trim_start is None and trim_end is None:
+        return None
+    if (trim_start is not None and trim_start < 0) or (
+            trim_start is not None and trim_end is not None and trim_end <= trim_start):
+        raise HTTPException(status_code=400, detail="trim_start / trim_end 範圍不正確")
+    return trim_start, trim_end
+
+
 @app.post("/analyze-pitch/")
 async def analyze_pitch(
-    db: Session = Depends(get_db),
     video_file: UploadFile = File(...), 
     player_name: str = Form(...),
     benchmark_name: str = Form(...),
-    compare_average: bool = Form(False)
+    compare_average: bool = Form(False),
+    rank_similar_models: bool = Form(False),
+    top_k: int = Form(5),
+    render_profile: Optional[str] = Form(None),
+    trim_start: Optional[float] = Form(None),
+    trim_end: Optional[float] = Form(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     接收前端請求，將所有工作轉交給服務層，並直接回傳服務層的結果。
+    rank_similar_models 為 True 時，回應會多一個 similar_models 欄位 (最像的前 top_k 位菁英選手模型)。
+    render_profile 指定渲染設定 (full / preview / fast)，未指定時使用部署預設值。
+    trim_start / trim_end (秒) 只分析影片的這一段，結果的幀編號仍以原始影片為準。
+    相同影片與參數的並行請求共用同一次分析；帶 Idempotency-Key 標頭重送時回傳同一筆結果。
+    伺服器忙碌且排隊已滿時回 429 與 Retry-After。
     """
     if not video_file.filename:
         raise HTTPException(status_code=400, detail="未上傳影片檔案")
+    _validate_render_profile(render_profile)
 
     try:
         final_response_package = await services.analyze_pitch_service(
-            db=db,
             video_file=video_file,
             player_name=player_name,
             benchmark_name=benchmark_name,
-            compare_average=compare_average 
+            compare_average=compare_average,
+            similar_models_top_k=top_k if rank_similar_models else None,
+            render_profile=render_profile,
+            trim_seconds=_trim_seconds(trim_start, trim_end),
+            idempotency_key=idempotency_key
         )
         
         return final_response_package
 
     except HTTPException as e:
         raise e
+    except IdempotencyKeyConflict as e:
+        raise HTTPException(status_code=422, detail=f"Idempotency-Key 已用於不同的影片或參數: {e}")
+    except AdmissionRejected as e:
+        # 並行數 / 記憶體預算已滿且排隊已滿 (或排隊逾時)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+    except ScratchQuotaExceeded as e:
+        raise _scratch_unavailable(e)
+    except BackendUnavailableError as e:
+        # 推論服務的斷路器斷開中：直接回 503，請前端稍後再試
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(max(1, int(e.retry_after + 0.5)))})
     except Exception as e:
         logger.error(f"影片分析處理失敗: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"影片分析處理失敗: {str(e)}")
 
 
+@app.post("/analyze-pitch/batch/")
+async def analyze_pitch_batch(
+    video_files: List[UploadFile] = File(...),
+    player_name: str = Form(...),
+    benchmark_name: str = Form(...),
+    compare_average: bool = Form(False),
+    max_concurrency: Optional[int] = Form(None),
+    rank_similar_models: bool = Form(False),
+    top_k: int = Form(5),
+    render_profile: Optional[str] = Form(None)
+):
+    """
+    一次上傳同一位投手的多支影片 (例如整場牛棚練投)，以有限的並行數逐支分析。
+    回應為 NDJSON 串流：每完成一支影片就送出一行結果，最後一行為批次摘要。
+    """
+    if not video_files or any(not f.filename for f in video_files):
+        raise HTTPException(status_code=400, detail="未上傳影片檔案")
+    if len(video_files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"單一批次最多 {BATCH_MAX_FILES} 支影片")
+    _validate_render_profile(render_profile)
+
+    try:
+        workspace = await services.open_upload_scratch("batch", video_files)
+    except ScratchQuotaExceeded as e:
+        raise _scratch_unavailable(e)
+    try:
+        batch_id, spooled_videos = await asyncio.to_thread(services.spool_batch_uploads, video_files, workspace)
+    except Exception as e:
+        workspace.close()
+        logger.error(f"批次影片暫存失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"批次影片暫存失敗: {str(e)}")
+
+    async def ndjson_stream():
+        async for item in services.analyze_pitch_batch_service(
+            workspace=workspace,
+            batch_id=batch_id,
+            spooled_videos=spooled_videos,
+            player_name=player_name,
+            benchmark_name=benchmark_name,
+            compare_average=compare_average,
+            max_concurrency=max_concurrency,
+            similar_models_top_k=top_k if rank_similar_models else None,
+            render_profile=render_profile
+        ):
+            yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+    # 串流還沒開始就中斷時 analyze_pitch_batch_service 不會執行，回應結束後再確認一次暫存目錄已刪除
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson",
+                             background=BackgroundTask(workspace.close))
+
+
+@app.post("/analyze-pitch/session/")
+async def analyze_pitch_session(
+    video_file: UploadFile = File(...),
+    player_name: str = Form(...),
+    benchmark_name: str = Form(...),
+    compare_average: bool = Form(False),
+    max_concurrency: Optional[int] = Form(None),
+    rank_similar_models: bool = Form(False),
+    top_k: int = Form(5),
+    render_profile: Optional[str] = Form(None)
+):
+    """
+    上傳一整段牛棚練投的長影片，自動切出每一次投球並行分析，每次投球存成一筆分析紀錄 (同一個 session_id)。
+    回應為 NDJSON 串流：每分析完一段就送出一行 (status 為 ok / no_pitch / error)，最後一行為場次摘要。
+    """
+    if not video_file.filename:
+        raise HTTPException(status_code=400, detail="未上傳影片檔案")
+    _validate_render_profile(render_profile)
+
+    try:
+        workspace = await services.open_session_scratch(video_file, max_concurrency or SESSION_MAX_CONCURRENCY)
+    except ScratchQuotaExceeded as e:
+        raise _scratch_unavailable(e)
+    try:
+        temp_video_path = await asyncio.to_thread(services.spool_upload, video_file, workspace)
+    except Exception as e:
+        workspace.close()
+        raise HTTPException(status_code=500, detail=f"無法儲存影片檔案: {str(e)}")
+    session_id = uuid.uuid4().hex[:12]
+
+    async def ndjson_stream():
+        async for item in services.analyze_session_service(
+            workspace=workspace,
+            session_id=session_id,
+            temp_video_path=temp_video_path,
+            filename=video_file.filename,
+            player_name=player_name,
+            benchmark_name=benchmark_name,
+            compare_average=compare_average,
+            max_concurrency=max_concurrency,
+            similar_models_top_k=top_k if rank_similar_models else None,
+            render_profile=render_profile
+        ):
+            yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson",
+                             headers={"X-Session-Id": session_id},
+                             background=BackgroundTask(workspace.close))
+
+
+@app.post("/analyze-pitch/stream/")
+async def analyze_pitch_stream(
+    video_file: UploadFile = File(...),
+    player_name: str = Form(...),
+    benchmark_name: str = Form(...),
+    compare_average: bool = Form(False),
+    rank_similar_models: bool = Form(False),
+    top_k: int = Form(5),
+    render_profile: Optional[str] = Form(None),
+    trim_start: Optional[float] = Form(None),
+    trim_end: Optional[float] = Form(None)
+):
+    """
+    與 /analyze-pitch/ 相同的分析，但以 Server-Sent Events 在每個階段完成時立即送出結果：
+    pose → keyframes → features → pose_score → (similar_models) → ball_score → speed → video / keyframe_urls → record，
+    最後送出 result (與 /analyze-pitch/ 相同的完整回應) 或 error。
+    """
+    if not video_file.filename:
+        raise HTTPException(status_code=400, detail="未上傳影片檔案")
+    _validate_render_profile(render_profile)
+    trim_seconds = _trim_seconds(trim_start, trim_end)
+
+    try:
+        workspace = await services.open_upload_scratch("stream", [video_file])
+    except ScratchQuotaExceeded as e:
+        raise _scratch_unavailable(e)
+    try:
+        temp_video_path = await asyncio.to_thread(services.spool_upload, video_file, workspace)
+    except Exception as e:
+        workspace.close()
+        raise HTTPException(status_code=500, detail=f"無法儲存影片檔案: {str(e)}")
+    # 回應開始串流後就無法再改狀態碼，准入控制必須在這之前完成 (名額由串流結束時歸還)
+    try:
+        admission_slot = await services.analysis_admission.acquire(os.path.getsize(temp_video_path))
+    except AdmissionRejected as e:
+        workspace.close()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+
+    def release_resources():
+        # 串流沒有開始 (例如用戶端在回應前斷線) 時服務層不會執行到歸還，在這裡補上 (重複呼叫無妨)
+        admission_slot.release()
+        workspace.close()
+
+    async def event_stream():
+        async for item in services.analyze_pitch_stream_service(
+            workspace=workspace,
+            temp_video_path=temp_video_path,
+            filename=video_file.filename,
+            player_name=player_name,
+            benchmark_name=benchmark_name,
+            compare_average=compare_average,
+            similar_models_top_k=top_k if rank_similar_models else None,
+            render_profile=render_profile,
+            trim_seconds=trim_seconds,
+            admission_slot=admission_slot
+        ):
+            data = json.dumps(item["data"], ensure_ascii=False, default=str)
+            yield f"event: {item['event']}\ndata: {data}\n\n"
+
+    # 關閉反向代理的緩衝，事件才會立即送達
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(release_resources))
+
+
 @app.get("/history/")
-async def get_history_analyses(player_name: str = None, db: Session = Depends(get_db)):
+async def get_history_analyses(player_name: str = None, session_id: Optional[str] = None, db: Session = Depends(get_db)):
     try:
-        history_records = crud.get_pitch_analyses(db, player_name)
+        history_records = crud.get_pitch_analyses(db, player_name, session_id=session_id)
         return [
             {
                 "id": record.id,
                 "video_path": record.video_path,
+                "video_endpoint": f"/analyses/{record.id}/video",
+                "hls_url": record.hls_url,
                 "max_speed_kmh": record.max_speed_kmh,
                 "pose_score": record.pose_score,
                 "ball_score": record.ball_score,
@@ -97,6 +357,8 @@ async def get_history_analyses(player_name: str = None, db: Session = Depends(ge
                 "player_name": record.player_name,
                 "created_at": record.created_at.isoformat() if record.created_at else None,
                 "pose_score_message": getattr(record, 'pose_score_message', '分析成功'),
+                "session_id": record.session_id,
+                "session_offset_seconds": record.session_offset_seconds,
                 "keyframe_urls": {
                     "release_frame_url": record.release_frame_url or "",
                     "landing_frame_url": record.landing_frame_url or "",
@@ -118,34 +380,12 @@ async def get_available_models(db: Session = Depends(get_db)):
     try:
         models_from_db = crud.get_all_pitch_models(db)
         
-        # 建立一個字典來翻譯球種縮寫
-        pitch_type_translator = {
-            "FS": "分指快速球 / 指叉球 (Splitter / Split-Finger Fastball)",
-            "FF": "四縫線快速球 (Four-Seam Fastball)",
-            "SL": "滑球 (Slider)",
-            "CU": "曲球 (Curveball)",
-            "CH": "變速球 (Changeup)",
-            "FO": "指叉球 (Forkball)",
-            "all": "通用"
-        }
-        
         formatted_models = []
         for model in models_from_db:
-            parts = model.model_name.split('_')
             # 預期格式為 "姓, 名_球種縮寫_v1" 或 "名字_姓氏_球種縮寫_v1"
-            if len(parts) >= 2:
-                player_name = parts[0].replace(",", ", ")
-                pitch_type_abbr = parts[1] if len(parts) > 1 else "all"
-                
-                # 產生顯示用的名稱
-                pitch_type_display = pitch_type_translator.get(pitch_type_abbr, pitch_type_abbr)
-                display_name = f"{player_name} - {pitch_type_display}"
-            else:
-                display_name = model.model_name # 如果格式不符，使用原名
-            
             formatted_models.append({
                 "model_name": model.model_name,      # 後端比對時需要的原始名稱
-                "display_name": display_name,        # 前端顯示用的乾淨名稱
+                "display_name": format_model_display_name(model.model_name),  # 前端顯示用的乾淨名稱
                 "profile_data": model.profile_data   # 【重點】將完整的 profile_data 一併回傳
             })
             
@@ -155,6 +395,112 @@ async def get_available_models(db: Session = Depends(get_db)):
         logger.error(f"無法獲取模型列表: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"無法獲取模型列表: {str(e)}")
 
+@app.post("/models/similar/")
+async def get_similar_models(request: SimilarModelsRequest, db: Session = Depends(get_db)):
+    """
+    「你的投球最像哪位職業選手」：將一組 biomechanics_features 與所有菁英模型一次比對，
+    回傳最接近的前 top_k 個模型與各特徵的 Z-score 距離。
+    """
+    try:
+        return services.rank_similar_models(db, request.biomechanics_features, request.top_k)
+    except SQLAlchemyError as e:
+        logger.error(f"相似選手排名失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"相似選手排名失敗: {str(e)}")
+
+@app.get("/analyses/{analysis_id}/similar-models")
+async def get_analysis_similar_models(analysis_id: int, top_k: int = Query(5), db: Session = Depends(get_db)):
+    """以已存檔分析紀錄的 biomechanics_features 進行相似選手排名。"""
+    try:
+        analysis = crud.get_pitch_analysis(db, analysis_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="分析紀錄未找到")
+        return services.rank_similar_models(db, analysis.biomechanics_features, top_k)
+    except SQLAlchemyError as e:
+        logger.error(f"相似選手排名失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"相似選手排名失敗: {str(e)}")
+
+@app.post("/models/{model_name}/rescore", status_code=202)
+async def rescore_model_analyses(model_name: str, resume_after_id: int = Query(0), db: Session = Depends(get_db)):
+    """
+    模型重建後，於背景重新計算所有以該模型比對的歷史 pose_score。
+    回傳工作資訊，可用 GET /rescore-jobs/{job_id} 查詢進度 (工作記錄在資料庫，任一工作行程都查得到)；
+    同一個模型已有進行中的工作時回傳該工作。
+    """
+    if not crud.get_pitch_model_by_name(db, model_name=model_name):
+        raise HTTPException(status_code=404, detail="找不到指定的模型")
+    job = rescoring.start_rescore_job(model_name, resume_after_id=resume_after_id)
+    # 沒有記錄比對模型的舊紀錄不在重新計分範圍內
+    return {**job.to_dict(), "unattributed_analyses": rescoring.count_unattributed_analyses(db)}
+
+@app.get("/rescore-jobs/{job_id}")
+async def get_rescore_job(job_id: str):
+    job = rescoring.get_rescore_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到重新計分工作")
+    return job.to_dict()
+
+@app.delete("/rescore-jobs/{job_id}")
+async def cancel_rescore_job(job_id: str):
+    """要求停止重新計分；目前的區塊處理完後停止，last_id 可作為續跑點。"""
+    job = rescoring.cancel_rescore_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到重新計分工作")
+    return job.to_dict()
+
+@app.post("/analyses/{analysis_id}/reanalyze")
+async def reanalyze_analysis(analysis_id: int, db: Session = Depends(get_db)):
+    """以保存的骨架 / 球路軌跡重新計算特徵、分數與球速 (不需重新上傳影片)。"""
+    try:
+        analysis = crud.get_pitch_analysis(db, analysis_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="分析紀錄未找到")
+        if analysis.tracks_blob is None:
+            raise HTTPException(status_code=409, detail="此分析紀錄沒有保存軌跡，無法重新分析")
+        analysis = await reanalysis.reanalyze_analysis(db, analysis)
+        return {
+            "id": analysis.id,
+            "max_speed_kmh": analysis.max_speed_kmh,
+            "pose_score": analysis.pose_score,
+            "ball_score": analysis.ball_score,
+            "biomechanics_features": analysis.biomechanics_features,
+            "benchmark_model_name": analysis.benchmark_model_name,
+            "reanalyzed_at": analysis.reanalyzed_at.isoformat() if analysis.reanalyzed_at else None
+        }
+    except SQLAlchemyError as e:
+        logger.error(f"重新分析失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"重新分析失敗: {str(e)}")
+
+@app.get("/analyses/{analysis_id}/video")
+async def get_analysis_video(analysis_id: int, profile: Optional[str] = Query(None), db: Session = Depends(get_db)):
+    """
+    取得分析影片的網址。分析時沒有渲染 (延遲渲染) 的紀錄會在第一次呼叫時由原始影片與軌跡渲染並快取，
+    同時間的多個請求共用同一次渲染。profile 指定渲染設定，未指定時使用分析時選擇的設定。
+    """
+    try:
+        analysis = crud.get_pitch_analysis(db, analysis_id)
+        if not analysis:
+            raise HTTPException(status_code=404, detail="分析紀錄未找到")
+        try:
+            render_profile = services.resolve_render_profile(profile or analysis.video_render_profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            video = await video_renderer.get_or_render_video(analysis, render_profile,
+                                                             scratch=services.analysis_scratch)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ScratchQuotaExceeded as e:
+            raise _scratch_unavailable(e)
+        return {"id": analysis_id, "render_profile": render_profile.name, **video}
+    except SQLAlchemyError as e:
+        logger.error(f"取得分析影片失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"取得分析影片失敗: {str(e)}")
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.error(f"影片渲染失敗: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"影片渲染失敗: {str(e)}")
+
 @app.get("/user-average-profile/{player_name}")
 async def get_user_average_profile_endpoint(player_name: str, db: Session = Depends(get_db)):
     """
@@ -200,7 +546,23 @@ async def update_analysis(analysis_id: int, updated_data: PitchAnalysisUpdate, d
          raise HTTPException(status_code=500, detail=f"更新分析紀錄失敗: {e}")
 
 
+@app.get("/healthz")
+async def healthz():
+    """健康檢查：行程可以接受請求就回 200；warm_up 為背景預熱的進度 (未完成時第一個請求會自行載入)。"""
+    return {"status": "ok", "warm_up": services.warm_up_status}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """行程內指標 (推論 API 的每次嘗試、重試、對沖、斷路器狀態等)，Prometheus 文字格式。"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    import os
     port = int(os.environ.get("PORT", 9000)) # 建議使用一個新的埠號
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
\ No newline at end of file
+    if SERVER_MODE == "prefork":
+        import prefork
+        prefork.serve("main:app", host="0.0.0.0", port=port, workers=WEB_WORKERS,
+                      max_requests=WORKER_MAX_REQUESTS, max_requests_jitter=WORKER_MAX_REQUESTS_JITTER)
+    else:
+        uvicorn.run("main:app", host="0.0.0.0", port=port)
\ No newline at end of file
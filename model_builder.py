@@ -0,0 +1,289 @@
+# 檔案: model_builder.py
+# 職責: 由訓練用的 kinematics / pitch_record 資料表批次建置菁英模型 (pitch_model.profile_data)。
+#
+#   - 一次查詢把所有 kinematics 讀成欄式 NumPy 陣列，以排序 + 切分的方式分組，不逐筆建立 ORM 物件
+#   - 每位選手建立各球種模型 "{player}_{pitch}_v1" 與不分球種的 "{player}_all_v1"
+#     (與 services.get_comparison_model 的命名規則一致)
+#   - 每個群組以來源資料 (kinematics id + 數值) 的雜湊作為指紋，與上次建置時存入的指紋相同就略過
+#   - 所有變動的模型在同一個交易中 upsert
+#
+# 命令列：python model_builder.py [--player "Cole, Gerrit"] [--force] [--dry-run] [--rescore]
+
+import argparse
+import hashlib
+import logging
+import time
+import warnings
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import MODEL_BUILD_MIN_SAMPLES
+from database import SessionLocal, Kinematics, PitchModel, PitchRecording
+from profile_catalog import profile_catalog
+
+logger = logging.getLogger(__name__)
+
+MODEL_VERSION = "v1"
+ALL_PITCH_TYPES = "all"
+
+# kinematics 資料表中納入模型的數值欄位 (欄位名稱即 profile_data 的鍵)
+FEATURE_COLUMNS = [
+    "trunk_flexion_excursion",
+    "pelvis_obliquity_at_fc",
+    "trunk_rotation_at_br",
+    "shoulder_abduction_at_br",
+    "trunk_flexion_at_br",
+    "trunk_lateral_flexion_at_hs",
+    "release_frame",
+    "landing_frame",
+    "shoulder_frame",
+    "total_frames",
+]
+
+
+@dataclass
+class KinematicsColumns:
+    """整張訓練表的欄式資料 (N = kinematics 筆數)。"""
+    ids: np.ndarray                  # (N,) int64
+    player_names: np.ndarray         # (N,) object
+    pitch_types: np.ndarray          # (N,) object，缺少球種時為 None
+    values: np.ndarray               # (N, F) float64，缺值為 NaN
+
+
+@dataclass
+class BuildReport:
+    groups: int = 0
+    built: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    skipped_small: List[str] = field(default_factory=list)
+    elapsed_s: float = 0.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "groups": self.groups,
+            "built": self.built,
+            "unchanged": self.unchanged,
+            "skipped_small": self.skipped_small,
+            "elapsed_s": round(self.elapsed_s, 3),
+        }
+
+
+def make_model_name(player_name: str, pitch_type: str) -> str:
+    return f"{player_name}_{pitch_type}_{MODEL_VERSION}"
+
+
+def load_kinematics_columns(db: Session, player_name: Optional[str] = None) -> KinematicsColumns:
+    """以單一 JOIN 查詢讀出所有 kinematics，轉成欄式陣列。"""
+    query = (
+        select(Kinematics.id, PitchRecording.player_name, PitchRecording.pitch_type,
+               *[getattr(Kinematics, column) for column in FEATURE_COLUMNS])
+        .join(PitchRecording, Kinematics.pitch_record_id == PitchRecording.id)
+        .where(PitchRecording.player_name.isnot(None))
+        .order_by(Kinematics.id)
+    )
+    if player_name:
+        query = query.where(PitchRecording.player_name == player_name)
+    rows = db.execute(query).all()
+
+    if not rows:
+        return KinematicsColumns(np.empty(0, dtype=np.int64), np.empty(0, dtype=object),
+                                 np.empty(0, dtype=object), np.empty((0, len(FEATURE_COLUMNS))))
+
+    columns = list(zip(*rows))
+    values = np.array(columns[3:], dtype=np.float64).T  # None 轉為 NaN
+    return KinematicsColumns(
+        ids=np.array(columns[0], dtype=np.int64),
+        player_names=np.array(columns[1], dtype=object),
+        pitch_types=np.array(columns[2], dtype=object),
+        values=values,
+    )
+
+
+def group_indices(data: KinematicsColumns) -> Dict[Tuple[str, str], np.ndarray]:
+    """
+    回傳 {(選手, 球種): 列索引}，另外每位選手一個 (選手, "all") 群組。
+    以穩定排序後依邊界切分，群組內維持 kinematics id 的順序 (指紋因此與讀取順序無關)。
+    """
+    groups: Dict[Tuple[str, str], np.ndarray] = {}
+    if data.ids.size == 0:
+        return groups
+
+    players, player_codes = np.unique(data.player_names, return_inverse=True)
+    has_pitch = np.array([p is not None and p != "" for p in data.pitch_types], dtype=bool)
+    pitch_labels = np.where(has_pitch, data.pitch_types, "").astype(str)
+    pitches, pitch_codes = np.unique(pitch_labels, return_inverse=True)
+
+    # 選手 × 球種
+    keys = player_codes * len(pitches) + pitch_codes
+    order = np.argsort(keys, kind="stable")
+    boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+    for idx in np.split(order, boundaries):
+        pitch = pitches[pitch_codes[idx[0]]]
+        if pitch:
+            groups[(players[player_codes[idx[0]]], pitch)] = idx
+
+    # 選手 × 全部球種
+    order = np.argsort(player_codes, kind="stable")
+    boundaries = np.flatnonzero(np.diff(player_codes[order])) + 1
+    for idx in np.split(order, boundaries):
+        groups[(players[player_codes[idx[0]]], ALL_PITCH_TYPES)] = idx
+    return groups
+
+
+def group_fingerprint(data: KinematicsColumns, idx: np.ndarray) -> str:
+    """來源列的 id 與數值雜湊；新增、刪除或修改任何一筆都會改變指紋。"""
+    digest = hashlib.sha1()
+    digest.update(MODEL_VERSION.encode())
+    digest.update(",".join(FEATURE_COLUMNS).encode())
+    digest.update(np.ascontiguousarray(data.ids[idx]).tobytes())
+    digest.update(np.ascontiguousarray(data.values[idx]).tobytes())
+    return digest.hexdigest()
+
+
+def compute_profile_data(values: np.ndarray) -> Dict[str, Dict[str, float]]:
+    """
+    一次計算群組內每個特徵的統計，格式與 crud.calculate_user_average_profile 相同。
+    缺值 (NaN) 不列入；整欄都是缺值的特徵不會出現在結果中。
+    """
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    profile_data = {}
+    if not counts.any():
+        return profile_data
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # 整欄缺值時 nan* 函式的 "All-NaN slice" 警告
+        means = np.nanmean(values, axis=0)
+        stds = np.nanstd(values, axis=0)
+        mins = np.nanmin(values, axis=0)
+        maxs = np.nanmax(values, axis=0)
+        p10, p50, p90 = np.nanpercentile(values, [10, 50, 90], axis=0)
+
+    for j, column in enumerate(FEATURE_COLUMNS):
+        if counts[j] == 0:
+            continue
+        profile_data[column] = {
+            "mean": float(means[j]),
+            "std": float(stds[j]),
+            "min": float(mins[j]),
+            "max": float(maxs[j]),
+            "p10": float(p10[j]),
+            "p50_median": float(p50[j]),
+            "p90": float(p90[j]),
+        }
+    return profile_data
+
+
+def _upsert_models(db: Session, rows: List[Dict]):
+    """PostgreSQL / SQLite 使用 INSERT ... ON CONFLICT (model_name) DO UPDATE；其他資料庫逐筆合併。"""
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(PitchModel).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[PitchModel.model_name],
+            set_={
+                "profile_data": statement.excluded.profile_data,
+                "method": statement.excluded.method,
+                "source_feature_count": statement.excluded.source_feature_count,
+                "source_fingerprint": statement.excluded.source_fingerprint,
+                "updated_at": func.now(),
+            },
+        )
+        db.execute(statement)
+        return
+
+    existing = {m.model_name: m for m in db.query(PitchModel).filter(
+        PitchModel.model_name.in_([row["model_name"] for row in rows]))}
+    for row in rows:
+        model = existing.get(row["model_name"])
+        if model is None:
+            db.add(PitchModel(**row))
+        else:
+            for key, value in row.items():
+                setattr(model, key, value)
+
+
+def build_pitch_models(db: Session, player_name: Optional[str] = None, force: bool = False,
+                       dry_run: bool = False, min_samples: int = MODEL_BUILD_MIN_SAMPLES) -> BuildReport:
+    """
+    重新計算來源資料有變動的模型並寫回 pitch_model。
+    force=True 時忽略指紋全部重建；dry_run=True 時只回報會重建哪些模型。
+    """
+    start = time.perf_counter()
+    report = BuildReport()
+
+    data = load_kinematics_columns(db, player_name)
+    groups = group_indices(data)
+    report.groups = len(groups)
+
+    names = [make_model_name(player, pitch) for player, pitch in groups]
+    stored = dict(
+        db.query(PitchModel.model_name, PitchModel.source_fingerprint)
+        .filter(PitchModel.model_name.in_(names)).all()
+    ) if names else {}
+
+    rows = []
+    for (player, pitch), idx in groups.items():
+        model_name = make_model_name(player, pitch)
+        if idx.size < min_samples:
+            report.skipped_small.append(model_name)
+            continue
+        fingerprint = group_fingerprint(data, idx)
+        if not force and stored.get(model_name) == fingerprint:
+            report.unchanged += 1
+            continue
+        rows.append({
+            "model_name": model_name,
+            "method": "percentile",
+            "profile_data": compute_profile_data(data.values[idx]),
+            "source_feature_count": int(idx.size),
+            "source_fingerprint": fingerprint,
+        })
+    report.built = [row["model_name"] for row in rows]
+
+    if rows and not dry_run:
+        try:
+            _upsert_models(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        # Core 的 INSERT 不會觸發 ORM 事件，手動讓相似模型目錄失效
+        profile_catalog.invalidate()
+
+    report.elapsed_s = time.perf_counter() - start
+    logger.info(f"模型建置完成：{report.groups} 個群組，重建 {len(report.built)} 個、未變動 {report.unchanged} 個、"
+                f"樣本不足 {len(report.skipped_small)} 個 ({report.elapsed_s:.2f} 秒)")
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="由 kinematics 訓練資料建置菁英模型")
+    parser.add_argument("--player", help="只建置指定選手的模型")
+    parser.add_argument("--force", action="store_true", help="忽略指紋，全部重建")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會重建的模型，不寫入資料庫")
+    parser.add_argument("--min-samples", type=int, default=MODEL_BUILD_MIN_SAMPLES)
+    parser.add_argument("--rescore", action="store_true", help="重建後以新模型重新計算歷史分析分數")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = build_pitch_models(db, player_name=args.player, force=args.force,
+                                    dry_run=args.dry_run, min_samples=args.min_samples)
+    finally:
+        db.close()
+    print(result.to_dict())
+
+    if args.rescore and not args.dry_run:
+        from rescoring import rescore_analyses_for_model
+        for model_name in result.built:
+            print(rescore_analyses_for_model(model_name).to_dict())
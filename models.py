@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, Optional
 from pydantic import BaseModel
 
 class PitchAnalysisUpdate(BaseModel):
@@ -9,3 +9,7 @@ class PitchAnalysisUpdate(BaseModel):
     release_frame_url: Optional[str] = None
     landing_frame_url: Optional[str] = None
     shoulder_frame_url: Optional[str] = None
+
+class SimilarModelsRequest(BaseModel):
+    biomechanics_features: Dict[str, Any]
+    top_k: int = 5
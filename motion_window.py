@@ -0,0 +1,225 @@
+# 檔案: motion_window.py
+# 職責: 在本機以低成本找出影片中「正在投球」的區間，只把這段 (加上前後緩衝) 送去遠端推論。
+#
+#   多數影片前後都有一段投手站著不動的準備 / 收尾畫面，但 Pose / Ball API 每一幀都要計費與計時。
+#   作法：每隔幾幀解碼一幀並縮成小張灰階圖，與約 0.2 秒前的取樣幀相減，計算變動像素的比例當作動作量
+#   (只和相鄰取樣幀相減時，慢動作或細小的肢體在縮圖上幾乎沒有差異)；
+#   動作量超過門檻的取樣點 (中間短暫停頓會合併) 組成區段，取總動作量最大的區段，前後加上緩衝秒數。
+#   回傳的是原始影片的幀範圍 [start, end)，由 video_proxy 裁切並在推論後把幀編號換算回原始影片。
+#
+#   iter_pitch_segments：長時間的牛棚練投影片 (一支影片多次投球) 以同樣的動作量逐段切出每一次投球的候選區間。
+#   邊解碼邊產生結果，只保留最近 reference_seconds 秒的動作量 (計算門檻用)，記憶體用量與影片長度無關；
+#   門檻改以最近一段時間的最大動作量計算 (整段影片的最大值要全部掃完才知道)。
+#   候選區間是否真的是一次投球，由呼叫端以骨架的出手 / 肩膀展開偵測確認。
+
+import logging
+from dataclasses import dataclass
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MotionWindow:
+    start_frame: int
+    end_frame: int                      # 不含
+    frame_count: int                    # 原始影片幀數
+    peak_score: float                   # 最大動作量 (變動像素比例)
+
+    @property
+    def coverage(self) -> float:
+        return (self.end_frame - self.start_frame) / self.frame_count if self.frame_count else 1.0
+
+
+@dataclass
+class PitchSegment:
+    """長影片中一次投球的候選區間 (原始影片幀編號，已加上前後緩衝)。"""
+    index: int
+    start_frame: int
+    end_frame: int                      # 不含
+    motion_start: int                   # 動作量超過門檻的範圍 (不含緩衝)
+    motion_end: int
+    peak_score: float
+
+
+def motion_scores(video_path: str, sample_step: int, lag: int = 1, analysis_width: int = 160,
+                  pixel_threshold: int = 10) -> List[tuple]:
+    """
+    每 sample_step 幀取一幀，回傳 [(幀編號, 動作量)]；動作量為與 lag 個取樣點之前的幀相比，
+    灰階差超過 pixel_threshold 的像素比例。最前面 lag 個取樣幀沒有比較對象，不列入。
+    """
+    return list(iter_motion_scores(video_path, sample_step, lag, analysis_width, pixel_threshold))
+
+
+def iter_motion_scores(video_path: str, sample_step: int, lag: int = 1, analysis_width: int = 160,
+                       pixel_threshold: int = 10) -> Iterator[Tuple[int, float]]:
+    """motion_scores 的串流版本：邊解碼邊產生 (幀編號, 動作量)。"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"無法開啟影片：{video_path}")
+    history = deque(maxlen=lag)
+    frame_idx = 0
+    try:
+        while True:
+            if not cap.grab():
+                break
+            if frame_idx % sample_step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                h, w = frame.shape[:2]
+                small = cv2.resize(frame, (analysis_width, max(1, h * analysis_width // w)),
+                                   interpolation=cv2.INTER_AREA)
+                gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (3, 3), 0)
+                if len(history) == lag:
+                    diff = cv2.absdiff(gray, history[0])
+                    yield frame_idx, float(np.count_nonzero(diff > pixel_threshold)) / diff.size
+                history.append(gray)
+            frame_idx += 1
+    finally:
+        cap.release()
+
+
+def detect_motion_window(video_path: str,
+                         video_meta: Dict,
+                         sample_fps: float = 15,
+                         lag_seconds: float = 0.2,
+                         margin_seconds: float = 1.0,
+                         gap_seconds: float = 0.5,
+                         min_score: float = 0.002,
+                         relative_threshold: float = 0.1,
+                         max_coverage: float = 0.9) -> Optional[MotionWindow]:
+    """
+    找出投球區間。找不到明顯的動作、或區間已涵蓋幾乎整段影片 (裁切沒有意義) 時回傳 None。
+    門檻為 max(min_score, 最大動作量 * relative_threshold)，避免背景雜訊或鏡頭輕微晃動被當成動作。
+    """
+    fps = video_meta.get("fps") or 0
+    frame_count = video_meta.get("frame_count", 0)
+    if not fps or not frame_count:
+        return None
+    sample_step = max(1, int(round(fps / sample_fps)))
+    lag = max(1, int(round(lag_seconds * fps / sample_step)))
+    scores = motion_scores(video_path, sample_step, lag)
+    if not scores:
+        return None
+    peak = max(s for _, s in scores)
+    threshold = max(min_score, peak * relative_threshold)
+    if peak < min_score:
+        logger.info("動作偵測：沒有明顯動作，送出整段影片")
+        return None
+
+    # 超過門檻的取樣點組成區段；間隔不超過 gap_seconds 的區段合併 (例如抬腿後短暫停頓)
+    max_gap = max(sample_step, int(gap_seconds * fps))
+    segments = []                       # [start, end, 總動作量]
+    for frame_idx, score in scores:
+        if score < threshold:
+            continue
+        # 差值代表 (lag 個取樣點之前, 這一幀] 之間有變化
+        start = frame_idx - lag * sample_step
+        if segments and start - segments[-1][1] <= max_gap:
+            segments[-1][1] = frame_idx
+            segments[-1][2] += score
+        else:
+            segments.append([start, frame_idx, score])
+    start, end, _ = max(segments, key=lambda s: s[2])
+
+    margin = int(round(margin_seconds * fps))
+    window = MotionWindow(start_frame=max(0, start - margin),
+                          end_frame=min(frame_count, end + margin + 1),
+                          frame_count=frame_count,
+                          peak_score=peak)
+    if window.coverage >= max_coverage:
+        logger.info(f"動作偵測：動作區間涵蓋 {window.coverage:.0%}，送出整段影片")
+        return None
+    logger.info(f"動作偵測：幀 {window.start_frame}-{window.end_frame} / {frame_count} ({window.coverage:.0%})")
+    return window
+
+
+def iter_pitch_segments(video_path: str,
+                        video_meta: Dict,
+                        sample_fps: float = 15,
+                        lag_seconds: float = 0.2,
+                        margin_seconds: float = 1.0,
+                        gap_seconds: float = 0.5,
+                        min_score: float = 0.002,
+                        relative_threshold: float = 0.1,
+                        reference_seconds: float = 60.0,
+                        min_seconds: float = 0.5,
+                        max_seconds: float = 10.0) -> Iterator[PitchSegment]:
+    """
+    逐段產生長影片中每一次投球的候選區間 (依時間順序)。
+    門檻為 max(min_score, 最近 reference_seconds 秒的最大動作量 * relative_threshold)；
+    動作持續不到 min_seconds 的區段捨棄 (雜訊)，超過 max_seconds 就先切開 (例如投手走動)。
+    前後緩衝不會超過與相鄰區段的中點，同一次投球不會同時出現在兩個區段。
+    """
+    fps = video_meta.get("fps") or 0
+    frame_count = video_meta.get("frame_count", 0)
+    if not fps or not frame_count:
+        return
+    sample_step = max(1, int(round(fps / sample_fps)))
+    lag = max(1, int(round(lag_seconds * fps / sample_step)))
+    max_gap = max(sample_step, int(gap_seconds * fps))
+    min_frames = int(min_seconds * fps)
+    max_frames = int(max_seconds * fps)
+    margin = int(round(margin_seconds * fps))
+
+    # 最近 reference_seconds 秒的動作量 (遞減的單調佇列，排頭即區間最大值)
+    recent: deque = deque()
+    reference_frames = int(reference_seconds * fps)
+    current = None                      # [start, end, 最大動作量]
+    pending = None                      # 已結束、等下一個區段決定後緩衝的區段
+    lower_bound = 0                     # 下一個區段的前緩衝不能早於這裡
+    index = 0
+
+    def finalize(segment, next_start: Optional[int]) -> PitchSegment:
+        nonlocal lower_bound, index
+        start, end, peak = segment
+        end_limit = frame_count if next_start is None else (end + next_start) // 2
+        result = PitchSegment(index=index,
+                              start_frame=max(lower_bound, start - margin),
+                              end_frame=min(end_limit, end + margin + 1),
+                              motion_start=start, motion_end=end + 1, peak_score=peak)
+        lower_bound = result.end_frame
+        index += 1
+        return result
+
+    def close(segment):
+        # 回傳可以確定緩衝範圍的上一個區段
+        nonlocal pending
+        if segment[1] - segment[0] < min_frames:
+            return None
+        previous, pending = pending, segment
+        return finalize(previous, segment[0]) if previous is not None else None
+
+    for frame_idx, score in iter_motion_scores(video_path, sample_step, lag):
+        while recent and recent[-1][1] <= score:
+            recent.pop()
+        recent.append((frame_idx, score))
+        while recent[0][0] < frame_idx - reference_frames:
+            recent.popleft()
+        threshold = max(min_score, recent[0][1] * relative_threshold)
+
+        if current is not None and (frame_idx - current[1] > max_gap or current[1] - current[0] >= max_frames):
+            done = close(current)
+            current = None
+            if done is not None:
+                yield done
+        if score < threshold:
+            continue
+        # 差值代表 (lag 個取樣點之前, 這一幀] 之間有變化
+        if current is None:
+            current = [max(0, frame_idx - lag * sample_step), frame_idx, score]
+        else:
+            current[1] = frame_idx
+            current[2] = max(current[2], score)
+
+    if current is not None:
+        done = close(current)
+        if done is not None:
+            yield done
+    if pending is not None:
+        yield finalize(pending, None)
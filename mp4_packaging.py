@@ -0,0 +1,466 @@
+# 檔案: mp4_packaging.py
+# 職責: 渲染後影片的封裝。只搬移 MP4 box，不重新編碼，也不需要 ffmpeg。
+#
+#   - faststart: 把 moov (索引) 移到 mdat (影像資料) 前面並修正 stco/co64 偏移，
+#                瀏覽器只要下載到檔案開頭就能開始播放，不必等整個檔案
+#   - HLS:       切成 fMP4 分段 (init.mp4 + seg_00000.m4s ...) 與 VOD 播放清單，每段都從關鍵幀開始，
+#                播放器下載完第一段即可播放
+#   - 片段擷取:  在關鍵幀把影像軌切成獨立的 fMP4 (分段送骨架推論用，見 video_proxy.split_video)
+#
+#   只處理影像軌 (render_video_with_pose_and_max_ball_speed 的輸出只有影像軌；上傳影片的音軌會被捨棄)。
+
+import math
+import os
+import shutil
+import struct
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# 需要往下解析的容器 box
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex"}
+
+# trun 的 sample_flags：關鍵幀不依賴其他幀；其他幀依賴前面的幀且不是同步點
+_SYNC_SAMPLE_FLAGS = 0x02000000
+_NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+
+@dataclass
+class Box:
+    type: bytes
+    payload: bytes = b""                 # 葉節點的內容 (不含 box header)
+    children: Optional[List["Box"]] = None
+
+    def find(self, box_type: bytes) -> Optional["Box"]:
+        for child in self.children or []:
+            if child.type == box_type:
+                return child
+        return None
+
+    def find_path(self, *box_types: bytes) -> Optional["Box"]:
+        box = self
+        for box_type in box_types:
+            box = box.find(box_type)
+            if box is None:
+                return None
+        return box
+
+    def walk(self):
+        yield self
+        for child in self.children or []:
+            yield from child.walk()
+
+    def to_bytes(self) -> bytes:
+        body = b"".join(c.to_bytes() for c in self.children) if self.children is not None else self.payload
+        if len(body) + 8 > 0xFFFFFFFF:
+            return struct.pack(">I4sQ", 1, self.type, len(body) + 16) + body
+        return struct.pack(">I4s", len(body) + 8, self.type) + body
+
+
+def _full_box(box_type: bytes, version: int, flags: int, body: bytes) -> Box:
+    return Box(box_type, struct.pack(">I", (version << 24) | flags) + body)
+
+
+def _box_header(data: bytes, offset: int, end: int) -> Tuple[bytes, int, int]:
+    """回傳 (type, header 長度, box 總長度)。"""
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header = 8
+    if size == 1:
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header = 16
+    elif size == 0:
+        size = end - offset
+    if size < header or offset + size > end:
+        raise ValueError(f"MP4 box 長度錯誤：{box_type!r}")
+    return box_type, header, size
+
+
+def parse_boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> List[Box]:
+    end = len(data) if end is None else end
+    boxes = []
+    offset = start
+    while offset + 8 <= end:
+        box_type, header, size = _box_header(data, offset, end)
+        if box_type in _CONTAINERS:
+            boxes.append(Box(box_type, children=parse_boxes(data, offset + header, offset + size)))
+        else:
+            boxes.append(Box(box_type, bytes(data[offset + header:offset + size])))
+        offset += size
+    return boxes
+
+
+def _top_level_boxes(f) -> List[Tuple[bytes, int, int]]:
+    """只讀 header 列出檔案最上層的 box：[(type, offset, size)] (mdat 內容不讀進記憶體)。"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        box_type, _, size = _box_header(header.ljust(16, b"\0"), 0, file_size - offset)
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def _read_moov(f, boxes) -> Tuple[Box, int, int]:
+    for box_type, offset, size in boxes:
+        if box_type == b"moov":
+            f.seek(offset)
+            data = f.read(size)
+            return parse_boxes(data)[0], offset, size
+    raise ValueError("MP4 檔案缺少 moov")
+
+
+# --- faststart ---
+
+def _chunk_offsets(stbl: Box) -> List[int]:
+    stco = stbl.find(b"stco")
+    if stco is not None:
+        count = struct.unpack_from(">I", stco.payload, 4)[0]
+        return list(struct.unpack_from(f">{count}I", stco.payload, 8))
+    co64 = stbl.find(b"co64")
+    if co64 is not None:
+        count = struct.unpack_from(">I", co64.payload, 4)[0]
+        return list(struct.unpack_from(f">{count}Q", co64.payload, 8))
+    return []
+
+
+def _shifted_moov(moov: Box, original_offsets: Dict[int, List[int]], moov_offset: int, delta: int,
+                  force_co64: bool) -> Box:
+    """把 moov 原位置之前的 chunk 偏移加上 delta (moov 移到前面後，這些資料往後移 moov 的長度)。"""
+    for stbl in moov.walk():
+        if stbl.type != b"stbl":
+            continue
+        offsets = [o + delta if o < moov_offset else o for o in original_offsets[id(stbl)]]
+        use_co64 = force_co64 or stbl.find(b"co64") is not None
+        table = (_full_box(b"co64", 0, 0, struct.pack(f">I{len(offsets)}Q", len(offsets), *offsets)) if use_co64
+                 else _full_box(b"stco", 0, 0, struct.pack(f">I{len(offsets)}I", len(offsets), *offsets)))
+        stbl.children = [table if c.type in (b"stco", b"co64") else c for c in stbl.children]
+    return moov
+
+
+def make_faststart(path: str) -> bool:
+    """
+    就地把 moov 移到 mdat 之前。已經是 faststart 時不動檔案並回傳 False。
+    """
+    with open(path, "rb") as f:
+        boxes = _top_level_boxes(f)
+        moov, moov_offset, moov_size = _read_moov(f, boxes)
+        first_mdat = next((offset for box_type, offset, _ in boxes if box_type == b"mdat"), None)
+        if first_mdat is None or moov_offset < first_mdat:
+            return False
+
+        original_offsets = {id(stbl): _chunk_offsets(stbl) for stbl in moov.walk() if stbl.type == b"stbl"}
+        # 偏移量超過 32 位元時改用 co64 (moov 變大，需要以新的長度重新計算)
+        force_co64 = False
+        while True:
+            new_moov = _shifted_moov(moov, original_offsets, moov_offset, 0, force_co64).to_bytes()
+            delta = len(new_moov)
+            new_moov = _shifted_moov(moov, original_offsets, moov_offset, delta, force_co64).to_bytes()
+            largest = max((max(o) for o in original_offsets.values() if o), default=0) + delta
+            if force_co64 or largest <= 0xFFFFFFFF:
+                break
+            force_co64 = True
+
+        tmp_path = path + ".faststart"
+        with open(tmp_path, "wb") as out:
+            for box_type, offset, size in boxes:
+                if offset == first_mdat:
+                    out.write(new_moov)
+                if box_type == b"moov":
+                    continue
+                f.seek(offset)
+                _copy_range(f, out, size)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _copy_range(src, dst, length: int, buffer_size: int = 1 << 20):
+    while length > 0:
+        chunk = src.read(min(buffer_size, length))
+        if not chunk:
+            raise ValueError("MP4 檔案內容不完整")
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+# --- HLS (fMP4) ---
+
+@dataclass
+class _SampleTable:
+    track_id: int
+    timescale: int
+    offsets: List[int]
+    sizes: List[int]
+    durations: List[int]
+    sync: List[bool]
+    composition_offsets: Optional[List[int]]
+    composition_signed: bool
+
+
+def _video_trak(moov: Box) -> Box:
+    for trak in moov.children:
+        if trak.type != b"trak":
+            continue
+        hdlr = trak.find_path(b"mdia", b"hdlr")
+        if hdlr is not None and hdlr.payload[8:12] == b"vide":
+            return trak
+    raise ValueError("MP4 檔案沒有影像軌")
+
+
+def _sample_table(trak: Box) -> _SampleTable:
+    tkhd = trak.find(b"tkhd").payload
+    track_id = struct.unpack_from(">I", tkhd, 20 if tkhd[0] == 1 else 12)[0]
+    mdhd = trak.find_path(b"mdia", b"mdhd").payload
+    timescale = struct.unpack_from(">I", mdhd, 20 if mdhd[0] == 1 else 12)[0]
+    stbl = trak.find_path(b"mdia", b"minf", b"stbl")
+
+    stsz = stbl.find(b"stsz").payload
+    uniform_size, count = struct.unpack_from(">II", stsz, 4)
+    sizes = [uniform_size] * count if uniform_size else list(struct.unpack_from(f">{count}I", stsz, 12))
+
+    # stsc：每個 chunk 的樣本數 (以 run-length 表示)，展開成每個樣本在檔案中的位置
+    chunk_offsets = _chunk_offsets(stbl)
+    stsc = stbl.find(b"stsc").payload
+    entries = struct.unpack_from(">I", stsc, 4)[0]
+    runs = [struct.unpack_from(">III", stsc, 8 + 12 * i)[:2] for i in range(entries)]
+    offsets = []
+    sample = 0
+    for i, (first_chunk, per_chunk) in enumerate(runs):
+        last_chunk = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            position = chunk_offsets[chunk - 1]
+            for _ in range(per_chunk):
+                if sample >= count:
+                    break
+                offsets.append(position)
+                position += sizes[sample]
+                sample += 1
+    if len(offsets) != count:
+        raise ValueError("MP4 樣本表不一致")
+
+    stts = stbl.find(b"stts").payload
+    durations = []
+    for i in range(struct.unpack_from(">I", stts, 4)[0]):
+        run, delta = struct.unpack_from(">II", stts, 8 + 8 * i)
+        durations.extend([delta] * run)
+
+    stss = stbl.find(b"stss")
+    if stss is None:
+        sync = [True] * count
+    else:
+        sync = [False] * count
+        n = struct.unpack_from(">I", stss.payload, 4)[0]
+        for number in struct.unpack_from(f">{n}I", stss.payload, 8):
+            sync[number - 1] = True
+
+    composition_offsets, signed = None, False
+    ctts = stbl.find(b"ctts")
+    if ctts is not None:
+        signed = ctts.payload[0] == 1
+        composition_offsets = []
+        for i in range(struct.unpack_from(">I", ctts.payload, 4)[0]):
+            run, offset = struct.unpack_from(">Ii" if signed else ">II", ctts.payload, 8 + 8 * i)
+            composition_offsets.extend([offset] * run)
+
+    return _SampleTable(track_id, timescale, offsets, sizes, durations[:count], sync,
+                        composition_offsets, signed)
+
+
+def _init_segment(moov: Box, trak: Box, track_id: int) -> bytes:
+    """init.mp4：原本的 moov，但樣本表清空並加上 mvex (樣本改由各分段的 moof 描述)。"""
+    stbl = trak.find_path(b"mdia", b"minf", b"stbl")
+    stbl.children = [
+        stbl.find(b"stsd"),
+        _full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+        _full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+        _full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+        _full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+    ]
+    moov.children = [c for c in moov.children if c.type in (b"mvhd", b"mvex") or c is trak]
+    moov.children.append(Box(b"mvex", children=[
+        _full_box(b"trex", 0, 0, struct.pack(">IIIII", track_id, 1, 0, 0, 0)),
+    ]))
+    ftyp = Box(b"ftyp", b"iso6" + struct.pack(">I", 0) + b"iso6mp41")
+    return ftyp.to_bytes() + moov.to_bytes()
+
+
+def _set_field(box: Box, offset_v0: int, offset_v1: int, value: int):
+    """改寫 full box 中依版本為 32 / 64 位元的欄位 (mvhd / mdhd / tkhd 的 duration)。"""
+    payload = bytearray(box.payload)
+    if payload[0] == 1:
+        struct.pack_into(">Q", payload, offset_v1, value)
+    else:
+        struct.pack_into(">I", payload, offset_v0, min(value, 0xFFFFFFFF))
+    box.payload = bytes(payload)
+
+
+def _with_duration(init: bytes, media_duration: int, media_timescale: int) -> bytes:
+    """
+    把 init 分段中 mvhd / tkhd / mdhd / elst 記錄的長度改成 media_duration (媒體時間單位)。
+    _init_segment 沿用原本的 moov，長度仍是整支影片；解碼器 (OpenCV 的 CAP_PROP_FRAME_COUNT) 依此推算幀數，
+    切出的片段會回報整支影片的幀數。
+    """
+    ftyp, moov = parse_boxes(init)
+    mvhd = moov.find(b"mvhd")
+    movie_timescale = struct.unpack_from(">I", mvhd.payload, 20 if mvhd.payload[0] == 1 else 12)[0]
+    movie_duration = media_duration * movie_timescale // media_timescale
+    _set_field(mvhd, 16, 24, movie_duration)
+    for trak in moov.children:
+        if trak.type != b"trak":
+            continue
+        _set_field(trak.find(b"tkhd"), 20, 28, movie_duration)
+        _set_field(trak.find_path(b"mdia", b"mdhd"), 16, 24, media_duration)
+        edts = trak.find(b"edts")
+        elst = edts.find(b"elst") if edts is not None else None
+        if elst is None:
+            continue
+        version = elst.payload[0]
+        entry_format = ">Qq" if version == 1 else ">Ii"
+        entry_size = struct.calcsize(entry_format) + 4
+        count = struct.unpack_from(">I", elst.payload, 4)[0]
+        entries = [struct.unpack_from(entry_format, elst.payload, 8 + entry_size * i) for i in range(count)]
+        playing = [i for i, (_, media_time) in enumerate(entries) if media_time != -1]
+        if len(playing) != 1:
+            # 多段編輯無法單純縮短，改為不使用編輯清單
+            trak.children = [c for c in trak.children if c is not edts]
+            continue
+        delay = sum(duration for i, (duration, _) in enumerate(entries) if i != playing[0])
+        payload = bytearray(elst.payload)
+        struct.pack_into(">Q" if version == 1 else ">I", payload, 8 + entry_size * playing[0],
+                         max(0, movie_duration - delay))
+        elst.payload = bytes(payload)
+    return ftyp.to_bytes() + moov.to_bytes()
+
+
+def _media_segment(f, table: _SampleTable, start: int, end: int, sequence: int, decode_time: int) -> bytes:
+    has_cto = table.composition_offsets is not None
+    trun_flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | (0x000800 if has_cto else 0)
+    entry_format = ">IIIi" if table.composition_signed else ">IIII"
+
+    def build_moof(data_offset: int) -> bytes:
+        entries = []
+        for i in range(start, end):
+            flags = _SYNC_SAMPLE_FLAGS if table.sync[i] else _NON_SYNC_SAMPLE_FLAGS
+            if has_cto:
+                entries.append(struct.pack(entry_format, table.durations[i], table.sizes[i], flags,
+                                           table.composition_offsets[i]))
+            else:
+                entries.append(struct.pack(">III", table.durations[i], table.sizes[i], flags))
+        trun = _full_box(b"trun", 1 if table.composition_signed else 0, trun_flags,
+                         struct.pack(">Ii", end - start, data_offset) + b"".join(entries))
+        traf = Box(b"traf", children=[
+            _full_box(b"tfhd", 0, 0x020000, struct.pack(">I", table.track_id)),  # default-base-is-moof
+            _full_box(b"tfdt", 1, 0, struct.pack(">Q", decode_time)),
+            trun,
+        ])
+        return Box(b"moof", children=[_full_box(b"mfhd", 0, 0, struct.pack(">I", sequence)), traf]).to_bytes()
+
+    moof_size = len(build_moof(0))
+    moof = build_moof(moof_size + 8)  # 資料從 mdat header 之後開始
+
+    samples = []
+    for i in range(start, end):
+        f.seek(table.offsets[i])
+        samples.append(f.read(table.sizes[i]))
+    mdat = Box(b"mdat", b"".join(samples)).to_bytes()
+    return moof + mdat
+
+
+def segment_hls(path: str, output_dir: str, segment_seconds: float = 2.0,
+                playlist_name: str = "playlist.m3u8") -> List[str]:
+    """
+    把 MP4 切成 HLS fMP4 分段，寫到 output_dir。
+    回傳所有輸出檔案的路徑，播放清單放在最後 (上傳時最後才上傳播放清單)。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    with open(path, "rb") as f:
+        moov, _, _ = _read_moov(f, _top_level_boxes(f))
+        trak = _video_trak(moov)
+        table = _sample_table(trak)
+        if not table.sizes:
+            raise ValueError("影片沒有任何幀，無法切割 HLS")
+
+        # 每段至少 segment_seconds，並且只在關鍵幀切開
+        boundaries = [0]
+        elapsed = 0
+        target = segment_seconds * table.timescale
+        for i in range(len(table.sizes)):
+            if i > boundaries[-1] and table.sync[i] and elapsed >= target:
+                boundaries.append(i)
+                elapsed = 0
+            elapsed += table.durations[i]
+        boundaries.append(len(table.sizes))
+
+        output_paths = []
+        init_path = os.path.join(output_dir, "init.mp4")
+        with open(init_path, "wb") as out:
+            out.write(_init_segment(moov, trak, table.track_id))
+        output_paths.append(init_path)
+
+        playlist_entries = []
+        decode_time = 0
+        for sequence, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+            name = f"seg_{sequence:05d}.m4s"
+            with open(os.path.join(output_dir, name), "wb") as out:
+                out.write(_media_segment(f, table, start, end, sequence + 1, decode_time))
+            duration = sum(table.durations[start:end])
+            decode_time += duration
+            playlist_entries.append((name, duration / table.timescale))
+            output_paths.append(os.path.join(output_dir, name))
+
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{max(1, math.ceil(max(d for _, d in playlist_entries)))}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        '#EXT-X-MAP:URI="init.mp4"',
+    ]
+    for name, duration in playlist_entries:
+        lines += [f"#EXTINF:{duration:.3f},", name]
+    lines.append("#EXT-X-ENDLIST")
+    playlist_path = os.path.join(output_dir, playlist_name)
+    with open(playlist_path, "w") as out:
+        out.write("\n".join(lines) + "\n")
+    output_paths.append(playlist_path)
+    return output_paths
+
+
+def keyframe_samples(path: str) -> Tuple[List[int], int]:
+    """回傳影像軌關鍵幀的樣本編號 (由 0 起算) 與樣本總數。"""
+    with open(path, "rb") as f:
+        moov, _, _ = _read_moov(f, _top_level_boxes(f))
+    table = _sample_table(_video_trak(moov))
+    return [i for i, is_sync in enumerate(table.sync) if is_sync], len(table.sizes)
+
+
+def extract_fragments(path: str, ranges: List[Tuple[int, int]]) -> List[bytes]:
+    """
+    把影像軌的每個樣本範圍 [start, end) 各自輸出成獨立的 fragmented MP4 (init + 一個分段)，不重新編碼。
+    start 必須是關鍵幀；每段的時間軸都從 0 開始，解碼出的第 0 幀即原始影片的第 start 幀，
+    檔頭記錄的長度也改成該段的長度。
+    """
+    with open(path, "rb") as f:
+        moov, _, _ = _read_moov(f, _top_level_boxes(f))
+        trak = _video_trak(moov)
+        table = _sample_table(trak)
+        for start, end in ranges:
+            if not 0 <= start < end <= len(table.sizes) or not table.sync[start]:
+                raise ValueError(f"樣本範圍 [{start}, {end}) 不是從關鍵幀開始或超出範圍")
+        init = _init_segment(moov, trak, table.track_id)
+        return [_with_duration(init, sum(table.durations[start:end]), table.timescale)
+                + _media_segment(f, table, start, end, 1, 0) for start, end in ranges]
+
+
+def concat_hls_segments(output_paths: List[str], destination: str) -> str:
+    """把 init 與各分段接成單一 fragmented MP4 (驗證 / 除錯用，可直接用 OpenCV 讀取)。"""
+    with open(destination, "wb") as out:
+        for path in output_paths:
+            if path.endswith(".m3u8"):
+                continue
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, out)
+    return destination
@@ -0,0 +1,220 @@
+# 檔案: pose_stream.py
+# 職責: 邊下載邊解析 Pose API 的回應，直接把第一個人的關節點寫進預先配置的 NumPy 陣列。
+#
+#   回應格式 {"frames": [{"frame_idx": int, "predictions": [{"keypoints", "keypoint_scores", "bbox", "bbox_score"}, ...]}, ...]}
+#   長影片的回應有數 MB，response.json() 會先建出整棵 Python 物件樹 (含每幀所有人物)，再由
+#   load_pose_from_response 逐幀轉成陣列。這裡改為：
+#   - 以括號深度切出 frames 陣列中的每個元素，收到一幀就處理一幀，已處理的位元組立即丟棄
+#   - 每幀只解碼 predictions[0] (raw_decode 解析一個值就停下)，其他人物不建立任何物件
+#   - 結果寫入預先配置 (不足時加倍) 的陣列，最後以 PoseTrack 提供各模組需要的格式
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+NUM_KEYPOINTS = 17
+
+_FRAMES_KEY = re.compile(rb'"frames"\s*:\s*\[')
+# 一次跳過一段不含結構字元的內容 (字串整段跳過，字串內的括號不影響深度)，Python 迴圈只需處理每個括號
+# 幀與幀之間還要找 frames 陣列的結尾 ']'
+_SKIP_IN_FRAME = re.compile(rb'(?:[^{}"]+|"(?:[^"\\]|\\.)*")*')
+_SKIP_BETWEEN = re.compile(rb'(?:[^{}"\]]+|"(?:[^"\\]|\\.)*")*')
+_FRAME_IDX = re.compile(r'"frame_idx"\s*:\s*(-?\d+)')
+_PREDICTIONS = re.compile(r'"predictions"\s*:\s*\[\s*')
+_DECODER = json.JSONDecoder()
+
+
+@dataclass
+class PoseTrack:
+    """
+    第一個人的逐幀骨架 (N = 有偵測到人的幀數，K = 17)。
+    keypoints 的第三欄與 load_pose_from_response 相同：API 給 (x, y, score) 時為 score，只給 (x, y) 時為 1。
+    """
+    frame_idx: np.ndarray            # (N,) int64
+    keypoints: np.ndarray            # (N, K, 3) float64
+    keypoint_scores: np.ndarray      # (N, K) float64，API 沒有 keypoint_scores 時為 NaN
+    bboxes: np.ndarray               # (N, 4) float64，沒有 bbox 時為 NaN
+    bbox_scores: np.ndarray          # (N,) float64
+    total_frames: int = 0            # 回應中的幀數 (含沒有偵測到人的幀)
+
+    def __len__(self) -> int:
+        return int(self.frame_idx.shape[0])
+
+    def to_pose_sequence(self) -> List[Dict]:
+        """KinematicsModule 使用的格式：[{"frame": int, "keypoints": ndarray(17, 3)}]。"""
+        return [{"frame": int(f), "keypoints": self.keypoints[i]} for i, f in enumerate(self.frame_idx)]
+
+    def to_pose_json(self) -> Dict:
+        """還原成 Pose API 的回應格式 (每幀只含第一個人)，供仍以 dict 為輸入的程式使用。"""
+        frames = []
+        has_scores = ~np.isnan(self.keypoint_scores).any(axis=1)
+        has_bbox = ~np.isnan(self.bboxes).any(axis=1)
+        for i, f in enumerate(self.frame_idx):
+            prediction = {"keypoints": self.keypoints[i, :, :2].tolist()}
+            if has_scores[i]:
+                prediction["keypoint_scores"] = self.keypoint_scores[i].tolist()
+            if has_bbox[i]:
+                prediction["bbox"] = [self.bboxes[i].tolist()]
+            if not np.isnan(self.bbox_scores[i]):
+                prediction["bbox_score"] = float(self.bbox_scores[i])
+            frames.append({"frame_idx": int(f), "predictions": [prediction]})
+        return {"frames": frames}
+
+
+class PoseStreamParser:
+    """
+    以 feed(chunk) 逐段餵入回應內容，finish() 取得 PoseTrack。
+    expected_frames 為預先配置的幀數 (通常是影片幀數)，實際較多時自動加倍擴充。
+    """
+
+    def __init__(self, expected_frames: int = 0):
+        capacity = max(16, int(expected_frames))
+        self._frame_idx = np.empty(capacity, dtype=np.int64)
+        self._keypoints = np.empty((capacity, NUM_KEYPOINTS, 3), dtype=np.float64)
+        self._scores = np.empty((capacity, NUM_KEYPOINTS), dtype=np.float64)
+        self._bboxes = np.empty((capacity, 4), dtype=np.float64)
+        self._bbox_scores = np.empty(capacity, dtype=np.float64)
+        self._count = 0
+        self._total_frames = 0
+
+        self._buffer = bytearray()
+        self._state = "seek_frames"    # seek_frames -> between -> in_frame -> done
+        self._pos = 0                  # 下一個要掃描的位置
+        self._depth = 0
+        self._frame_start = 0
+
+    # --- 陣列 ---
+
+    def _grow(self):
+        capacity = self._frame_idx.shape[0] * 2
+        for name in ("_frame_idx", "_keypoints", "_scores", "_bboxes", "_bbox_scores"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+
+    def _add_frame(self, frame_text: str):
+        self._total_frames += 1
+        match = _PREDICTIONS.search(frame_text)
+        if match is None or frame_text.startswith("]", match.end()):
+            return
+        prediction, _ = _DECODER.raw_decode(frame_text, match.end())
+        keypoints = prediction.get("keypoints")
+        if not keypoints:
+            return
+        frame_idx = _FRAME_IDX.search(frame_text)
+        if frame_idx is None:
+            raise ValueError("Pose API 回應的幀缺少 frame_idx")
+
+        if self._count == self._frame_idx.shape[0]:
+            self._grow()
+        i = self._count
+        self._frame_idx[i] = int(frame_idx.group(1))
+        points = np.asarray(keypoints, dtype=np.float64)
+        self._keypoints[i, :, :2] = points[:, :2]
+        self._keypoints[i, :, 2] = points[:, 2] if points.shape[1] == 3 else 1.0
+
+        scores = prediction.get("keypoint_scores")
+        self._scores[i] = scores if scores else np.nan
+
+        bbox = prediction.get("bbox")
+        while isinstance(bbox, list) and bbox and isinstance(bbox[0], list):
+            bbox = bbox[0]
+        self._bboxes[i] = bbox if bbox and len(bbox) == 4 and None not in bbox else np.nan
+        bbox_score = prediction.get("bbox_score")
+        while isinstance(bbox_score, list) and bbox_score:
+            bbox_score = bbox_score[0]
+        self._bbox_scores[i] = bbox_score if isinstance(bbox_score, (int, float)) else np.nan
+        self._count += 1
+
+    # --- 串流切割 ---
+
+    def feed(self, chunk: bytes):
+        if self._state == "done" or not chunk:
+            return
+        buffer = self._buffer
+        buffer += chunk
+
+        if self._state == "seek_frames":
+            match = _FRAMES_KEY.search(buffer)
+            if match is None:
+                # 保留結尾幾個位元組，避免 "frames" 剛好被切在兩段之間
+                del buffer[:max(0, len(buffer) - 32)]
+                return
+            del buffer[:match.end()]
+            self._state = "between"
+            self._pos = 0
+
+        while self._state != "done":
+            pattern = _SKIP_IN_FRAME if self._depth else _SKIP_BETWEEN
+            self._pos = pattern.match(buffer, self._pos).end()
+            if self._pos == len(buffer):
+                break
+            char = buffer[self._pos]
+            if char == 0x22:  # 字串還沒收完整，等下一段
+                break
+            self._pos += 1
+            if char == 0x7B:  # '{'
+                if self._depth == 0:
+                    self._frame_start = self._pos - 1
+                self._depth += 1
+            elif char == 0x7D:  # '}'
+                self._depth -= 1
+                if self._depth == 0:
+                    self._add_frame(buffer[self._frame_start:self._pos].decode("utf-8"))
+                    del buffer[:self._pos]
+                    self._pos = 0
+            else:  # 幀與幀之間的 ']'：frames 陣列結束，之後的內容不需要
+                self._state = "done"
+                buffer.clear()
+
+        if self._depth == 0 and self._state == "between":
+            # 兩幀之間只剩逗號與空白
+            del buffer[:self._pos]
+            self._pos = 0
+
+    def finish(self) -> PoseTrack:
+        n = self._count
+        track = PoseTrack(
+            frame_idx=self._frame_idx[:n].copy(),
+            keypoints=self._keypoints[:n].copy(),
+            keypoint_scores=self._scores[:n].copy(),
+            bboxes=self._bboxes[:n].copy(),
+            bbox_scores=self._bbox_scores[:n].copy(),
+            total_frames=self._total_frames,
+        )
+        self._buffer = bytearray()
+        return track
+
+
+def parse_pose_bytes(data: bytes, expected_frames: int = 0, chunk_size: int = 1 << 16) -> PoseTrack:
+    """一次解析整段回應內容 (測試 / 基準測試用)。"""
+    parser = PoseStreamParser(expected_frames)
+    view = memoryview(data)
+    for start in range(0, len(data), chunk_size):
+        parser.feed(view[start:start + chunk_size])
+    return parser.finish()
+
+
+
+def stitch_pose_tracks(parts: List[Tuple[PoseTrack, int, int, int]], total_frames: int = 0) -> PoseTrack:
+    """
+    把分段推論的結果接回一條 PoseTrack。parts 為 [(track, 片段起始幀, keep_start, keep_end)]：
+    片段內的 frame_idx 加上起始幀，只保留 [keep_start, keep_end) 內的幀 (去除重疊區的重複結果)。
+    """
+    pieces = []
+    for track, offset, keep_start, keep_end in parts:
+        frame_idx = track.frame_idx + offset
+        keep = (frame_idx >= keep_start) & (frame_idx < keep_end)
+        pieces.append((frame_idx[keep], track.keypoints[keep], track.keypoint_scores[keep],
+                       track.bboxes[keep], track.bbox_scores[keep]))
+    if not pieces:
+        return PoseTrack(np.zeros(0, dtype=np.int64), np.zeros((0, NUM_KEYPOINTS, 3)), np.zeros((0, NUM_KEYPOINTS)),
+                         np.zeros((0, 4)), np.zeros(0), total_frames)
+    frame_idx, keypoints, keypoint_scores, bboxes, bbox_scores = (np.concatenate(column) for column in zip(*pieces))
+    order = np.argsort(frame_idx, kind="stable")
+    return PoseTrack(frame_idx=frame_idx[order], keypoints=keypoints[order], keypoint_scores=keypoint_scores[order],
+                     bboxes=bboxes[order], bbox_scores=bbox_scores[order], total_frames=total_frames)
@@ -0,0 +1,177 @@
+# 檔案: prefork.py
+# 職責: 正式環境的多工作行程啟動器 (pre-fork)。
+#
+#   python main.py 只啟動一個 uvicorn 行程，多核心的機器上分析流程中 Python 的部分大約只用到一個核心。
+#   - 父行程先匯入應用程式並預熱 (球路模型、菁英模型目錄等)，再 fork 出工作行程：
+#     這些唯讀資料的記憶體分頁以 copy-on-write 共用，不必每個工作行程各載入一份
+#     (fork 前 gc.freeze()，避免垃圾回收掃描時寫入物件標頭而複製分頁)
+#   - 監聽 socket 由父行程建立，所有工作行程共用 (由核心分配連線)
+#   - 工作行程數依 CPU 與記憶體上限 (cgroup) 自動決定：
+#     min(可用 CPU, 記憶體上限 / 每個工作行程的記憶體)，每個工作行程的記憶體 = 基本用量 + 准入控制的記憶體預算
+#   - 工作行程處理 max_requests 個請求 (加上隨機抖動，避免同時重啟) 後優雅結束 (處理完進行中的請求)，
+#     父行程立即補上新的工作行程，限制 OpenCV 等原生程式庫的記憶體緩慢增長
+#   指標是各工作行程自己的 (GET /metrics 只反映處理該請求的工作行程)；去重 / Idempotency-Key 的結果、
+#   延遲渲染的進行中工作與重新計分工作記在資料庫，各工作行程共用。
+
+import gc
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+import uvicorn
+from uvicorn.importer import import_from_string
+
+logger = logging.getLogger(__name__)
+
+# 工作行程存活不到這個秒數就異常結束時視為啟動失敗，重啟前逐步拉長等待時間
+MIN_HEALTHY_UPTIME_S = 5.0
+
+
+def _read_cgroup(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus() -> float:
+    """可用的 CPU 數：cgroup 配額 (v2 cpu.max / v1 cfs_quota) 與 CPU 親和性取較小者。"""
+    try:
+        cpus = float(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        cpus = float(os.cpu_count() or 1)
+    cpu_max = _read_cgroup("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            cpus = min(cpus, int(quota) / int(period))
+    else:
+        quota = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+        period = _read_cgroup("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            cpus = min(cpus, int(quota) / int(period))
+    return max(cpus, 1.0)
+
+
+def memory_limit_bytes() -> int:
+    """可用的記憶體：cgroup 上限 (v2 memory.max / v1 memory.limit_in_bytes)，沒有上限時為實體記憶體。"""
+    physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        value = _read_cgroup(path)
+        if value and value != "max":
+            return min(int(value), physical)
+    return physical
+
+
+def auto_worker_count(per_worker_bytes: int, cpus: Optional[float] = None,
+                      memory_bytes: Optional[int] = None) -> int:
+    cpus = available_cpus() if cpus is None else cpus
+    memory_bytes = memory_limit_bytes() if memory_bytes is None else memory_bytes
+    by_memory = memory_bytes // per_worker_bytes if per_worker_bytes > 0 else cpus
+    return max(1, int(min(cpus, by_memory)))
+
+
+def _run_worker(app, sock: socket.socket, max_requests: Optional[int], log_level: str):
+    # 子行程：還原父行程設定的訊號處理 (交給 uvicorn)，重設亂數種子 (fork 後各行程的狀態相同)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    random.seed()
+    config = uvicorn.Config(app, limit_max_requests=max_requests, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(app_path: str, host: str, port: int, workers: int = 0, max_requests: int = 0,
+          max_requests_jitter: int = 0, log_level: str = "info"):
+    """
+    匯入 app_path (例如 "main:app")、預熱後 fork 出 workers 個工作行程 (0 代表自動決定)，
+    並持續補上結束的工作行程，直到收到 SIGTERM / SIGINT。
+    """
+    app = import_from_string(app_path)
+
+    # 預熱放在 fork 之前，模型與目錄只載入一次；資料庫連線不能跨行程共用，fork 前全部關閉
+    import reanalysis
+    import services
+    from config import ADMISSION_MEMORY_BUDGET_MB, REANALYSIS_WORKERS, WORKER_BASE_MEMORY_MB
+    from database import engine
+    services.warm_up()
+    engine.dispose()
+
+    if workers <= 0:
+        workers = auto_worker_count(int((WORKER_BASE_MEMORY_MB + ADMISSION_MEMORY_BUDGET_MB) * 1024 * 1024))
+    if "ADMISSION_MAX_CONCURRENCY" not in os.environ:
+        # 預設的並行上限是整台機器的 CPU 數，多個工作行程時平均分配
+        services.analysis_admission.max_concurrency = max(1, int(available_cpus() // workers))
+    if "REANALYSIS_WORKERS" not in os.environ:
+        # 每個工作行程各有一個重新分析行程池，預設大小同樣平均分配，避免 N 個池子各開滿 CPU 數個行程
+        reanalysis.pool_workers = max(1, REANALYSIS_WORKERS // workers)
+    # 暫存空間是所有工作行程共用的同一個磁碟 (或 tmpfs)，各工作行程只記得自己的預留，配額必須平均分配
+    services.analysis_scratch.quota_bytes //= workers
+    logger.info(f"pre-fork：{workers} 個工作行程 (CPU {available_cpus():g}, 記憶體 "
+                f"{memory_limit_bytes() / 1024 ** 3:.1f} GB)，每個處理約 {max_requests or '不限'} 個請求後重啟")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    gc.collect()
+    gc.freeze()
+
+    children: Dict[int, float] = {}     # pid → 啟動時間
+    stopping = False
+    restart_delay = 0.0
+
+    def spawn():
+        limit = max_requests + random.randint(0, max_requests_jitter) if max_requests > 0 else None
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock, limit, log_level)
+            except BaseException:
+                logger.exception("工作行程異常結束")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        logger.info(f"pre-fork：收到訊號 {signum}，等待 {len(children)} 個工作行程結束")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+    while children:
+        pid, status = os.wait()
+        started_at = children.pop(pid, None)
+        if started_at is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+        uptime = time.monotonic() - started_at
+        if code == 0:
+            logger.info(f"pre-fork：工作行程 {pid} 已達請求上限 (存活 {uptime:.0f} 秒)，重新啟動")
+            restart_delay = 0.0
+        else:
+            logger.warning(f"pre-fork：工作行程 {pid} 異常結束 (代碼 {code}，存活 {uptime:.1f} 秒)")
+            restart_delay = min(30.0, max(1.0, restart_delay * 2)) if uptime < MIN_HEALTHY_UPTIME_S else 0.0
+            time.sleep(restart_delay)
+        if not stopping:
+            spawn()
+    sock.close()
@@ -0,0 +1,188 @@
+# 檔案: profile_catalog.py
+# 職責: 將所有菁英選手的 PitchModel 統計預先轉成記憶體中的平均值 / 標準差矩陣，
+#       讓「你的投球最像哪位職業選手」可以一次比對所有模型，而不必逐一查詢資料庫。
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from config import PROFILE_CATALOG_TTL_SECONDS
+from database import PitchModel
+from PoseClassification import build_profile_matrix, calculate_score_matrix
+
+logger = logging.getLogger(__name__)
+
+# 與投球風格無關、只反映影片長度或剪輯位置的欄位，不納入相似度排名
+RANKING_EXCLUDED_FEATURES = {"release_frame", "landing_frame", "shoulder_frame", "total_frames"}
+
+# 球種縮寫對照 (供前端顯示)
+PITCH_TYPE_TRANSLATOR = {
+    "FS": "分指快速球 / 指叉球 (Splitter / Split-Finger Fastball)",
+    "FF": "四縫線快速球 (Four-Seam Fastball)",
+    "SL": "滑球 (Slider)",
+    "CU": "曲球 (Curveball)",
+    "CH": "變速球 (Changeup)",
+    "FO": "指叉球 (Forkball)",
+    "all": "通用"
+}
+
+
+def format_model_display_name(model_name: str) -> str:
+    """將 "姓, 名_球種縮寫_v1" 或 "名字_姓氏_球種縮寫_v1" 格式的模型名稱轉成前端顯示用名稱。"""
+    parts = model_name.split('_')
+    if len(parts) < 2:
+        return model_name  # 如果格式不符，使用原名
+    player_name = parts[0].replace(",", ", ")
+    pitch_type_abbr = parts[1] if len(parts) > 1 else "all"
+    pitch_type_display = PITCH_TYPE_TRANSLATOR.get(pitch_type_abbr, pitch_type_abbr)
+    return f"{player_name} - {pitch_type_display}"
+
+
+@dataclass
+class CatalogSnapshot:
+    """某個時間點所有模型的矩陣快照 (M = 模型數, F = 特徵數)，建立後不再修改，可跨執行緒共用。"""
+    model_names: List[str]
+    feature_keys: List[str]          # 小寫的 profile_data 鍵
+    means: np.ndarray                # (M, F)
+    stds: np.ndarray                 # (M, F)
+    present: np.ndarray              # (M, F)
+    fingerprint: Tuple
+    built_at: float
+
+
+class ProfileCatalog:
+    """
+    所有 PitchModel 的記憶體矩陣快取。
+    - 同一行程內 pitch_model 有新增 / 修改 / 刪除時，由 SQLAlchemy 事件標記為過期
+    - 其他行程 (例如模型建置腳本) 的修改，則在超過 TTL 後以輕量查詢比對指紋，有變動才重建
+    """
+
+    def __init__(self, ttl_seconds: float = PROFILE_CATALOG_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._dirty = True
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._dirty = True
+
+    @staticmethod
+    def _fingerprint(db: Session) -> Tuple:
+        row = db.query(func.count(PitchModel.id), func.max(PitchModel.id),
+                       func.max(PitchModel.created_at), func.max(PitchModel.updated_at)).one()
+        return tuple(row)
+
+    def _build(self, db: Session) -> CatalogSnapshot:
+        start = time.perf_counter()
+        fingerprint = self._fingerprint(db)
+        rows = db.query(PitchModel.model_name, PitchModel.profile_data).order_by(PitchModel.model_name).all()
+        model_names = [name for name, _ in rows]
+        profiles = [profile_data or {} for _, profile_data in rows]
+
+        feature_keys = {}
+        for profile_data in profiles:
+            for key in profile_data:
+                if key not in RANKING_EXCLUDED_FEATURES:
+                    feature_keys.setdefault(key, None)
+        feature_keys = list(feature_keys)
+
+        means, stds, present = build_profile_matrix(profiles, feature_keys)
+        logger.info(f"模型目錄：已載入 {len(model_names)} 個模型 × {len(feature_keys)} 項特徵 "
+                    f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+        return CatalogSnapshot(model_names, feature_keys, means, stds, present, fingerprint, time.time())
+
+    def get(self, db: Session) -> CatalogSnapshot:
+        """取得目前的快照，必要時重建。"""
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and not self._dirty and now - self._checked_at < self.ttl_seconds:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and not self._dirty:
+                if time.monotonic() - self._checked_at < self.ttl_seconds:
+                    return snapshot
+                # TTL 到期：指紋沒變就沿用舊快照
+                if self._fingerprint(db) == snapshot.fingerprint:
+                    self._checked_at = time.monotonic()
+                    return snapshot
+            self._dirty = False
+            try:
+                self._snapshot = self._build(db)
+            except Exception:
+                self._dirty = True
+                raise
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def rank(self, db: Session, features: Dict, top_k: int = 5, min_features: int = 1) -> List[Dict]:
+        """
+        將一筆 biomechanics_features 與所有模型比對，回傳最接近的 top_k 個模型。
+        距離為可比較特徵的平均 |Z-score| (越小越像)；同距離時以綜合分數較高者優先。
+        """
+        snapshot = self.get(db)
+        if not snapshot.model_names or not snapshot.feature_keys:
+            return []
+
+        # 使用者特徵鍵大小寫不一，統一轉小寫後對齊快照的特徵欄位
+        lowered = {key.lower(): (key, value) for key, value in features.items()}
+        values = np.full((1, len(snapshot.feature_keys)), np.nan, dtype=np.float64)
+        value_present = np.zeros(values.shape, dtype=bool)
+        for j, key in enumerate(snapshot.feature_keys):
+            original = lowered.get(key)
+            if original is not None and isinstance(original[1], (int, float)) and not isinstance(original[1], bool):
+                values[0, j] = original[1]
+                value_present[0, j] = True
+
+        result = calculate_score_matrix(values, snapshot.means, snapshot.stds,
+                                        value_present, snapshot.present, snapshot.feature_keys)
+        counts = result.feature_counts[0]
+        with np.errstate(invalid='ignore'):
+            distances = np.nansum(result.z_scores[0], axis=1) / np.maximum(counts, 1)
+        eligible = np.flatnonzero(counts >= max(1, min_features))
+        if eligible.size == 0:
+            return []
+
+        order = eligible[np.lexsort((-result.final_scores[0][eligible], distances[eligible]))][:top_k]
+        ranking = []
+        for rank, m in enumerate(order, start=1):
+            feature_distances = {}
+            for j in np.flatnonzero(result.valid[0, m]):
+                original_key, user_value = lowered[snapshot.feature_keys[j]]
+                feature_distances[original_key] = {
+                    "user_value": user_value,
+                    "mean": float(snapshot.means[m, j]),
+                    "std": float(snapshot.stds[m, j]),
+                    "z_score": float(result.z_scores[0, m, j]),
+                    "score": int(result.feature_scores[0, m, j])
+                }
+            model_name = snapshot.model_names[m]
+            ranking.append({
+                "rank": rank,
+                "model_name": model_name,
+                "display_name": format_model_display_name(model_name),
+                "distance": float(distances[m]),
+                "score": int(result.final_scores[0, m]),
+                "compared_features": int(counts[m]),
+                "feature_distances": feature_distances
+            })
+        return ranking
+
+
+profile_catalog = ProfileCatalog()
+
+
+# pitch_model 有任何 ORM 寫入就讓快照失效
+@event.listens_for(PitchModel, "after_insert")
+@event.listens_for(PitchModel, "after_update")
+@event.listens_for(PitchModel, "after_delete")
+def _invalidate_on_pitch_model_change(mapper, connection, target):
+    profile_catalog.invalidate()
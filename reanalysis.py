@@ -0,0 +1,187 @@
+# 檔案: reanalysis.py
+# 職責: 由 PitchAnalyses 保存的原始軌跡 (track_store) 重新計算生物力學特徵、pose_score、ball_score 與最大球速，
+#       不需要原始影片，也不再呼叫遠端推論 API。
+#
+#   - 計算在行程池中執行 (特徵擷取與隨機森林都是純 Python / CPU 密集，執行緒無法平行)
+#   - 批次命令依 id 分頁讀取，每頁送進行程池，結果以一次批次 UPDATE 寫回並 commit，可用 --resume-after 續跑
+#
+# 命令列：python reanalysis.py --workers 4 --chunk-size 200 [--player "王小明"] [--resume-after 0]
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from config import REANALYSIS_CHUNK_SIZE, REANALYSIS_WORKERS
+from database import SessionLocal, PitchAnalyses, PitchModel
+from BallClassification import classify_ball_quality, get_ball_model
+from Drawingfunction import calculate_max_ball_speed
+from KinematicsModule import extract_pitching_biomechanics
+from PoseClassification import calculate_score_from_comparison
+from track_store import AnalysisTracks
+
+logger = logging.getLogger(__name__)
+
+
+def reanalyze_tracks(tracks_blob: bytes, profile_data: Optional[Dict] = None) -> Dict:
+    """
+    由軌跡重新計算分析結果 (在工作行程中執行，參數與回傳值都必須可以 pickle)。
+    沒有 profile_data 時 (原本比對個人平均或沒有模型) 不重新計算 pose_score。
+    """
+    tracks = AnalysisTracks(tracks_blob)
+    pose_json = tracks.to_pose_json()
+    ball_json = tracks.to_ball_json()
+
+    biomechanics_features = extract_pitching_biomechanics(pose_json)
+    result = {
+        "biomechanics_features": biomechanics_features,
+        "ball_score": classify_ball_quality(ball_json, get_ball_model()),
+        "max_speed_kmh": calculate_max_ball_speed(ball_json, tracks.video.get("fps"),
+                                                  tracks.video.get("frame_count") or None),
+    }
+    if profile_data:
+        result["pose_score"], _ = calculate_score_from_comparison(biomechanics_features, profile_data)
+    return result
+
+
+def _reanalyze_row(args) -> Dict:
+    analysis_id, tracks_blob, profile_data = args
+    try:
+        return {"id": analysis_id, **reanalyze_tracks(tracks_blob, profile_data)}
+    except Exception as e:
+        return {"id": analysis_id, "error": str(e)}
+
+
+# --- 行程池 (API 與批次命令共用) ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# API 行程池的大小；pre-fork 模式下由 prefork.serve 依工作行程數平均分配
+pool_workers = REANALYSIS_WORKERS
+
+
+def get_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 伺服器內有許多執行緒 (預熱、to_thread、重新計分)，直接 fork 可能複製到被其他執行緒持有的鎖而卡死；
+            # 改由 forkserver 產生工作行程 (預先匯入本模組，每個工作行程不必重新匯入)，也不會繼承監聽 socket
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=max(1, max_workers or pool_workers), mp_context=context)
+        return _pool
+
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def _profile_for(db: Session, model_name: Optional[str], cache: Dict[str, Optional[Dict]]) -> Optional[Dict]:
+    if not model_name:
+        return None
+    if model_name not in cache:
+        model = db.query(PitchModel).filter(PitchModel.model_name == model_name).first()
+        cache[model_name] = model.profile_data if model else None
+    return cache[model_name]
+
+
+def _apply_result(result: Dict, reanalyzed_at: datetime) -> Dict:
+    values = {key: result[key] for key in ("biomechanics_features", "ball_score", "max_speed_kmh", "pose_score")
+              if key in result}
+    values["reanalyzed_at"] = reanalyzed_at
+    return values
+
+
+async def reanalyze_analysis(db: Session, analysis: PitchAnalyses) -> PitchAnalyses:
+    """重新分析單筆紀錄並寫回資料庫 (供 API 使用，計算交給行程池)。"""
+    if analysis.tracks_blob is None:
+        raise ValueError("此分析紀錄沒有保存軌跡，無法重新分析")
+    profile_data = _profile_for(db, analysis.benchmark_model_name, {})
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(get_process_pool(), reanalyze_tracks, analysis.tracks_blob, profile_data)
+    for key, value in _apply_result(result, datetime.now(timezone.utc)).items():
+        setattr(analysis, key, value)
+    db.commit()
+    db.refresh(analysis)
+    return analysis
+
+
+def reanalyze_history(
+        workers: int = REANALYSIS_WORKERS,
+        chunk_size: int = REANALYSIS_CHUNK_SIZE,
+        player_name: Optional[str] = None,
+        resume_after_id: int = 0,
+        session_factory=SessionLocal) -> Dict:
+    """重新分析所有保存了軌跡的紀錄 (可限定選手)，回傳處理統計。"""
+    start = time.perf_counter()
+    stats = {"processed": 0, "updated": 0, "failed": 0, "last_id": resume_after_id}
+    profiles: Dict[str, Optional[Dict]] = {}
+    condition = PitchAnalyses.tracks_blob.isnot(None)
+    if player_name:
+        condition = condition & (PitchAnalyses.player_name == player_name)
+
+    db = session_factory()
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            last_id = resume_after_id
+            while True:
+                rows = db.execute(
+                    select(PitchAnalyses.id, PitchAnalyses.tracks_blob, PitchAnalyses.benchmark_model_name)
+                    .where(condition & (PitchAnalyses.id > last_id))
+                    .order_by(PitchAnalyses.id).limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                jobs = [(row.id, row.tracks_blob, _profile_for(db, row.benchmark_model_name, profiles)) for row in rows]
+                results = list(pool.map(_reanalyze_row, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+                reanalyzed_at = datetime.now(timezone.utc)
+                changes = []
+                for result in results:
+                    if "error" in result:
+                        stats["failed"] += 1
+                        logger.warning(f"重新分析 id={result['id']} 失敗: {result['error']}")
+                        continue
+                    changes.append({"id": result["id"], **_apply_result(result, reanalyzed_at)})
+                if changes:
+                    db.execute(update(PitchAnalyses), changes)
+                db.commit()
+
+                last_id = rows[-1].id
+                stats["processed"] += len(rows)
+                stats["updated"] += len(changes)
+                stats["last_id"] = last_id
+                logger.info(f"重新分析進度：{stats['processed']} 筆 (last_id={last_id})")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    stats["elapsed_s"] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="由保存的軌跡重新計算歷史分析結果")
+    parser.add_argument("--workers", type=int, default=REANALYSIS_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=REANALYSIS_CHUNK_SIZE)
+    parser.add_argument("--player", help="只處理指定選手")
+    parser.add_argument("--resume-after", type=int, default=0, help="從 id 大於此值的紀錄開始 (續跑)")
+    args = parser.parse_args()
+
+    print(reanalyze_history(workers=args.workers, chunk_size=args.chunk_size,
+                            player_name=args.player, resume_after_id=args.resume_after))
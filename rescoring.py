@@ -0,0 +1,402 @@
+# 檔案: rescoring.py
+# 職責: 菁英模型 (PitchModel) 重建後，於背景分批重新計算以該模型比對的歷史 pose_score。
+#
+#   - 以伺服器端游標 (yield_per) 分塊串流 pitch_analyses，記憶體只保留一個區塊 (SQLite 改用 id 分頁)
+#   - 每個區塊以向量化評分引擎一次算完，再以一次批次 UPDATE 寫回並立即 commit，鎖定時間以區塊為上限
+#   - 進度中的 last_id 即為續跑點，可從中斷處繼續
+#   - API 啟動的工作記錄在 rescore_job 資料表：任一工作行程都能查詢 / 取消，同一個模型同時只有一個工作；
+#     執行中的行程以 heartbeat_at 維持租約，行程結束 (例如 pre-fork 工作行程重啟) 後由其他行程從 last_id 接手
+#
+# 命令列：python rescoring.py "Cole, Gerrit_FF_v1" --chunk-size 500 --resume-after 0
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import RESCORE_CHUNK_SIZE, RESCORE_LEASE_SECONDS, RESCORE_PAUSE_SECONDS
+from database import SessionLocal, PitchAnalyses, PitchModel, RescoreJob
+from PoseClassification import score_records_against_profiles
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RescoreProgress:
+    job_id: str
+    model_name: str
+    status: str = "pending"          # pending / running / completed / failed / cancelled
+    total: int = 0                   # 啟動時符合條件的筆數
+    processed: int = 0
+    updated: int = 0                 # 分數有變動而寫回的筆數
+    last_id: int = 0                 # 已處理完的最大 id (續跑點)
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict:
+        return {f.name: getattr(self, f.name) for f in fields(self) if f.name != "cancel_event"}
+
+
+def count_unattributed_analyses(db) -> int:
+    """沒有記錄比對模型的紀錄數 (benchmark_model_name 欄位加入前的舊紀錄無法得知當時的模型)，這些紀錄不會被重新計分。"""
+    return db.execute(select(func.count(PitchAnalyses.id)).where(
+        PitchAnalyses.benchmark_model_name.is_(None) & (PitchAnalyses.pose_score > 0))).scalar_one()
+
+
+def _iter_chunks(read_db, condition, chunk_size: int) -> Iterator[List]:
+    """
+    依 id 順序分塊讀出 (id, biomechanics_features, pose_score)。
+    PostgreSQL 使用伺服器端游標 (yield_per)；不支援伺服器端游標的資料庫 (例如本機開發用的 SQLite，
+    讀取中的交易會擋住另一個連線的寫入) 改用 id 分頁，每頁讀完即結束讀取交易。
+    """
+    columns = (PitchAnalyses.id, PitchAnalyses.biomechanics_features, PitchAnalyses.pose_score)
+    if read_db.get_bind().dialect.supports_server_side_cursors:
+        stream = read_db.execute(
+            select(*columns).where(condition).order_by(PitchAnalyses.id).execution_options(yield_per=chunk_size)
+        )
+        yield from stream.partitions()
+        return
+
+    last_id = None
+    while True:
+        query = select(*columns).where(condition).order_by(PitchAnalyses.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(PitchAnalyses.id > last_id)
+        rows = read_db.execute(query).all()
+        read_db.commit()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        yield rows
+
+
+def rescore_analyses_for_model(
+        model_name: str,
+        chunk_size: int = RESCORE_CHUNK_SIZE,
+        resume_after_id: int = 0,
+        pause_seconds: float = RESCORE_PAUSE_SECONDS,
+        progress: Optional[RescoreProgress] = None,
+        progress_callback: Optional[Callable[[RescoreProgress], None]] = None,
+        session_factory=SessionLocal) -> RescoreProgress:
+    """
+    以模型目前的 profile_data 重新計算所有 benchmark_model_name == model_name 的 pose_score。
+    讀取與寫入使用不同的 Session：讀取端維持一個唯讀的串流游標，寫入端每個區塊各自 commit。
+    """
+    progress = progress or RescoreProgress(job_id=uuid.uuid4().hex[:12], model_name=model_name)
+    progress.status = "running"
+    progress.last_id = resume_after_id
+    progress.started_at = progress.started_at or datetime.now(timezone.utc).isoformat()
+
+    read_db = session_factory()
+    write_db = session_factory()
+    try:
+        model = write_db.query(PitchModel).filter(PitchModel.model_name == model_name).first()
+        if model is None or not model.profile_data:
+            raise ValueError(f"找不到模型或模型資料不完整：{model_name}")
+        profile_data = model.profile_data
+        write_db.commit()  # 結束讀取模型的交易，避免整個工作期間持有快照
+
+        condition = (PitchAnalyses.benchmark_model_name == model_name) & (PitchAnalyses.id > resume_after_id)
+        # 接手中斷的工作時 processed 已有先前的進度，total 維持為整個工作的筆數
+        remaining = read_db.execute(select(func.count(PitchAnalyses.id)).where(condition)).scalar_one()
+        progress.total = progress.processed + remaining
+        logger.info(f"重新計分 {model_name}：剩餘 {remaining} 筆 (從 id > {resume_after_id} 開始)")
+        if progress_callback:
+            progress_callback(progress)
+
+        read_db.commit()
+        for rows in _iter_chunks(read_db, condition, chunk_size):
+            if progress.cancel_event.is_set():
+                progress.status = "cancelled"
+                break
+
+            features_list = [row.biomechanics_features or {} for row in rows]
+            scores = score_records_against_profiles(features_list, [profile_data]).final_scores[:, 0]
+            changes = [
+                {"id": row.id, "pose_score": int(score)}
+                for row, score in zip(rows, scores)
+                if row.pose_score != int(score)
+            ]
+            if changes:
+                # ORM 依主鍵批次 UPDATE (executemany)，每個區塊一個短交易
+                write_db.execute(update(PitchAnalyses), changes)
+            write_db.commit()
+
+            progress.processed += len(rows)
+            progress.updated += len(changes)
+            progress.last_id = rows[-1].id
+            if progress_callback:
+                progress_callback(progress)
+            if pause_seconds:
+                # 讓出資料庫資源給線上流量
+                time.sleep(pause_seconds)
+        else:
+            progress.status = "completed"
+    except Exception as e:
+        write_db.rollback()
+        progress.status = "failed"
+        progress.error = str(e)
+        logger.error(f"重新計分 {model_name} 失敗 (last_id={progress.last_id}): {e}", exc_info=True)
+    finally:
+        read_db.close()
+        write_db.close()
+        progress.finished_at = datetime.now(timezone.utc).isoformat()
+
+    logger.info(f"重新計分 {model_name} {progress.status}：處理 {progress.processed} 筆，更新 {progress.updated} 筆")
+    return progress
+
+
+# --- 背景工作管理 (進度與租約存在 rescore_job 資料表) ---
+
+# 本行程正在執行的工作 (job_id → 進度)，關閉時通知它們停止並交出租約
+_local_jobs: Dict[str, RescoreProgress] = {}
+_local_threads: Dict[str, threading.Thread] = {}
+_local_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def _new_owner() -> str:
+    # 每次執行各自一個持有者代號 (同一個行程接手自己過期的工作時，舊的執行緒也會發現租約已被接手)
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+
+
+def _lease_expired():
+    """租約已過期的條件 (沒有持有者，或持有者超過 RESCORE_LEASE_SECONDS 沒有回報)。"""
+    return or_(RescoreJob.heartbeat_at.is_(None),
+               RescoreJob.heartbeat_at < _now() - timedelta(seconds=RESCORE_LEASE_SECONDS))
+
+
+def _progress_from_row(job: RescoreJob) -> RescoreProgress:
+    return RescoreProgress(
+        job_id=job.job_id, model_name=job.model_name, status=job.status, total=job.total,
+        processed=job.processed, updated=job.updated, last_id=job.last_id,
+        started_at=_isoformat(job.started_at), finished_at=_isoformat(job.finished_at), error=job.error)
+
+
+def _sync_job(job_id: str, owner: str, progress: RescoreProgress, lost: threading.Event):
+    """每個區塊後寫回進度並更新租約；租約被接手時停止，收到取消要求或本行程要關閉時在下一個區塊前停止。"""
+    db = SessionLocal()
+    try:
+        owned = db.execute(
+            update(RescoreJob)
+            .where((RescoreJob.job_id == job_id) & (RescoreJob.owner == owner))
+            .values(status=progress.status, total=progress.total, processed=progress.processed,
+                    updated=progress.updated, last_id=progress.last_id, heartbeat_at=_now())
+        ).rowcount
+        cancel_requested = db.execute(
+            select(RescoreJob.cancel_requested).where(RescoreJob.job_id == job_id)).scalar()
+        db.commit()
+    finally:
+        db.close()
+    if not owned:
+        lost.set()
+    if not owned or cancel_requested or _stopping.is_set():
+        progress.cancel_event.set()
+
+
+def _finish_job(job_id: str, owner: str, progress: RescoreProgress):
+    db = SessionLocal()
+    try:
+        values = dict(total=progress.total, processed=progress.processed, updated=progress.updated,
+                      last_id=progress.last_id)
+        cancel_requested = db.execute(
+            select(RescoreJob.cancel_requested).where(RescoreJob.job_id == job_id)).scalar()
+        if progress.status == "cancelled" and not cancel_requested:
+            # 本行程要關閉而停止：保留 active_model 並交出租約，由其他 (或重啟後的) 工作行程從 last_id 接手
+            values.update(status="pending", owner=None, heartbeat_at=None)
+        else:
+            values.update(status=progress.status, error=progress.error, active_model=None, owner=None,
+                          finished_at=_now())
+        db.execute(update(RescoreJob)
+                   .where((RescoreJob.job_id == job_id) & (RescoreJob.owner == owner))
+                   .values(**values))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _run_job(job: RescoreJob):
+    progress = _progress_from_row(job)
+    lost = threading.Event()
+    with _local_lock:
+        _local_jobs[job.job_id] = progress
+    try:
+        rescore_analyses_for_model(
+            job.model_name, chunk_size=job.chunk_size, resume_after_id=job.last_id, progress=progress,
+            progress_callback=lambda p: _sync_job(job.job_id, job.owner, p, lost))
+        if not lost.is_set():
+            _finish_job(job.job_id, job.owner, progress)
+    except Exception as e:
+        # 資料庫暫時無法寫入等：不清除租約，過期後由其他行程接手
+        logger.error(f"重新計分工作 {job.job_id} 無法更新狀態: {e}", exc_info=True)
+    finally:
+        with _local_lock:
+            _local_jobs.pop(job.job_id, None)
+            _local_threads.pop(job.job_id, None)
+
+
+def _start_thread(job: RescoreJob):
+    thread = threading.Thread(target=_run_job, args=(job,), name=f"rescore-{job.job_id}", daemon=True)
+    with _local_lock:
+        _local_threads[job.job_id] = thread
+    thread.start()
+
+
+def _take_over(db, job_id: str) -> Optional[RescoreJob]:
+    """租約過期時由本行程接手 (條件式 UPDATE，多個行程同時嘗試只有一個成功)。"""
+    # Session 中可能已載入該工作，不在 Python 端比對條件 (SQLite 讀回的時間沒有時區)，commit 後重新讀取
+    taken = db.execute(
+        update(RescoreJob)
+        .where((RescoreJob.job_id == job_id) & RescoreJob.active_model.isnot(None) & _lease_expired())
+        .values(owner=_new_owner(), heartbeat_at=_now(), status="running")
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if not taken:
+        return None
+    job = db.get(RescoreJob, job_id)
+    db.expunge(job)
+    return job
+
+
+def start_rescore_job(model_name: str, chunk_size: int = RESCORE_CHUNK_SIZE, resume_after_id: int = 0) -> RescoreProgress:
+    """
+    在背景執行緒啟動重新計分。同一個模型已有進行中的工作時直接回傳該工作
+    (該工作的租約已過期時由本行程接手，從 last_id 繼續)。
+    """
+    db = SessionLocal()
+    try:
+        for _ in range(2):
+            active = db.execute(select(RescoreJob).where(RescoreJob.active_model == model_name)).scalar_one_or_none()
+            if active is not None:
+                job = _take_over(db, active.job_id)
+                if job is not None:
+                    logger.info(f"接手重新計分工作 {job.job_id} ({model_name})，從 id > {job.last_id} 繼續")
+                    _start_thread(job)
+                    return _progress_from_row(job)
+                db.refresh(active)
+                return _progress_from_row(active)
+
+            job = RescoreJob(job_id=uuid.uuid4().hex[:12], model_name=model_name, active_model=model_name,
+                             status="running", last_id=resume_after_id, chunk_size=chunk_size,
+                             cancel_requested=False, owner=_new_owner(), heartbeat_at=_now(), started_at=_now())
+            db.add(job)
+            try:
+                db.commit()
+            except IntegrityError:
+                # 另一個工作行程同時為同一個模型建立了工作：改為回傳那一個
+                db.rollback()
+                continue
+            db.refresh(job)
+            db.expunge(job)
+            _start_thread(job)
+            return _progress_from_row(job)
+        raise RuntimeError(f"無法建立 {model_name} 的重新計分工作")
+    finally:
+        db.close()
+
+
+def get_rescore_job(job_id: str) -> Optional[RescoreProgress]:
+    db = SessionLocal()
+    try:
+        job = db.get(RescoreJob, job_id)
+        return _progress_from_row(job) if job else None
+    finally:
+        db.close()
+
+
+def cancel_rescore_job(job_id: str) -> Optional[RescoreProgress]:
+    """要求停止；執行中的行程在下一個區塊前停止。沒有行程持有租約的工作直接標記為取消。"""
+    db = SessionLocal()
+    try:
+        db.execute(update(RescoreJob).where(RescoreJob.job_id == job_id).values(cancel_requested=True))
+        db.execute(
+            update(RescoreJob)
+            .where((RescoreJob.job_id == job_id) & RescoreJob.active_model.isnot(None) & _lease_expired())
+            .values(status="cancelled", active_model=None, owner=None, finished_at=_now())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        job = db.get(RescoreJob, job_id)
+        return _progress_from_row(job) if job else None
+    finally:
+        db.close()
+
+
+def resume_orphaned_jobs() -> int:
+    """接手所有租約過期的工作 (原本執行的行程已結束)，回傳接手的數量。"""
+    db = SessionLocal()
+    try:
+        job_ids = db.execute(
+            select(RescoreJob.job_id).where(RescoreJob.active_model.isnot(None) & _lease_expired())).scalars().all()
+        db.commit()
+        resumed = 0
+        for job_id in job_ids:
+            job = _take_over(db, job_id)
+            if job is not None:
+                logger.info(f"接手中斷的重新計分工作 {job.job_id} ({job.model_name})，從 id > {job.last_id} 繼續")
+                _start_thread(job)
+                resumed += 1
+        return resumed
+    finally:
+        db.close()
+
+
+async def run_job_supervisor(interval_s: float = RESCORE_LEASE_SECONDS):
+    """背景工作：定期接手中斷的重新計分工作，直到被取消。"""
+    while True:
+        try:
+            await asyncio.to_thread(resume_orphaned_jobs)
+        except Exception as e:
+            logger.warning(f"檢查中斷的重新計分工作失敗: {e}", exc_info=True)
+        await asyncio.sleep(interval_s)
+
+
+def stop_local_jobs(timeout_s: float = 10.0):
+    """行程關閉前呼叫：本行程的工作處理完目前的區塊後停止並交出租約，由其他工作行程接手。"""
+    _stopping.set()
+    with _local_lock:
+        threads = list(_local_threads.values())
+    for progress in list(_local_jobs.values()):
+        progress.cancel_event.set()
+    deadline = time.monotonic() + timeout_s
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="以最新的菁英模型重新計算歷史分析的 pose_score")
+    parser.add_argument("model_name")
+    parser.add_argument("--chunk-size", type=int, default=RESCORE_CHUNK_SIZE)
+    parser.add_argument("--resume-after", type=int, default=0, help="從 id 大於此值的紀錄開始 (續跑)")
+    parser.add_argument("--pause", type=float, default=RESCORE_PAUSE_SECONDS, help="每個區塊之間暫停的秒數")
+    args = parser.parse_args()
+
+    result = rescore_analyses_for_model(
+        args.model_name, chunk_size=args.chunk_size, resume_after_id=args.resume_after, pause_seconds=args.pause,
+        progress_callback=lambda p: print(f"進度 {p.processed}/{p.total} (更新 {p.updated}，last_id={p.last_id})")
+    )
+    print(result.to_dict())
@@ -0,0 +1,270 @@
+# 檔案: scratch_space.py
+# 職責: 分析過程暫存檔的管理：每個請求一個獨立目錄、保證清除、全域磁碟配額，以及清掃孤兒檔案的 janitor。
+#
+#   原本上傳影片寫成工作目錄下的 temp_{filename}、渲染結果寫進共用的 temp_rendered_videos/：
+#   同名上傳會互相覆蓋 (並行時出現 FileNotFoundError)，清除前發生例外就會留下檔案，最後塞滿容器的暫存磁碟。
+#   - ScratchDir：{根目錄}/{用途}_{pid}_{隨機碼}/，代理影片、推論片段、渲染影片與關鍵影格都寫在裡面，
+#                 close() (或 with / async with 結束) 整個目錄刪除
+#   - 配額：開目錄時預留預估用量 (上傳大小 × 倍數)，預留總和超過配額就等待，等太久拋出 ScratchQuotaExceeded
+#           (API 回 503 + Retry-After)；單一請求的預留最多視為整個配額，避免永遠等不到
+#   - janitor：定期刪除擁有者行程已不存在、或名稱沒有擁有者且超過 orphan_age_s 的目錄 (以及舊版留在工作目錄的 temp_* 檔案)，
+#              並更新磁碟用量指標
+#   根目錄可以放在 tmpfs (例如 /dev/shm)：I/O 不落地，但會佔用記憶體，配額需一併算進准入控制的記憶體預算。
+
+import asyncio
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, List, Optional
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_DIRS = Gauge("scratch_active_dirs", "使用中的暫存目錄數", ("space",))
+RESERVED_BYTES = Gauge("scratch_reserved_bytes", "使用中暫存目錄預留的磁碟空間", ("space",))
+DISK_USAGE_BYTES = Gauge("scratch_disk_usage_bytes", "暫存根目錄實際佔用的磁碟空間 (janitor 掃描時更新)", ("space",))
+FILESYSTEM_FREE_BYTES = Gauge("scratch_filesystem_free_bytes", "暫存根目錄所在檔案系統的剩餘空間", ("space",))
+QUOTA_WAITS = Counter("scratch_quota_waits_total", "配額不足需要等待的次數", ("space",))
+QUOTA_REJECTIONS = Counter("scratch_quota_rejections_total", "配額不足且等待逾時而拒絕的次數", ("space",))
+ORPHANS_REMOVED = Counter("scratch_orphans_removed_total", "janitor 刪除的孤兒目錄 / 檔案數", ("space",))
+
+
+class ScratchQuotaExceeded(Exception):
+    """暫存空間配額不足且等待逾時。retry_after 為建議的重試秒數。"""
+
+    def __init__(self, needed_bytes: int, retry_after: float):
+        super().__init__(f"暫存空間不足 (需要 {needed_bytes / 1024 / 1024:.0f} MB)，約 {retry_after:.0f} 秒後再試")
+        self.needed_bytes = needed_bytes
+        self.retry_after = retry_after
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass                    # 掃描途中被刪除
+    return total
+
+
+class ScratchDir:
+    """單一請求的暫存目錄。close() 可重複呼叫，也可以在工作執行緒中呼叫。"""
+
+    def __init__(self, space: "ScratchSpace", path: str, reserved_bytes: int):
+        self.space = space
+        self.path = path
+        self.reserved_bytes = reserved_bytes
+        self.closed = False
+
+    def file(self, name: str) -> str:
+        """目錄內的檔案路徑 (只取檔名，避免上傳檔名帶目錄)。"""
+        return os.path.join(self.path, os.path.basename(name) or "upload")
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.space._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+class ScratchSpace:
+    def __init__(self, name: str, root: str, quota_bytes: int, wait_timeout_s: float, orphan_age_s: float):
+        self.name = name
+        self.root = root
+        self.quota_bytes = quota_bytes          # 0 代表不限
+        self.wait_timeout_s = wait_timeout_s
+        self.orphan_age_s = orphan_age_s
+        self.reserved_bytes = 0
+        self._active = set()
+        self._waiters: Deque[List] = deque()    # [預留量, future]
+        self._lock = threading.Lock()           # close() 可能在工作執行緒中呼叫
+        os.makedirs(root, exist_ok=True)
+
+    def _fits(self, reserve_bytes: int) -> bool:
+        return self.quota_bytes <= 0 or self.reserved_bytes + reserve_bytes <= self.quota_bytes
+
+    def _update_gauges(self):
+        ACTIVE_DIRS.set(len(self._active), space=self.name)
+        RESERVED_BYTES.set(self.reserved_bytes, space=self.name)
+
+    def _create(self, prefix: str, reserve_bytes: int) -> ScratchDir:
+        # 呼叫端已持有鎖，預留量也已計入
+        path = os.path.join(self.root, f"{prefix}_{os.getpid()}_{uuid.uuid4().hex[:12]}")
+        try:
+            os.makedirs(path)
+        except OSError:
+            self.reserved_bytes -= reserve_bytes
+            self._update_gauges()
+            raise
+        self._active.add(path)
+        self._update_gauges()
+        return ScratchDir(self, path, reserve_bytes)
+
+    def _wake_locked(self) -> List[asyncio.Future]:
+        # 依到達順序放行 (預留量先計入)，排頭放不下就停
+        granted = []
+        while self._waiters and self._fits(self._waiters[0][0]):
+            reserve_bytes, future = self._waiters.popleft()
+            self.reserved_bytes += reserve_bytes
+            granted.append(future)
+        self._update_gauges()
+        return granted
+
+    def _unreserve(self, reserve_bytes: int, path: Optional[str] = None):
+        with self._lock:
+            if path is not None:
+                self._active.discard(path)
+            self.reserved_bytes -= reserve_bytes
+            granted = self._wake_locked()
+        for future in granted:
+            future.get_loop().call_soon_threadsafe(self._grant, future)
+
+    def _grant(self, future: asyncio.Future):
+        if future.done():
+            # 等待者已經逾時放棄：把代為預留的空間還回去
+            self._unreserve(future.reserve_bytes)
+        else:
+            future.set_result(None)
+
+    def _release(self, scratch: ScratchDir):
+        self._unreserve(scratch.reserved_bytes, scratch.path)
+
+    def retry_after(self) -> float:
+        return max(1.0, self.wait_timeout_s)
+
+    async def open(self, prefix: str, reserve_bytes: int = 0) -> ScratchDir:
+        """建立暫存目錄並預留 reserve_bytes；配額不足時等待，最多 wait_timeout_s 秒。"""
+        if self.quota_bytes > 0:
+            reserve_bytes = min(reserve_bytes, self.quota_bytes)
+        with self._lock:
+            if not self._waiters and self._fits(reserve_bytes):
+                self.reserved_bytes += reserve_bytes
+                return self._create(prefix, reserve_bytes)
+            future = asyncio.get_running_loop().create_future()
+            future.reserve_bytes = reserve_bytes
+            waiter = [reserve_bytes, future]
+            self._waiters.append(waiter)
+            self._update_gauges()
+        QUOTA_WAITS.inc(space=self.name)
+        try:
+            await asyncio.wait({future}, timeout=self.wait_timeout_s or None)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        if not future.done():
+            self._abandon(waiter)
+            QUOTA_REJECTIONS.inc(space=self.name)
+            raise ScratchQuotaExceeded(reserve_bytes, self.retry_after())
+        with self._lock:
+            return self._create(prefix, reserve_bytes)
+
+    def _abandon(self, waiter: List):
+        reserve_bytes, future = waiter
+        if future.done():
+            # 已經被放行才放棄
+            self._unreserve(reserve_bytes)
+            return
+        with self._lock:
+            queued = waiter in self._waiters
+            if queued:
+                self._waiters.remove(waiter)
+            future.cancel()
+        # 已放行但 _grant 尚未執行時，由 _grant 歸還預留量；排頭離開後後面的請求可能放得下
+        if queued:
+            self._unreserve(0)
+
+    def sweep(self, legacy_patterns=()) -> int:
+        """刪除孤兒暫存目錄 (擁有者行程已結束，或無法判斷擁有者且超過 orphan_age_s)，回傳刪除數並更新磁碟指標 (在執行緒中執行)。"""
+        removed = 0
+        now = time.time()
+        pid = os.getpid()
+        for entry in os.scandir(self.root):
+            with self._lock:
+                if entry.path in self._active:
+                    continue
+            try:
+                owner = int(entry.name.rsplit("_", 2)[-2])
+            except (ValueError, IndexError):
+                owner = None
+            try:
+                age = now - entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            # 本行程的目錄不在使用中表示 close() 刪除失敗 (建立與登記在同一把鎖內完成，不會誤刪剛建立的目錄)
+            # 其他存活行程 (pre-fork 的其他工作行程) 的目錄一律視為使用中：長時間分析期間目錄的 mtime 不會更新，
+            # 不能以存在時間判斷；存在時間只用於名稱中沒有擁有者的項目
+            if owner == pid:
+                orphaned = True
+            elif owner is not None:
+                orphaned = not _pid_alive(owner)
+            else:
+                orphaned = age > self.orphan_age_s
+            if not orphaned:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+            removed += 1
+        # 舊版寫在工作目錄的暫存檔 (temp_*、temp_rendered_videos/)
+        for pattern in legacy_patterns:
+            for path in glob.glob(pattern):
+                try:
+                    if now - os.path.getmtime(path) <= self.orphan_age_s:
+                        continue
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        if removed:
+            ORPHANS_REMOVED.inc(removed, space=self.name)
+            logger.info(f"暫存空間 {self.name}：刪除 {removed} 個孤兒目錄 / 檔案")
+        DISK_USAGE_BYTES.set(_tree_size(self.root), space=self.name)
+        FILESYSTEM_FREE_BYTES.set(shutil.disk_usage(self.root).free, space=self.name)
+        return removed
+
+    async def run_janitor(self, interval_s: float, legacy_patterns=()):
+        """背景工作：每 interval_s 秒清掃一次，直到被取消。"""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep, legacy_patterns)
+            except Exception as e:
+                logger.warning(f"暫存空間 {self.name} 清掃失敗: {e}", exc_info=True)
+            await asyncio.sleep(interval_s)
@@ -2,23 +2,162 @@ import os
 import shutil
 import httpx
 import asyncio
-import joblib
+import hashlib
+import json
 import logging
+import math
+import time
+import uuid
+from dataclasses import dataclass, field, replace
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
-from config import GCS_BUCKET_NAME, POSE_API_URL, BALL_API_URL
-from gcs_utils import upload_video_to_gcs
-from Drawingfunction import render_video_with_pose_and_max_ball_speed, save_specific_frames
+from config import GCS_BUCKET_NAME, POSE_API_URL, BALL_API_URL, BATCH_MAX_CONCURRENCY, SIMILAR_MODELS_MAX_TOP_K
+from config import IDEMPOTENCY_TTL_SECONDS, SINGLE_FLIGHT_ENABLED
+from config import (ADMISSION_BASE_COST_MB, ADMISSION_COST_PER_UPLOAD_MB, ADMISSION_MAX_CONCURRENCY,
+                    ADMISSION_MAX_QUEUE, ADMISSION_MEMORY_BUDGET_MB, ADMISSION_QUEUE_TIMEOUT_SECONDS)
+from admission import AdmissionController, AdmissionSlot
+from config import (SCRATCH_DIR, SCRATCH_ORPHAN_SECONDS, SCRATCH_QUOTA_MB, SCRATCH_RENDER_RESERVE_MB,
+                    SCRATCH_RESERVE_FACTOR, SCRATCH_WAIT_SECONDS)
+from scratch_space import ScratchDir, ScratchSpace
+from config import RENDER_CODECS, RENDER_MODE, RENDER_PROFILE, RENDER_QUALITY, STORAGE_BACKEND
+from config import ANALYSIS_PROXY_ENABLED, ANALYSIS_PROXY_MAX_FPS, ANALYSIS_PROXY_MAX_HEIGHT
+from config import MOTION_WINDOW_ENABLED, MOTION_WINDOW_MARGIN_SECONDS
+from config import (SESSION_GAP_SECONDS, SESSION_MARGIN_SECONDS, SESSION_MAX_CONCURRENCY, SESSION_MAX_PITCH_SECONDS,
+                    SESSION_MIN_PITCH_SECONDS)
+from config import POSE_CHUNK_CONCURRENCY, POSE_CHUNK_OVERLAP_SECONDS, POSE_CHUNK_SECONDS
+from config import (INFERENCE_ATTEMPT_TIMEOUT, INFERENCE_BACKOFF_BASE_SECONDS, INFERENCE_BACKOFF_MAX_SECONDS,
+                    INFERENCE_DEADLINE_SECONDS, INFERENCE_HEDGE_MIN_DELAY_SECONDS, INFERENCE_HEDGE_MIN_SAMPLES,
+                    INFERENCE_HEDGE_PERCENTILE, INFERENCE_MAX_ATTEMPTS, CIRCUIT_FAILURE_THRESHOLD,
+                    CIRCUIT_RESET_SECONDS)
+from database import SessionLocal, PitchModel
+from gcs_utils import get_storage_client, upload_video_to_gcs
+from inference_client import CircuitBreaker, HedgePolicy, InferenceBackend, RetryPolicy
+from Drawingfunction import (RenderProfile, calculate_max_ball_speed, get_render_profile,
+                             render_video_with_pose_and_max_ball_speed, save_specific_frames)
 from KinematicsModule import extract_pitching_biomechanics
 from PoseClassification import calculate_score_from_comparison
-from BallClassification import classify_ball_quality
-from typing import Dict, Optional, Tuple
+from BallClassification import classify_ball_quality, get_ball_model
+from profile_catalog import profile_catalog
+from track_store import FORMAT_VERSION as TRACKS_FORMAT_VERSION, encode_tracks, probe_video
+from pose_stream import PoseStreamParser, PoseTrack, stitch_pose_tracks
+from single_flight import DatabaseFlightStore, SingleFlight
+from motion_window import PitchSegment, detect_motion_window, iter_pitch_segments
+from video_proxy import VideoChunk, VideoProxy, build_proxy, cut_clip, plan_chunks, split_video
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import crud
+import video_renderer
 logger = logging.getLogger(__name__)
 API_TIMEOUT = 300
 
-# 載入球路預測模型 用來分類好壞球
-ball_prediction_model = joblib.load('random_forest_model.pkl')
+# 球路預測模型 (用來分類好壞球) 改由 get_ball_model() 延後載入，啟動時由 warm_up() 在背景預先載入
+
+# 啟動預熱的狀態 (GET /healthz 回報)：各步驟耗時與是否完成
+warm_up_status: Dict = {"done": False, "seconds": {}, "errors": {}}
+
+# 推論服務的容錯呼叫器 (延遲統計與斷路器狀態在整個行程內共用)
+def _make_inference_backend(name: str) -> InferenceBackend:
+    return InferenceBackend(
+        name,
+        retry=RetryPolicy(max_attempts=INFERENCE_MAX_ATTEMPTS, backoff_base_s=INFERENCE_BACKOFF_BASE_SECONDS,
+                          backoff_max_s=INFERENCE_BACKOFF_MAX_SECONDS, attempt_timeout_s=INFERENCE_ATTEMPT_TIMEOUT,
+                          deadline_s=INFERENCE_DEADLINE_SECONDS),
+        hedge=HedgePolicy(percentile=INFERENCE_HEDGE_PERCENTILE, min_samples=INFERENCE_HEDGE_MIN_SAMPLES,
+                          min_delay_s=INFERENCE_HEDGE_MIN_DELAY_SECONDS),
+        breaker=CircuitBreaker(name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                               reset_timeout_s=CIRCUIT_RESET_SECONDS)
+    )
+
+pose_backend = _make_inference_backend("pose")
+ball_backend = _make_inference_backend("ball")
+
+# 執行中的單支影片分析 (相同影片內容 + 參數只跑一次)；記在資料庫，pre-fork 的各工作行程共用
+analysis_flight = SingleFlight("analyze_pitch", store=DatabaseFlightStore())
+
+# 單支影片分析的准入控制 (並行數與記憶體預算)
+MB = 1024 * 1024
+analysis_admission = AdmissionController(
+    "analyze_pitch",
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    memory_budget_bytes=int(ADMISSION_MEMORY_BUDGET_MB * MB),
+    max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout_s=ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    base_cost_bytes=int(ADMISSION_BASE_COST_MB * MB),
+    cost_per_upload_byte=ADMISSION_COST_PER_UPLOAD_MB
+)
+
+# 分析暫存空間 (每個請求一個目錄，含磁碟配額)；舊版寫在工作目錄的 temp_* 由 janitor 一併清掉
+analysis_scratch = ScratchSpace(
+    "analysis",
+    root=SCRATCH_DIR,
+    quota_bytes=int(SCRATCH_QUOTA_MB * MB),
+    wait_timeout_s=SCRATCH_WAIT_SECONDS,
+    orphan_age_s=SCRATCH_ORPHAN_SECONDS
+)
+LEGACY_SCRATCH_PATTERNS = ("temp_*",)
+
+# 啟動預熱 (在背景執行緒中執行，健康檢查不需要等待)：載入延後載入的模型與模組，第一個請求就不必負擔
+def warm_up():
+    def load_profile_catalog():
+        db = SessionLocal()
+        try:
+            profile_catalog.get(db)
+        finally:
+            db.close()
+
+    steps = [
+        ("ball_model", get_ball_model),
+        ("pandas", lambda: __import__("pandas")),
+        ("profile_catalog", load_profile_catalog),
+    ]
+    if STORAGE_BACKEND == "gcs":
+        steps.append(("storage_client", get_storage_client))
+    started = time.perf_counter()
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # 預熱失敗不影響服務，第一次使用時會再載入一次
+            logger.warning(f"啟動預熱 {name} 失敗: {e}", exc_info=True)
+            warm_up_status["errors"][name] = str(e)
+        warm_up_status["seconds"][name] = round(time.perf_counter() - step_started, 3)
+    warm_up_status["done"] = True
+    logger.info(f"啟動預熱完成，耗時 {time.perf_counter() - started:.2f} 秒: {warm_up_status['seconds']}")
+
+@dataclass
+class AnalysisContext:
+    """
+    一次分析 (或一整個批次) 共用的資源。
+    批次分析時只需建立一次：比對模型解析、個人歷史平均、HTTP 連線池。
+    """
+    benchmark_profiles: List = field(default_factory=list)
+    http_client: Optional[httpx.AsyncClient] = None
+    # 有值時額外與所有菁英模型比對，回傳最相似的前 k 個
+    similar_models_top_k: Optional[int] = None
+    # 渲染設定 (None 代表使用部署預設的 RENDER_PROFILE)
+    render_profile: Optional[RenderProfile] = None
+    # 串流模式：各階段完成時把 {"event", "data"} 放進此佇列
+    events: Optional[asyncio.Queue] = None
+    # 只分析影片的 (開始秒數, 結束秒數)，None 代表不裁切 (單支影片分析時使用)
+    trim_seconds: Optional[Tuple[Optional[float], Optional[float]]] = None
+    # 長時間練投影片切出的片段：偵測不到出手與肩膀展開幀就不是一次投球，不存紀錄 (run_pitch_pipeline 回傳 None)
+    require_delivery: bool = False
+    # 額外存入紀錄的欄位 (例如所屬場次 session_id / session_offset_seconds)
+    record_fields: Dict = field(default_factory=dict)
+
+    def emit(self, event: str, data):
+        if self.events is not None:
+            self.events.put_nowait({"event": event, "data": data})
+
+# 取得渲染設定 輸入設定名稱 (None 為部署預設) 返回套用部署編碼器設定後的 RenderProfile
+def resolve_render_profile(name: Optional[str] = None) -> RenderProfile:
+    profile = get_render_profile(name or RENDER_PROFILE)
+    overrides = {}
+    if RENDER_CODECS:
+        overrides["codecs"] = RENDER_CODECS
+    if RENDER_QUALITY is not None:
+        overrides["quality"] = RENDER_QUALITY
+    return replace(profile, **overrides) if overrides else profile
 
 # 取得比較模型 輸入資料庫 比較對象 球路 返回比較標準模型
 def get_comparison_model(db: Session, benchmark_player_name: str, detected_pitch_type: str):
@@ -35,91 +174,386 @@ def get_comparison_model(db: Session, benchmark_player_name: str, detected_pitch
     profile_model = crud.get_pitch_model_by_name(db, model_name=fallback_model_name)
     return profile_model
 
-# 分析生物力學特徵函數 輸入影片 返回 運動力學特徵 骨架
-async def analyze_video_kinematics(video_bytes: bytes, filename: str) -> Tuple[Dict, Dict]:
-    logger.info("服務層：(子任務) 正在呼叫 POSE API...")
-    async with httpx.AsyncClient(timeout=API_TIMEOUT) as client:
-        files = {"file": (filename, video_bytes, "video/mp4")}
-        response = await client.post(POSE_API_URL, files=files)
+# 決定比較標竿 輸入資料庫 球員名稱 比較對象 是否比對個人平均 返回要比對的模型列表
+def resolve_benchmark_profiles(db: Session, player_name: str, benchmark_name: str, compare_average: bool) -> List:
+    # 建立一個列表來存放所有要比對的模型
+    benchmark_profiles = []
+
+    # 處理菁英選手模型
+    if benchmark_name:
+        elite_model = crud.get_pitch_model_by_name(db, model_name=benchmark_name)
+        if elite_model:
+            benchmark_profiles.append(elite_model)
+
+    # 如果勾選了，處理個人歷史平均模型
+    if compare_average:
+        current_time = datetime.now(timezone.utc)
+        user_average_model = crud.calculate_user_average_profile(db, player_name, end_date=current_time)
+        if user_average_model:
+            benchmark_profiles.append(user_average_model)
+
+    return benchmark_profiles
+
+async def _post_video(client: Optional[httpx.AsyncClient], url: str, video_bytes: bytes, filename: str,
+                      backend: Optional[InferenceBackend] = None) -> Dict:
+    """上傳影片到推論 API；未提供共用 client 時建立一個只用一次的 client。有 backend 時經由容錯層重試 / 對沖。"""
+    files = {"file": (filename, video_bytes, "video/mp4")}
+
+    async def attempt() -> Dict:
+        if client is None:
+            async with httpx.AsyncClient(timeout=API_TIMEOUT) as own_client:
+                response = await own_client.post(url, files=files)
+        else:
+            response = await client.post(url, files=files)
         response.raise_for_status()
-        pose_data = response.json()
+        return response.json()
+
+    return await (backend.call(attempt) if backend is not None else attempt())
+
+async def _post_video_for_pose(client: Optional[httpx.AsyncClient], url: str, video_bytes: bytes, filename: str,
+                               expected_frames: int = 0, backend: Optional[InferenceBackend] = None) -> PoseTrack:
+    """上傳影片到 Pose API，邊接收回應邊解析成 PoseTrack (不建立整份回應的物件樹)。"""
+    files = {"file": (filename, video_bytes, "video/mp4")}
+
+    async def consume(http_client: httpx.AsyncClient, parser: PoseStreamParser):
+        async with http_client.stream("POST", url, files=files) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+
+    async def attempt() -> PoseTrack:
+        # 每次嘗試 (重試 / 對沖) 都從頭解析
+        parser = PoseStreamParser(expected_frames)
+        if client is None:
+            async with httpx.AsyncClient(timeout=API_TIMEOUT) as own_client:
+                await consume(own_client, parser)
+        else:
+            await consume(client, parser)
+        return parser.finish()
+
+    return await (backend.call(attempt) if backend is not None else attempt())
+
+async def _post_chunks_for_pose(client: Optional[httpx.AsyncClient], url: str,
+                                pose_chunks: List[Tuple[VideoChunk, bytes]], filename: str,
+                                total_frames: int = 0) -> PoseTrack:
+    """各片段並行送到 Pose API (最多 POSE_CHUNK_CONCURRENCY 段同時進行)，再依片段起始幀接回一條 PoseTrack。"""
+    semaphore = asyncio.Semaphore(POSE_CHUNK_CONCURRENCY)
+    stem, ext = os.path.splitext(filename)
+
+    async def post(i: int, chunk: VideoChunk, data: bytes) -> PoseTrack:
+        async with semaphore:
+            return await _post_video_for_pose(client, url, data, f"{stem}_part{i:03d}{ext}", chunk.frame_count,
+                                              backend=pose_backend)
+
+    tasks = [asyncio.ensure_future(post(i, chunk, data)) for i, (chunk, data) in enumerate(pose_chunks)]
+    try:
+        tracks = await asyncio.gather(*tasks)
+    except BaseException:
+        # 任一段失敗就取消其餘片段，不再佔用遠端資源
+        for task in tasks:
+            task.cancel()
+        raise
+    return stitch_pose_tracks(
+        [(track, chunk.start_frame, chunk.keep_start, chunk.keep_end)
+         for track, (chunk, _) in zip(tracks, pose_chunks)],
+        total_frames
+    )
+
+# 分析生物力學特徵函數 輸入影片 返回 運動力學特徵 骨架
+async def analyze_video_kinematics(video_bytes: bytes, filename: str, client: Optional[httpx.AsyncClient] = None,
+                                   expected_frames: int = 0, proxy: Optional[VideoProxy] = None,
+                                   pose_chunks: Optional[List[Tuple[VideoChunk, bytes]]] = None
+                                   ) -> Tuple[Dict, PoseTrack]:
+    if pose_chunks:
+        logger.info(f"服務層：(子任務) 正在分 {len(pose_chunks)} 段呼叫 POSE API...")
+        pose_data = await _post_chunks_for_pose(client, POSE_API_URL, pose_chunks, filename, expected_frames)
+    else:
+        logger.info("服務層：(子任務) 正在呼叫 POSE API...")
+        pose_data = await _post_video_for_pose(client, POSE_API_URL, video_bytes, filename, expected_frames,
+                                               backend=pose_backend)
+    if proxy is not None:
+        # 代理影片的幀編號與座標換算回原始影片
+        pose_data = proxy.map_pose(pose_data)
     logger.info("服務層：(子任務) 正在計算生物力學特徵...")
-    biomechanics_features = extract_pitching_biomechanics(pose_data)
+    biomechanics_features = await asyncio.to_thread(extract_pitching_biomechanics, pose_data)
     return biomechanics_features, pose_data
-    
+
+# 產生分析用代理影片 輸入暫存影片與影片資訊 返回 VideoProxy (失敗或不需要時為原始影片)
+def prepare_analysis_proxy(temp_video_path: str, video_meta: Dict,
+                           trim_seconds: Optional[Tuple[Optional[float], Optional[float]]] = None) -> VideoProxy:
+    fps = video_meta.get("fps") or 0
+    start_frame, end_frame = 0, None
+    if trim_seconds and fps:
+        start_s, end_s = trim_seconds
+        if start_s:
+            start_frame = max(0, int(start_s * fps))
+        if end_s:
+            end_frame = int(math.ceil(end_s * fps))
+    elif MOTION_WINDOW_ENABLED:
+        # 沒有指定裁切時只送出偵測到的投球區間；偵測失敗就送整段
+        try:
+            window = detect_motion_window(temp_video_path, video_meta, margin_seconds=MOTION_WINDOW_MARGIN_SECONDS)
+        except Exception as e:
+            logger.warning(f"服務層：動作區間偵測失敗，送出整段影片: {e}")
+            window = None
+        if window is not None:
+            start_frame, end_frame = window.start_frame, window.end_frame
+    try:
+        return build_proxy(
+            temp_video_path, video_meta,
+            max_height=ANALYSIS_PROXY_MAX_HEIGHT if ANALYSIS_PROXY_ENABLED else None,
+            max_fps=ANALYSIS_PROXY_MAX_FPS if ANALYSIS_PROXY_ENABLED else None,
+            start_frame=start_frame,
+            end_frame=end_frame
+        )
+    except Exception as e:
+        logger.warning(f"服務層：代理影片產生失敗，改送原始影片: {e}", exc_info=True)
+        return VideoProxy(path=temp_video_path, source_path=temp_video_path,
+                          frame_count=video_meta.get("frame_count", 0), fps=fps, source_meta=video_meta)
+
+# 切割骨架推論片段 輸入代理影片 返回 [(片段, 影片內容)]；未啟用、影片不夠長或切割失敗時返回 None
+def prepare_pose_chunks(proxy: VideoProxy) -> Optional[List[Tuple[VideoChunk, bytes]]]:
+    if POSE_CHUNK_SECONDS <= 0 or not proxy.fps or not proxy.frame_count:
+        return None
+    plan = plan_chunks(proxy.frame_count, int(POSE_CHUNK_SECONDS * proxy.fps),
+                       int(POSE_CHUNK_OVERLAP_SECONDS * proxy.fps))
+    if len(plan) < 2:
+        return None
+    try:
+        chunks = split_video(proxy.path, plan, proxy.fps)
+    except Exception as e:
+        logger.warning(f"服務層：影片切割失敗，骨架推論改送整段影片: {e}", exc_info=True)
+        return None
+    pose_chunks = []
+    try:
+        for chunk in chunks:
+            with open(chunk.path, "rb") as f:
+                pose_chunks.append((chunk, f.read()))
+    finally:
+        for chunk in chunks:
+            if os.path.exists(chunk.path):
+                os.remove(chunk.path)
+    return pose_chunks
+
 # 棒球軌跡分析函數 輸入影片輸出球路軌跡
-async def analyze_ball_flight(video_bytes: bytes, filename: str) -> Dict:
+async def analyze_ball_flight(video_bytes: bytes, filename: str, client: Optional[httpx.AsyncClient] = None) -> Dict:
     """
     呼叫 Ball API 以獲取球路相關數據。
     """
     logger.info("服務層：(子任務) 正在呼叫 BALL API...")
-    async with httpx.AsyncClient(timeout=API_TIMEOUT) as client:
-        files = {"file": (filename, video_bytes, "video/mp4")}
-        response = await client.post(BALL_API_URL, files=files)
-        response.raise_for_status()
-        return response.json()
+    return await _post_video(client, BALL_API_URL, video_bytes, filename, backend=ball_backend)
 
-# 主要分析路由 輸入資料庫 影片 球員名稱 比較對象 返回分析結果
+# 主要分析路由 輸入影片 球員名稱 比較對象 返回分析結果
+# 相同影片內容 + 參數的並行請求共用同一次分析 (同一筆紀錄)；帶 idempotency_key 時完成後的結果也會保留供重送
+# 實際分析前經過准入控制，忙碌時排隊，排隊已滿則拋出 AdmissionRejected
 async def analyze_pitch_service(
-        db,
-        video_file, 
+        video_file,
         player_name,
         benchmark_name,
-        compare_average: bool
+        compare_average: bool,
+        similar_models_top_k: Optional[int] = None,
+        render_profile: Optional[str] = None,
+        trim_seconds: Optional[Tuple[Optional[float], Optional[float]]] = None,
+        idempotency_key: Optional[str] = None
         ):
-    
+
     logger.info(f"[服務層] 收到參數: player_name='{player_name}', benchmark_name='{benchmark_name}', compare_average={compare_average}") # 偵錯日誌
-    
-    # 步驟 1 嘗試暫存原始影片
-    temp_video_path = f"temp_{video_file.filename}"
-    
+
+    # 步驟 1 暫存原始影片 (請求自己的暫存目錄，同時計算內容雜湊)
+    workspace = await open_upload_scratch("analyze", [video_file])
+    # 實際執行分析的工作接手暫存目錄 (同步取走)；共用其他請求的結果時由本請求刪除自己的暫存目錄
+    owned = {"workspace": workspace}
+    try:
+        digest = hashlib.sha256()
+        temp_video_path = await asyncio.to_thread(spool_upload, video_file, workspace, digest)
+        profile = resolve_render_profile(render_profile)
+        params = [player_name, benchmark_name, compare_average, similar_models_top_k, profile.name, trim_seconds]
+        analysis_key = f"{digest.hexdigest()}:{hashlib.sha256(json.dumps(params).encode('utf-8')).hexdigest()[:16]}"
+
+        keys = []
+        if idempotency_key:
+            keys.append((f"idempotency:{idempotency_key}", IDEMPOTENCY_TTL_SECONDS))
+        if SINGLE_FLIGHT_ENABLED:
+            keys.append((f"analysis:{analysis_key}", 0))
+
+        def start():
+            return _run_single_analysis(owned.pop("workspace"), temp_video_path, video_file.filename, player_name,
+                                        benchmark_name, compare_average, similar_models_top_k, profile, trim_seconds)
+
+        if not keys:
+            return await start()
+        result, role = await analysis_flight.run(keys, start, fingerprint=analysis_key)
+        if role != "leader":
+            logger.info(f"[服務層] 相同的分析請求 ({role})，直接使用紀錄 ID: {result['new_record']['id']}")
+        return result
+    finally:
+        leftover = owned.get("workspace")
+        if leftover is not None:
+            leftover.close()
+
+async def _run_single_analysis(workspace: ScratchDir, temp_video_path: str, filename: str, player_name: str,
+                               benchmark_name: str, compare_average: bool, similar_models_top_k: Optional[int],
+                               render_profile: RenderProfile,
+                               trim_seconds: Optional[Tuple[Optional[float], Optional[float]]]):
+    with workspace:
+        async with analysis_admission.admit(os.path.getsize(temp_video_path)):
+            # 可能由多個請求共用，發起請求結束後仍可能在執行，使用自己的 Session
+            db = SessionLocal()
+            try:
+                context = AnalysisContext(
+                    benchmark_profiles=resolve_benchmark_profiles(db, player_name, benchmark_name, compare_average),
+                    similar_models_top_k=similar_models_top_k,
+                    render_profile=render_profile,
+                    trim_seconds=trim_seconds
+                )
+                return await run_pitch_pipeline(db, context, temp_video_path, filename, player_name)
+            finally:
+                db.close()
+
+# 上傳檔案大小 (UploadFile 已由框架暫存，不需要讀取內容)
+def _upload_size(video_file) -> int:
+    f = video_file.file
+    position = f.tell()
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    f.seek(position)
+    return size
+
+# 建立上傳影片的暫存目錄 依上傳大小預留磁碟配額 (不足時等待，逾時拋出 ScratchQuotaExceeded)
+async def open_upload_scratch(prefix: str, video_files) -> ScratchDir:
+    upload_bytes = sum(_upload_size(f) for f in video_files)
+    return await analysis_scratch.open(prefix, int(upload_bytes * SCRATCH_RESERVE_FACTOR))
+
+# 暫存單支上傳影片到 workspace (串流回應開始前必須完成，請求結束後 UploadFile 就會被關閉)；有 digest 時同時計算內容雜湊
+def spool_upload(video_file, workspace: ScratchDir, digest=None) -> str:
+    temp_video_path = workspace.file(video_file.filename)
     try:
         with open(temp_video_path, "wb") as buffer:
-            shutil.copyfileobj(video_file.file, buffer)
+            if digest is None:
+                shutil.copyfileobj(video_file.file, buffer)
+            else:
+                for block in iter(lambda: video_file.file.read(1 << 20), b""):
+                    digest.update(block)
+                    buffer.write(block)
     except Exception as e:
         logger.error(f"無法儲存影片檔案: {e}", exc_info=True)
+        if os.path.exists(temp_video_path):
+            os.remove(temp_video_path)
         raise e
+    return temp_video_path
+
+# 串流分析 輸入已暫存的影片 依序回傳各階段的結果，最後是完整結果 (result) 或錯誤 (error)
+# admission_slot 為回應開始前已取得的准入名額 (忙碌時才能回 429)，串流結束時歸還
+async def analyze_pitch_stream_service(
+        workspace: ScratchDir,
+        temp_video_path: str,
+        filename: str,
+        player_name: str,
+        benchmark_name: str,
+        compare_average: bool,
+        similar_models_top_k: Optional[int] = None,
+        render_profile: Optional[str] = None,
+        trim_seconds: Optional[Tuple[Optional[float], Optional[float]]] = None,
+        admission_slot: Optional[AdmissionSlot] = None
+        ) -> AsyncIterator[Dict]:
+    logger.info(f"[服務層] 串流分析: player_name='{player_name}', benchmark_name='{benchmark_name}', compare_average={compare_average}")
 
+    # 串流回應期間請求層級的 Session 已經關閉，使用自己的 Session
+    db = SessionLocal()
+    events: asyncio.Queue = asyncio.Queue()
+    pipeline = None
     try:
-        with open(temp_video_path, "rb") as f:
+        context = AnalysisContext(
+            benchmark_profiles=resolve_benchmark_profiles(db, player_name, benchmark_name, compare_average),
+            similar_models_top_k=similar_models_top_k,
+            render_profile=resolve_render_profile(render_profile),
+            events=events,
+            trim_seconds=trim_seconds
+        )
+        pipeline = asyncio.ensure_future(run_pitch_pipeline(db, context, temp_video_path, filename, player_name))
+        while True:
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({next_event, pipeline}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_event.done():
+                next_event.cancel()
+                break
+            yield next_event.result()
+        while not events.empty():
+            yield events.get_nowait()
+
+        try:
+            yield {"event": "result", "data": pipeline.result()}
+        except Exception as e:
+            logger.error(f"串流分析失敗: {e}", exc_info=True)
+            yield {"event": "error", "data": {"detail": getattr(e, "detail", None) or str(e)}}
+    finally:
+        # 用戶端中途斷線時取消分析並清掉暫存目錄
+        if pipeline is not None and not pipeline.done():
+            pipeline.cancel()
+        if admission_slot is not None:
+            admission_slot.release()
+        workspace.close()
+        db.close()
+
+# 單支影片的完整分析流程 (單次分析與批次分析共用)
+async def run_pitch_pipeline(
+        db,
+        context: AnalysisContext,
+        temp_video_path: str,
+        filename: str,
+        player_name: str
+        ):
+    # 代理影片、推論片段、渲染影片與關鍵影格都寫在原始影片所在的暫存目錄 (請求之間互不干擾)
+    work_dir = os.path.dirname(os.path.abspath(temp_video_path))
+
+    # 影片資訊 (原始影片)：隨軌跡一起保存，渲染與球速計算都以原始影片為準
+    video_meta = await asyncio.to_thread(probe_video, temp_video_path)
+
+    # 送去推論的是縮小 / 降幀 / 裁切後的代理影片，結果再換算回原始影片
+    proxy = await asyncio.to_thread(prepare_analysis_proxy, temp_video_path, video_meta, context.trim_seconds)
+    try:
+        with open(proxy.path, "rb") as f:
             video_bytes = f.read()
+        # 長影片的骨架推論切成多段並行送出 (片段由代理影片切出，幀編號仍以代理影片為準)
+        pose_chunks = await asyncio.to_thread(prepare_pose_chunks, proxy)
     except Exception as e:
         logger.error(f"無法讀取影片內容: {e}", exc_info=True)
         raise e
+    finally:
+        proxy.cleanup()
+
+    # 步驟 2: 並行呼叫 API 分析骨架跟球路；骨架通常先回來，先計算特徵與姿勢分數 (串流模式可先送出結果)
+    kinematics_task = asyncio.ensure_future(
+        analyze_video_kinematics(video_bytes, filename, context.http_client,
+                                 expected_frames=proxy.frame_count, proxy=proxy, pose_chunks=pose_chunks))
+    ball_task = asyncio.ensure_future(analyze_ball_flight(video_bytes, filename, context.http_client))
+    # 影片內容已交給上傳工作，之後只需要暫存檔路徑，提早釋放記憶體
+    del video_bytes, pose_chunks
 
-    # 步驟 2: 並行呼叫 API 分析骨架跟球路
-    (kinematics_results, ball_data) = await asyncio.gather(
-            analyze_video_kinematics(video_bytes, video_file.filename),
-            analyze_ball_flight(video_bytes, video_file.filename)
-            )
-    
     # 從kinematics_results拿出骨架資料跟運動力學特徵
-    biomechanics_features, pose_data = kinematics_results
-    
-    # 從球路資料拿到pitch_type
-    detected_pitch_type = ball_data.get("predicted_pitch_type",None)
-    
-    # 步驟 3: 決定比較標竿並取得模型
-    # 建立一個列表來存放所有要比對的模型
-    benchmark_profiles_to_return = []
+    try:
+        biomechanics_features, pose_data = await kinematics_task
+    except BaseException:
+        ball_task.cancel()
+        raise
+    if context.require_delivery and (biomechanics_features.get("release_frame") is None
+                                     or biomechanics_features.get("shoulder_frame") is None):
+        ball_task.cancel()
+        logger.info(f"服務層：{filename} 偵測不到出手 / 肩膀展開幀，不是一次投球")
+        return None
+    context.emit("pose", {"frames_with_pose": len(pose_data), "total_frames": pose_data.total_frames})
+    context.emit("keyframes", {key: biomechanics_features.get(key)
+                               for key in ("release_frame", "landing_frame", "shoulder_frame")})
+    context.emit("features", biomechanics_features)
 
-    # 處理菁英選手模型
-    if benchmark_name:
-        elite_model = crud.get_pitch_model_by_name(db, model_name=benchmark_name)
-        if elite_model:
-            benchmark_profiles_to_return.append(elite_model)
-
-    # 如果勾選了，處理個人歷史平均模型
-    if compare_average:
-        current_time = datetime.now(timezone.utc)
-        user_average_model = crud.calculate_user_average_profile(db, player_name, end_date=current_time)
-        if user_average_model:
-            benchmark_profiles_to_return.append(user_average_model)
+    # 步驟 3: 比較標竿已由呼叫端決定 (批次分析時整批只解析一次)
+    benchmark_profiles_to_return = context.benchmark_profiles
 
     # 使用第一個模型（通常是菁英模型）來計算主要分數
     pose_score = 0
     pose_score_details = {}
     pose_score_message = "分析成功" # 預設訊息
+    scored_model_name = None
 
     if benchmark_profiles_to_return:
         main_profile_data = benchmark_profiles_to_return[0].profile_data
@@ -128,6 +562,9 @@ async def analyze_pitch_service(
                 features=biomechanics_features,
                 profile_data=main_profile_data
             )
+            # 只記錄資料庫中的菁英模型 (個人歷史平均是即時計算的，無法重新計分)
+            if isinstance(benchmark_profiles_to_return[0], PitchModel):
+                scored_model_name = benchmark_profiles_to_return[0].model_name
         else:
             # 雖然有模型，但模型沒有資料的情況
             pose_score_message = "比對模型資料不完整"
@@ -136,33 +573,89 @@ async def analyze_pitch_service(
         # 【建議優化】: 在找不到模型時，更新訊息內容
         pose_score_message = "未選擇或找不到比對模型"
         logger.warning(f"服務層：找不到任何比對模型，pose_score 設為 0。")
+    context.emit("pose_score", {
+        "pose_score": pose_score,
+        "pose_score_details": pose_score_details,
+        "pose_score_message": pose_score_message,
+        "benchmark_model_name": scored_model_name
+    })
+
+    # 與所有菁英模型比對 (記憶體矩陣，不逐一查詢資料庫)
+    similar_models = None
+    if context.similar_models_top_k:
+        similar_models = rank_similar_models(db, biomechanics_features, context.similar_models_top_k)
+        context.emit("similar_models", similar_models)
+
+    ball_data = proxy.map_ball(await ball_task)
+    # 從球路資料拿到pitch_type
+    detected_pitch_type = ball_data.get("predicted_pitch_type",None)
 
     # 計算投球分數
-    ball_score = classify_ball_quality(ball_data, ball_prediction_model)
-        
-    # 渲染影片
+    ball_score = await asyncio.to_thread(lambda: classify_ball_quality(ball_data, get_ball_model()))
+    context.emit("ball_score", {"ball_score": ball_score, "predicted_pitch_type": detected_pitch_type})
+
+    # 保存原始軌跡，之後演算法更新時可直接重新分析 (失敗不影響本次分析)
+    tracks_blob = None
     try:
-        rendered_video_local_path, max_speed_kmh = render_video_with_pose_and_max_ball_speed(
-            input_video_path=temp_video_path,
-            pose_json=pose_data,
-            ball_json=ball_data
-        )
+        tracks_blob = await asyncio.to_thread(encode_tracks, pose_data, ball_data, video_meta)
     except Exception as e:
-        logger.error(f"影片渲染失敗: {e}", exc_info=True)
-        raise e
+        logger.warning(f"服務層：軌跡打包失敗，本次不保存軌跡: {e}", exc_info=True)
 
-    # 上傳至 GCS
+    render_profile = context.render_profile or resolve_render_profile()
+    rendered_video_local_path = None
     gcs_video_url = None
-    try:
-        destination_blob_name = f"render_videos/rendered_{video_file.filename}"
-        gcs_video_url = upload_video_to_gcs(
-            bucket_name=GCS_BUCKET_NAME,
-            source_file_path=rendered_video_local_path,
-            destination_blob_name=destination_blob_name
-        )
-    except Exception as e:
-        logger.error(f"GCS 上傳失敗: {e}", exc_info=True)
-        raise e
+    hls_url = None
+    source_video_blob = None
+    # 延遲渲染：只上傳原始影片，最大球速直接由球路軌跡計算；沒有軌跡 (打包失敗) 時無法事後渲染，改為立即渲染
+    if RENDER_MODE == "lazy" and tracks_blob is not None:
+        max_speed_kmh = calculate_max_ball_speed(ball_data, video_meta.get("fps"),
+                                                 video_meta.get("frame_count") or None)
+        context.emit("speed", {"max_speed_kmh": max_speed_kmh})
+        try:
+            source_video_blob = video_renderer.source_blob_name(filename)
+            await asyncio.to_thread(
+                upload_video_to_gcs,
+                bucket_name=GCS_BUCKET_NAME,
+                source_file_path=temp_video_path,
+                destination_blob_name=source_video_blob
+            )
+        except Exception as e:
+            logger.error(f"GCS 上傳失敗: {e}", exc_info=True)
+            raise e
+    else:
+        # 渲染影片 (CPU 密集，移到執行緒中執行以免阻塞其他請求)
+        try:
+            rendered_video_local_path, max_speed_kmh = await asyncio.to_thread(
+                render_video_with_pose_and_max_ball_speed,
+                input_video_path=temp_video_path,
+                pose_json=pose_data,
+                ball_json=ball_data,
+                key_frames={
+                    "release": biomechanics_features.get("release_frame"),
+                    "landing": biomechanics_features.get("landing_frame")
+                },
+                profile=render_profile,
+                output_dir=work_dir
+            )
+        except Exception as e:
+            logger.error(f"影片渲染失敗: {e}", exc_info=True)
+            raise e
+        context.emit("speed", {"max_speed_kmh": max_speed_kmh})
+
+        # 上傳至 GCS (faststart / HLS 依部署設定)
+        try:
+            # 完整影片沿用原本的路徑，其他設定加上設定名稱以免互相覆蓋
+            prefix = "rendered_" if render_profile.name == "full" else f"rendered_{render_profile.name}_"
+            destination_blob_name = f"render_videos/{prefix}{filename}"
+            gcs_video_url, hls_url = await asyncio.to_thread(
+                video_renderer.publish_rendered_video,
+                rendered_video_local_path,
+                destination_blob_name
+            )
+        except Exception as e:
+            logger.error(f"GCS 上傳失敗: {e}", exc_info=True)
+            raise e
+        context.emit("video", {"video_url": gcs_video_url, "hls_url": hls_url, "render_profile": render_profile.name})
 
     # 儲存關鍵影格圖片
     release_frame_url = None
@@ -173,25 +666,28 @@ async def analyze_pitch_service(
         "landing": biomechanics_features.get("landing_frame"),
         "shoulder": biomechanics_features.get("shoulder_frame")
         }
-        
-    saved_frame_paths = save_specific_frames(temp_video_path, frame_indices)
+
+    saved_frame_paths = await asyncio.to_thread(save_specific_frames, temp_video_path, frame_indices, work_dir)
 
     # 上傳關鍵影格圖片到 GCS
     try:
         if "release_frame_path" in saved_frame_paths:
-            release_frame_url = upload_video_to_gcs(
+            release_frame_url = await asyncio.to_thread(
+                upload_video_to_gcs,
                 bucket_name=GCS_BUCKET_NAME,
                 source_file_path=saved_frame_paths["release_frame_path"],
                 destination_blob_name=f"key_frames/release_{os.path.basename(saved_frame_paths['release_frame_path'])}"
             )
         if "landing_frame_path" in saved_frame_paths:
-            landing_frame_url = upload_video_to_gcs(
+            landing_frame_url = await asyncio.to_thread(
+                upload_video_to_gcs,
                 bucket_name=GCS_BUCKET_NAME,
                 source_file_path=saved_frame_paths["landing_frame_path"],
                 destination_blob_name=f"key_frames/landing_{os.path.basename(saved_frame_paths['landing_frame_path'])}"
             )
         if "shoulder_frame_path" in saved_frame_paths:
-            shoulder_frame_url = upload_video_to_gcs(
+            shoulder_frame_url = await asyncio.to_thread(
+                upload_video_to_gcs,
                 bucket_name=GCS_BUCKET_NAME,
                 source_file_path=saved_frame_paths["shoulder_frame_path"],
                 destination_blob_name=f"key_frames/shoulder_{os.path.basename(saved_frame_paths['shoulder_frame_path'])}"
@@ -199,12 +695,17 @@ async def analyze_pitch_service(
     except Exception as e:
         logger.error(f"GCS 上傳失敗: {e}", exc_info=True)
         raise e
+    context.emit("keyframe_urls", {
+        "release_frame_url": release_frame_url,
+        "landing_frame_url": landing_frame_url,
+        "shoulder_frame_url": shoulder_frame_url
+    })
 
     # 清理本地臨時檔案
     try:
         if os.path.exists(temp_video_path):
             os.remove(temp_video_path)
-        if os.path.exists(rendered_video_local_path):
+        if rendered_video_local_path and os.path.exists(rendered_video_local_path):
             os.remove(rendered_video_local_path)
         for key in ["release_frame_path", "landing_frame_path", "shoulder_frame_path"]:
             path = saved_frame_paths.get(key)
@@ -224,7 +725,14 @@ async def analyze_pitch_service(
         "release_frame_url": release_frame_url,
         "landing_frame_url": landing_frame_url,
         "shoulder_frame_url": shoulder_frame_url,
-        "pose_score_message": pose_score_message
+        "pose_score_message": pose_score_message,
+        "benchmark_model_name": scored_model_name,
+        "tracks_blob": tracks_blob,
+        "tracks_format": TRACKS_FORMAT_VERSION if tracks_blob is not None else None,
+        "source_video_blob": source_video_blob,
+        "video_render_profile": render_profile.name,
+        "hls_url": hls_url,
+        **context.record_fields
     }
 
     # 步驟 7: 將本次分析結果存入資料庫
@@ -238,8 +746,14 @@ async def analyze_pitch_service(
         logger.info(f"成功將分析結果 (ID: {new_record_id}) 存入資料庫。")
     except Exception as e:
         logger.error(f"服務層：分析結果存入資料庫失敗: {e}", exc_info=True)
+        db.rollback()
         new_record_id = None
         new_record_created_at = None
+    context.emit("record", {"id": new_record_id, "created_at": new_record_created_at})
+    if gcs_video_url is None and new_record_id is not None:
+        # 延遲渲染：影片網址要等有人呼叫 GET /analyses/{id}/video 才產生
+        context.emit("video", {"video_url": None, "render_profile": render_profile.name,
+                               "video_endpoint": f"/analyses/{new_record_id}/video"})
 
     final_response_package = {
         "new_record": {
@@ -247,6 +761,10 @@ async def analyze_pitch_service(
             "created_at": new_record_created_at,
             "player_name": player_name,
             "video_path": gcs_video_url,
+            "hls_url": hls_url,
+            "render_profile": render_profile.name,
+            # 延遲渲染時 video_path 為 None，由此路徑取得 (第一次呼叫時才渲染)
+            "video_endpoint": f"/analyses/{new_record_id}/video" if new_record_id is not None else None,
             "keyframe_urls": {
                 "release_frame_url": release_frame_url,
                 "landing_frame_url": landing_frame_url,
@@ -257,7 +775,7 @@ async def analyze_pitch_service(
                 "pose_score": pose_score,
                 "ball_score": ball_score,
                 "pose_score_details": pose_score_details,
-                "pose_score_message": pose_score_message 
+                "pose_score_message": pose_score_message
             },
             "biomechanics_features": biomechanics_features
         },
@@ -269,5 +787,228 @@ async def analyze_pitch_service(
             } for p in benchmark_profiles_to_return
         ]
     }
+    if similar_models is not None:
+        final_response_package["similar_models"] = similar_models
+
+    return final_response_package
+
+# 相似選手排名 輸入生物力學特徵 返回最接近的前 k 個菁英模型
+def rank_similar_models(db: Session, biomechanics_features: Dict, top_k: int = 5) -> List[Dict]:
+    top_k = max(1, min(top_k, SIMILAR_MODELS_MAX_TOP_K))
+    try:
+        return profile_catalog.rank(db, biomechanics_features or {}, top_k=top_k)
+    except Exception as e:
+        logger.error(f"服務層：相似選手排名失敗: {e}", exc_info=True)
+        return []
+
+# 批次暫存上傳影片到 workspace 必須在回應開始串流前完成 (請求結束後 UploadFile 就會被關閉)
+def spool_batch_uploads(video_files, workspace: ScratchDir) -> Tuple[str, List[Tuple[str, str]]]:
+    batch_id = uuid.uuid4().hex[:8]
+    spooled = []
+    try:
+        for index, video_file in enumerate(video_files):
+            # 加上序號，避免同一批次內的同名檔案互相覆蓋
+            temp_video_path = workspace.file(f"{index}_{os.path.basename(video_file.filename)}")
+            with open(temp_video_path, "wb") as buffer:
+                shutil.copyfileobj(video_file.file, buffer)
+            spooled.append((video_file.filename, temp_video_path))
+    except Exception as e:
+        logger.error(f"無法儲存批次影片檔案: {e}", exc_info=True)
+        raise e
+    return batch_id, spooled
+
+# 批次 / 練投場次內同時分析的數量：不超過設定上限，也不超過准入控制的並行上限 (多開只會在准入佇列中排隊，
+# 佔滿佇列後連自己的下一支都會被拒絕)
+def _item_concurrency(requested: Optional[int], limit: int) -> int:
+    concurrency = max(1, min(requested or limit, limit))
+    if analysis_admission.max_concurrency > 0:
+        concurrency = min(concurrency, analysis_admission.max_concurrency)
+    return concurrency
 
-    return final_response_package
\ No newline at end of file
+# 批次分析 輸入已暫存的影片列表 依完成順序逐支回傳結果
+async def analyze_pitch_batch_service(
+        workspace: ScratchDir,
+        batch_id: str,
+        spooled_videos: List[Tuple[str, str]],
+        player_name: str,
+        benchmark_name: str,
+        compare_average: bool,
+        max_concurrency: Optional[int] = None,
+        similar_models_top_k: Optional[int] = None,
+        render_profile: Optional[str] = None
+        ) -> AsyncIterator[Dict]:
+    concurrency = _item_concurrency(max_concurrency, BATCH_MAX_CONCURRENCY)
+    logger.info(f"[服務層] 批次 {batch_id}: {len(spooled_videos)} 支影片, player_name='{player_name}', "
+                f"benchmark_name='{benchmark_name}', compare_average={compare_average}, 並行上限={concurrency}")
+
+    # 串流回應期間請求層級的 Session 已經關閉，批次使用自己的 Session
+    db = SessionLocal()
+    semaphore = asyncio.Semaphore(concurrency)
+    succeeded = 0
+    tasks = []
+    try:
+        async with httpx.AsyncClient(timeout=API_TIMEOUT) as http_client:
+            # 整批共用：比對模型、個人歷史平均 (以批次開始時間計算)、HTTP 連線池
+            context = AnalysisContext(
+                benchmark_profiles=resolve_benchmark_profiles(db, player_name, benchmark_name, compare_average),
+                http_client=http_client,
+                similar_models_top_k=similar_models_top_k,
+                render_profile=resolve_render_profile(render_profile)
+            )
+
+            async def run_one(index: int, filename: str, temp_video_path: str) -> Dict:
+                async with semaphore:
+                    try:
+                        # 每支影片各自經過准入控制，批次不會繞過整個行程的並行數與記憶體預算
+                        async with analysis_admission.admit(os.path.getsize(temp_video_path)):
+                            result = await run_pitch_pipeline(db, context, temp_video_path, filename, player_name)
+                        return {"index": index, "filename": filename, "status": "ok", "result": result}
+                    except Exception as e:
+                        logger.error(f"批次 {batch_id} 第 {index} 支影片 ({filename}) 分析失敗: {e}", exc_info=True)
+                        detail = getattr(e, "detail", None) or str(e)
+                        return {"index": index, "filename": filename, "status": "error", "detail": detail}
+                    finally:
+                        if os.path.exists(temp_video_path):
+                            os.remove(temp_video_path)
+
+            tasks = [asyncio.ensure_future(run_one(i, name, path)) for i, (name, path) in enumerate(spooled_videos)]
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                if item["status"] == "ok":
+                    succeeded += 1
+                yield item
+
+        yield {
+            "event": "summary",
+            "batch_id": batch_id,
+            "total": len(spooled_videos),
+            "succeeded": succeeded,
+            "failed": len(spooled_videos) - succeeded
+        }
+    finally:
+        # 用戶端中途斷線時取消尚未完成的工作並清掉暫存目錄
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        workspace.close()
+        db.close()
+
+# 建立長時間練投影片的暫存目錄：影片本身 + 每段同時分析時的切割片段、代理影片與渲染
+async def open_session_scratch(video_file, concurrency: int) -> ScratchDir:
+    reserve_bytes = _upload_size(video_file) + concurrency * int(SCRATCH_RENDER_RESERVE_MB * MB)
+    return await analysis_scratch.open("session", reserve_bytes)
+
+# 長時間練投影片 輸入已暫存的影片 逐段偵測每一次投球並切成獨立片段並行分析，每次投球存成一筆紀錄，依完成順序逐段回傳
+async def analyze_session_service(
+        workspace: ScratchDir,
+        session_id: str,
+        temp_video_path: str,
+        filename: str,
+        player_name: str,
+        benchmark_name: str,
+        compare_average: bool,
+        max_concurrency: Optional[int] = None,
+        similar_models_top_k: Optional[int] = None,
+        render_profile: Optional[str] = None
+        ) -> AsyncIterator[Dict]:
+    concurrency = _item_concurrency(max_concurrency, SESSION_MAX_CONCURRENCY)
+    logger.info(f"[服務層] 練投場次 {session_id}: {filename}, player_name='{player_name}', "
+                f"benchmark_name='{benchmark_name}', compare_average={compare_average}, 並行上限={concurrency}")
+
+    # 串流回應期間請求層級的 Session 已經關閉，使用自己的 Session
+    db = SessionLocal()
+    semaphore = asyncio.Semaphore(concurrency)
+    finished: asyncio.Queue = asyncio.Queue()
+    tasks = []
+    counts = {"ok": 0, "no_pitch": 0, "error": 0}
+    scan_task = None
+    try:
+        video_meta = await asyncio.to_thread(probe_video, temp_video_path)
+        fps = video_meta.get("fps") or 0
+        source_bytes = os.path.getsize(temp_video_path)
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        async with httpx.AsyncClient(timeout=API_TIMEOUT) as http_client:
+            context = AnalysisContext(
+                benchmark_profiles=resolve_benchmark_profiles(db, player_name, benchmark_name, compare_average),
+                http_client=http_client,
+                similar_models_top_k=similar_models_top_k,
+                render_profile=resolve_render_profile(render_profile),
+                require_delivery=True
+            )
+
+            async def run_one(segment: PitchSegment):
+                item = {"index": segment.index,
+                        "start_seconds": round(segment.start_frame / fps, 3),
+                        "end_seconds": round(segment.end_frame / fps, 3)}
+                # 片段檔名帶場次編號：關鍵影格與原始影片在儲存空間中的路徑都由檔名產生
+                clip_name = f"{stem}_{session_id}_{segment.index:03d}.mp4"
+                clip_path = workspace.file(clip_name)
+                # 准入成本以片段佔整支影片的比例估計上傳大小 (切割前還不知道片段檔案大小)
+                clip_bytes = source_bytes * (segment.end_frame - segment.start_frame) // max(
+                    1, video_meta.get("frame_count") or segment.end_frame)
+                try:
+                    async with semaphore, analysis_admission.admit(clip_bytes):
+                        await asyncio.to_thread(cut_clip, temp_video_path, segment.start_frame, segment.end_frame,
+                                                fps, clip_path)
+                        # 片段就是要分析的範圍，不再偵測動作區間
+                        segment_context = replace(context, trim_seconds=(None, None), record_fields={
+                            "session_id": session_id, "session_offset_seconds": item["start_seconds"]})
+                        result = await run_pitch_pipeline(db, segment_context, clip_path, clip_name, player_name)
+                    item.update({"status": "ok", "result": result} if result is not None else {"status": "no_pitch"})
+                except Exception as e:
+                    logger.error(f"練投場次 {session_id} 第 {segment.index} 段分析失敗: {e}", exc_info=True)
+                    item.update({"status": "error", "detail": getattr(e, "detail", None) or str(e)})
+                finally:
+                    if os.path.exists(clip_path):
+                        os.remove(clip_path)
+                counts[item["status"]] += 1
+                finished.put_nowait(item)
+
+            # 偵測與分析同時進行：每偵測到一段就開始分析，不必等整支影片掃完
+            async def scan():
+                segments = iter_pitch_segments(temp_video_path, video_meta,
+                                               margin_seconds=SESSION_MARGIN_SECONDS,
+                                               gap_seconds=SESSION_GAP_SECONDS,
+                                               min_seconds=SESSION_MIN_PITCH_SECONDS,
+                                               max_seconds=SESSION_MAX_PITCH_SECONDS)
+                while True:
+                    segment = await asyncio.to_thread(next, segments, None)
+                    if segment is None:
+                        return
+                    tasks.append(asyncio.ensure_future(run_one(segment)))
+
+            scan_task = asyncio.ensure_future(scan())
+            reported = 0
+            while not scan_task.done() or reported < len(tasks):
+                next_item = asyncio.ensure_future(finished.get())
+                waiting = {next_item} if scan_task.done() else {next_item, scan_task}
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if not next_item.done():
+                    next_item.cancel()
+                    continue
+                reported += 1
+                yield next_item.result()
+
+        summary = {
+            "event": "summary",
+            "session_id": session_id,
+            "segments": len(tasks),
+            "pitches": counts["ok"],
+            "no_pitch": counts["no_pitch"],
+            "failed": counts["error"]
+        }
+        try:
+            scan_task.result()
+        except Exception as e:
+            logger.error(f"練投場次 {session_id} 投球偵測失敗: {e}", exc_info=True)
+            summary["detail"] = f"投球偵測失敗: {e}"
+        yield summary
+    finally:
+        # 用戶端中途斷線時取消尚未完成的工作並清掉暫存目錄 (進行中的偵測步驟會在下一段或影片結尾停止)
+        if scan_task is not None and not scan_task.done():
+            scan_task.cancel()
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        workspace.close()
+        db.close()
@@ -0,0 +1,318 @@
+# 檔案: single_flight.py
+# 職責: 相同內容的並行分析只執行一次 (single-flight)，其餘請求等待並取得同一份結果。
+#
+#   前端轉圈圈太久時使用者常重複送出同一支影片，每次都會跑完整流程並多寫一筆 PitchAnalyses。
+#   以「影片內容雜湊 + 分析參數」為 key：執行中的相同請求直接共用同一個工作 (asyncio.Task)。
+#   用戶端帶 Idempotency-Key 重試時，完成後的結果也會保留一段時間 (重送直接拿到同一筆紀錄)；
+#   同一個 Idempotency-Key 搭配不同內容視為用法錯誤 (IdempotencyKeyConflict)。
+#
+#   工作以 asyncio.shield 等待：發起的請求中途斷線不會取消其他人共用的分析。
+#
+#   提供 DatabaseFlightStore 時，執行中的工作 (租約) 與保留的結果也記在資料庫 (single_flight 資料表)，
+#   pre-fork 的其他工作行程收到相同請求時等待同一個工作、重送時取得同一份結果；
+#   執行的行程結束 (租約過期) 或工作失敗時，等待中的請求重新取得租約並自行執行。
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from config import SINGLE_FLIGHT_LEASE_SECONDS, SINGLE_FLIGHT_POLL_SECONDS
+from database import FlightRecord, SessionLocal
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = Counter("single_flight_requests_total",
+                   "分析請求的去重結果 (leader = 實際執行, joined = 共用執行中的分析, replayed = 重送取得保留的結果)",
+                   ("flight", "role"))
+
+
+class IdempotencyKeyConflict(Exception):
+    """同一個 key 已用於不同內容 / 參數的請求。"""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite 讀回的時間沒有時區 (寫入時為 UTC)
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+
+def _key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class DatabaseFlightStore:
+    """
+    SingleFlight 的跨行程紀錄 (single_flight 資料表)。每個方法各自開一個 Session，都是同步的 (由 SingleFlight 在執行緒中呼叫)。
+    結果以 jsonable_encoder 轉成 JSON 保存 (與 API 回應的序列化方式相同)。
+    """
+
+    def __init__(self, session_factory=SessionLocal, lease_s: float = SINGLE_FLIGHT_LEASE_SECONDS,
+                 poll_s: float = SINGLE_FLIGHT_POLL_SECONDS):
+        self.session_factory = session_factory
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+
+    def _is_live(self, row: FlightRecord, now: datetime) -> bool:
+        if row.status == "completed":
+            return _as_utc(row.expires_at) > now
+        heartbeat_at = _as_utc(row.heartbeat_at)
+        return heartbeat_at is not None and heartbeat_at > now - timedelta(seconds=self.lease_s)
+
+    def _reclaimable(self, now: datetime):
+        """可以被重新取得的紀錄 (保留期限已過的結果，或租約過期的執行中工作)。"""
+        return or_((FlightRecord.status == "completed") & (FlightRecord.expires_at <= now),
+                   (FlightRecord.status == "running") & (FlightRecord.heartbeat_at <= now - timedelta(seconds=self.lease_s)))
+
+    def acquire(self, flight: str, keys: Sequence[Tuple[str, float]], fingerprint: str) -> Tuple[str, Any]:
+        """
+        依序檢查每個 key：有保留的結果回傳 ("replayed", 結果)，有其他行程執行中回傳 ("running", key)；
+        都沒有時在所有 key 上取得租約，回傳 ("leader", 持有者代號)。與其他行程同時取得失敗時回傳 ("retry", None)。
+        """
+        now = _now()
+        db = self.session_factory()
+        try:
+            rows = {row.key_hash: row for row in db.execute(
+                select(FlightRecord).where(FlightRecord.key_hash.in_([_key_hash(k) for k, _ in keys]))).scalars()}
+            for key, _ in keys:
+                row = rows.get(_key_hash(key))
+                if row is None or not self._is_live(row, now):
+                    continue
+                if row.fingerprint != fingerprint:
+                    raise IdempotencyKeyConflict(f"{key} 已用於內容或參數不同的請求")
+                if row.status == "completed":
+                    return "replayed", row.result
+                return "running", key
+
+            owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            values = dict(flight=flight, fingerprint=fingerprint, status="running", owner=owner, heartbeat_at=now,
+                          expires_at=None, result=None)
+            for key, _ in keys:
+                key_hash = _key_hash(key)
+                if key_hash in rows:
+                    # 條件式 UPDATE：多個行程同時接手只有一個成功
+                    taken = db.execute(
+                        update(FlightRecord)
+                        .where((FlightRecord.key_hash == key_hash) & self._reclaimable(now))
+                        .values(**values)
+                        .execution_options(synchronize_session=False)
+                    ).rowcount
+                    if not taken:
+                        db.rollback()
+                        return "retry", None
+                else:
+                    db.add(FlightRecord(key_hash=key_hash, **values))
+            # 順便清掉保留期限早已過去的結果
+            db.execute(delete(FlightRecord)
+                       .where((FlightRecord.status == "completed")
+                              & (FlightRecord.expires_at < now - timedelta(seconds=max(60.0, self.lease_s))))
+                       .execution_options(synchronize_session=False))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                return "retry", None
+            return "leader", owner
+        finally:
+            db.close()
+
+    def check(self, key: str) -> Tuple[str, Any]:
+        """等待中的請求查詢 key 的狀態：("completed", 結果)、("running", None) 或 ("gone", None) (失敗或租約過期)。"""
+        now = _now()
+        db = self.session_factory()
+        try:
+            row = db.get(FlightRecord, _key_hash(key))
+            if row is None:
+                return "gone", None
+            if row.status == "completed":
+                return "completed", row.result
+            return ("running" if self._is_live(row, now) else "gone"), None
+        finally:
+            db.close()
+
+    def heartbeat(self, keys: Sequence[Tuple[str, float]], owner: str) -> bool:
+        db = self.session_factory()
+        try:
+            renewed = db.execute(
+                update(FlightRecord)
+                .where(FlightRecord.key_hash.in_([_key_hash(k) for k, _ in keys]) & (FlightRecord.owner == owner))
+                .values(heartbeat_at=_now())
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+            return renewed > 0
+        finally:
+            db.close()
+
+    def finish(self, keys: Sequence[Tuple[str, float]], owner: str, result: Any = None, succeeded: bool = True):
+        """工作結束：成功時保存結果 (各 key 保留各自的秒數)，失敗時刪除紀錄 (重送時重新執行)。"""
+        now = _now()
+        db = self.session_factory()
+        try:
+            for key, keep_s in keys:
+                condition = (FlightRecord.key_hash == _key_hash(key)) & (FlightRecord.owner == owner)
+                if succeeded:
+                    db.execute(update(FlightRecord).where(condition)
+                               .values(status="completed", owner=None, result=jsonable_encoder(result),
+                                       expires_at=now + timedelta(seconds=keep_s))
+                               .execution_options(synchronize_session=False))
+                else:
+                    db.execute(delete(FlightRecord).where(condition).execution_options(synchronize_session=False))
+            db.commit()
+        finally:
+            db.close()
+
+    def remember(self, flight: str, keys: Sequence[Tuple[str, float]], fingerprint: str, result: Any):
+        """共用其他行程的結果後，把這次才帶的 key (例如 Idempotency-Key) 也記下來，之後重送可以直接取得。"""
+        now = _now()
+        for key, keep_s in keys:
+            if keep_s <= 0:
+                continue
+            db = self.session_factory()
+            try:
+                db.add(FlightRecord(key_hash=_key_hash(key), flight=flight, fingerprint=fingerprint, status="completed",
+                                    expires_at=now + timedelta(seconds=keep_s), result=jsonable_encoder(result)))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            finally:
+                db.close()
+
+
+class SingleFlight:
+    def __init__(self, name: str, max_results: int = 1000, store: Optional[DatabaseFlightStore] = None):
+        self.name = name
+        self.max_results = max_results
+        self.store = store
+        self._inflight: Dict[str, Tuple[asyncio.Task, str]] = {}
+        self._results: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()  # key → (到期時間, 指紋, 結果)
+
+    def _check(self, key: str, fingerprint: str, existing: str):
+        if existing != fingerprint:
+            raise IdempotencyKeyConflict(f"{key} 已用於內容或參數不同的請求")
+
+    def _cached(self, key: str, fingerprint: str):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        expires_at, existing, result = entry
+        if expires_at < time.monotonic():
+            del self._results[key]
+            return None
+        self._check(key, fingerprint, existing)
+        return entry
+
+    def _store(self, keys: Sequence[Tuple[str, float]], fingerprint: str, task: asyncio.Task):
+        for key, _ in keys:
+            if self._inflight.get(key, (None, None))[0] is task:
+                del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return                      # 失敗不保留，重送時重新分析
+        now = time.monotonic()
+        for key, keep_s in keys:
+            if keep_s > 0:
+                self._results[key] = (now + keep_s, fingerprint, task.result())
+                self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    async def run(self, keys: Sequence[Tuple[str, float]], factory: Callable[[], Awaitable[Any]],
+                  fingerprint: str = "") -> Tuple[Any, str]:
+        """
+        keys 為 [(key, 完成後保留結果的秒數)]。任一個 key 有保留的結果就直接回傳 (replayed)，
+        有執行中的工作就等待它 (joined)；都沒有時呼叫 factory() 開始新的工作並登記在所有 key 之下 (leader)。
+        factory 會被同步呼叫 (在回傳 coroutine 之前即可接手暫存檔等資源)。回傳 (結果, 角色)。
+        有 store 時本行程沒有紀錄才查詢資料庫：其他行程保留的結果直接回傳、執行中就輪詢到完成，
+        否則取得租約後才呼叫 factory() (租約在工作結束前定期更新)。
+        """
+        while True:
+            for key, _ in keys:
+                cached = self._cached(key, fingerprint)
+                if cached is not None:
+                    REQUESTS.inc(flight=self.name, role="replayed")
+                    return cached[2], "replayed"
+            for key, _ in keys:
+                entry = self._inflight.get(key)
+                if entry is not None:
+                    self._check(key, fingerprint, entry[1])
+                    # 其他 key (例如這次才帶的 Idempotency-Key) 也登記到同一個工作
+                    self._register([k for k in keys if k[0] not in self._inflight], fingerprint, entry[0])
+                    REQUESTS.inc(flight=self.name, role="joined")
+                    return await asyncio.shield(entry[0]), "joined"
+            if self.store is None:
+                owner = None
+                break
+
+            state, value = await asyncio.to_thread(self.store.acquire, self.name, keys, fingerprint)
+            if state == "replayed":
+                REQUESTS.inc(flight=self.name, role="replayed")
+                return value, "replayed"
+            if state == "running":
+                result = await self._follow(value)
+                if result is not None:
+                    others = [k for k in keys if k[0] != value]
+                    await asyncio.to_thread(self.store.remember, self.name, others, fingerprint, result)
+                    REQUESTS.inc(flight=self.name, role="joined")
+                    return result, "joined"
+                continue                # 執行的行程失敗或已結束：重新檢查，可能由本請求接手
+            if state == "leader":
+                owner = value
+                break
+            await asyncio.sleep(self.store.poll_s * random.random())
+
+        task = asyncio.ensure_future(factory())
+        self._register(keys, fingerprint, task)
+        if owner is not None:
+            asyncio.ensure_future(self._hold(keys, owner, task))
+        REQUESTS.inc(flight=self.name, role="leader")
+        return await asyncio.shield(task), "leader"
+
+    async def _follow(self, key: str) -> Any:
+        """輪詢其他行程執行中的工作，完成時回傳結果；失敗或租約過期時回傳 None。"""
+        while True:
+            await asyncio.sleep(self.store.poll_s)
+            state, result = await asyncio.to_thread(self.store.check, key)
+            if state == "completed":
+                return result
+            if state == "gone":
+                return None
+
+    async def _hold(self, keys: Sequence[Tuple[str, float]], owner: str, task: asyncio.Task):
+        """工作執行期間定期更新租約，結束後寫回結果 (失敗或被取消時刪除紀錄，其他行程的等待者改為自行執行)。"""
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.store.lease_s / 3)
+            if task.done():
+                break
+            try:
+                await asyncio.to_thread(self.store.heartbeat, keys, owner)
+            except Exception as e:
+                logger.warning(f"{self.name}：更新租約失敗: {e}", exc_info=True)
+        succeeded = not task.cancelled() and task.exception() is None
+        try:
+            await asyncio.to_thread(self.store.finish, keys, owner, task.result() if succeeded else None, succeeded)
+        except Exception as e:
+            logger.warning(f"{self.name}：寫回結果失敗: {e}", exc_info=True)
+
+    def _register(self, keys: Sequence[Tuple[str, float]], fingerprint: str, task: asyncio.Task):
+        if not keys:
+            return
+        for key, _ in keys:
+            self._inflight[key] = (task, fingerprint)
+        task.add_done_callback(lambda t: self._store(keys, fingerprint, t))
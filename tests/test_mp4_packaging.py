@@ -0,0 +1,162 @@
+# 檔案: tests/test_mp4_packaging.py
+# 職責: mp4_packaging 的回歸測試。faststart、HLS 分段與片段擷取只搬移 box、不重新編碼，
+#       因此處理前後解碼出的每一幀都必須與原始影片完全相同。
+#
+# 執行：python -m pytest tests
+
+import os
+import struct
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks import fixtures  # noqa: E402
+from mp4_packaging import (_chunk_offsets, _full_box, _read_moov, _top_level_boxes,  # noqa: E402
+                           concat_hls_segments, extract_fragments, keyframe_samples, make_faststart, parse_boxes,
+                           segment_hls)
+
+N_FRAMES = 90
+
+
+def _decode_frames(path: str) -> list:
+    cap = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    return frames
+
+
+def _top_level_types(path: str) -> list:
+    with open(path, "rb") as f:
+        return [box_type for box_type, _, _ in _top_level_boxes(f)]
+
+
+def _convert_to_co64(path: str):
+    """把 moov 在檔尾的 MP4 的 stco 改寫成 co64 (偏移不變；moov 在 mdat 之後，變長不影響 chunk 位置)。"""
+    with open(path, "rb") as f:
+        boxes = _top_level_boxes(f)
+        moov, moov_offset, moov_size = _read_moov(f, boxes)
+        f.seek(0)
+        head = f.read(moov_offset)
+        f.seek(moov_offset + moov_size)
+        tail = f.read()
+    assert all(offset < moov_offset for box_type, offset, _ in boxes if box_type == b"mdat")
+    for stbl in moov.walk():
+        if stbl.type != b"stbl" or stbl.find(b"stco") is None:
+            continue
+        offsets = _chunk_offsets(stbl)
+        co64 = _full_box(b"co64", 0, 0, struct.pack(f">I{len(offsets)}Q", len(offsets), *offsets))
+        stbl.children = [co64 if c.type == b"stco" else c for c in stbl.children]
+    with open(path, "wb") as f:
+        f.write(head + moov.to_bytes() + tail)
+
+
+def _has_box(path: str, box_type: bytes) -> bool:
+    with open(path, "rb") as f:
+        moov, _, _ = _read_moov(f, _top_level_boxes(f))
+    return any(box.type == box_type for box in moov.walk())
+
+
+@pytest.fixture(scope="module")
+def source_video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("source") / "clip.mp4")
+    fixtures.make_video(path, N_FRAMES, 320, 240)
+    frames = _decode_frames(path)
+    assert len(frames) == N_FRAMES
+    return path, frames
+
+
+@pytest.fixture(params=["stco", "co64"])
+def video(request, source_video, tmp_path):
+    source_path, frames = source_video
+    path = str(tmp_path / "clip.mp4")
+    with open(source_path, "rb") as src, open(path, "wb") as dst:
+        dst.write(src.read())
+    if request.param == "co64":
+        _convert_to_co64(path)
+        assert _has_box(path, b"co64") and not _has_box(path, b"stco")
+        assert len(_decode_frames(path)) == N_FRAMES
+    return path, frames
+
+
+def _assert_same_frames(path: str, expected: list):
+    frames = _decode_frames(path)
+    assert len(frames) == len(expected)
+    for i, (frame, original) in enumerate(zip(frames, expected)):
+        assert np.array_equal(frame, original), f"第 {i} 幀不一致"
+
+
+def test_faststart_keeps_every_frame(video):
+    path, frames = video
+    types = _top_level_types(path)
+    assert types.index(b"moov") > types.index(b"mdat")
+
+    assert make_faststart(path) is True
+    types = _top_level_types(path)
+    assert types.index(b"moov") < types.index(b"mdat")
+    _assert_same_frames(path, frames)
+
+
+def test_faststart_is_noop_when_already_faststart(video):
+    path, _ = video
+    make_faststart(path)
+    with open(path, "rb") as f:
+        before = f.read()
+
+    assert make_faststart(path) is False
+    with open(path, "rb") as f:
+        assert f.read() == before
+    assert not os.path.exists(path + ".faststart")
+
+
+def test_hls_segments_concatenate_to_every_frame(video, tmp_path):
+    path, frames = video
+    output_paths = segment_hls(path, str(tmp_path / "hls"), segment_seconds=1.0)
+
+    assert output_paths[0].endswith("init.mp4") and output_paths[-1].endswith(".m3u8")
+    segments = [p for p in output_paths if p.endswith(".m4s")]
+    assert len(segments) >= 2
+    with open(output_paths[-1]) as f:
+        playlist = f.read()
+    assert all(os.path.basename(p) in playlist for p in segments)
+    with open(segments[0], "rb") as f:
+        assert [box.type for box in parse_boxes(f.read())] == [b"moof", b"mdat"]
+
+    _assert_same_frames(concat_hls_segments(output_paths, str(tmp_path / "joined.mp4")), frames)
+
+
+def test_hls_after_faststart_keeps_every_frame(video, tmp_path):
+    path, frames = video
+    make_faststart(path)
+    output_paths = segment_hls(path, str(tmp_path / "hls"), segment_seconds=1.0)
+    _assert_same_frames(concat_hls_segments(output_paths, str(tmp_path / "joined.mp4")), frames)
+
+
+def test_extracted_fragment_reports_its_own_length(video, tmp_path):
+    path, frames = video
+    keyframes, sample_count = keyframe_samples(path)
+    assert sample_count == N_FRAMES and len(keyframes) >= 3
+    start, end = keyframes[1], keyframes[-1]
+
+    fragment_path = str(tmp_path / "fragment.mp4")
+    with open(fragment_path, "wb") as f:
+        f.write(extract_fragments(path, [(start, end)])[0])
+
+    cap = cv2.VideoCapture(fragment_path)
+    try:
+        assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == end - start
+    finally:
+        cap.release()
+    _assert_same_frames(fragment_path, frames[start:end])
@@ -0,0 +1,93 @@
+# 檔案: tests/test_score_matrix.py
+# 職責: 向量化評分引擎的回歸測試。score_records_against_profiles / calculate_scores_from_comparison_batch
+#       對隨機產生的紀錄與模型，結果必須與逐筆呼叫 calculate_score_from_comparison 完全相同
+#       (含缺少的特徵鍵、std 為 0、None / 布林 / 字串等非數值、大小寫不一的鍵)。
+#
+# 執行：python -m pytest tests
+
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from PoseClassification import (calculate_score_from_comparison, calculate_scores_from_comparison_batch,  # noqa: E402
+                                score_records_against_profiles)
+
+FEATURE_KEYS = ["stride_length", "Trunk_Tilt", "ELBOW_ANGLE", "knee_flexion", "hip_shoulder_sep", "arm_slot"]
+
+
+def _random_value(rng: random.Random):
+    kind = rng.random()
+    if kind < 0.08:
+        return None
+    if kind < 0.12:
+        return rng.choice([True, False])
+    if kind < 0.15:
+        return rng.choice(["n/a", "", "12.5"])
+    if kind < 0.20:
+        return rng.randint(-50, 200)
+    if kind < 0.25:
+        return np.float64(rng.uniform(-50, 200))
+    return rng.uniform(-50, 200)
+
+
+def _random_features(rng: random.Random) -> dict:
+    features = {}
+    for key in FEATURE_KEYS:
+        if rng.random() < 0.2:
+            continue
+        # 同一個特徵有時以不同大小寫出現 (對到模型中同一個小寫鍵)
+        name = rng.choice([key, key.lower(), key.upper()])
+        features[name] = _random_value(rng)
+    if rng.random() < 0.2:
+        features["unknown_feature"] = rng.uniform(0, 10)
+    return features
+
+
+def _random_profile(rng: random.Random) -> dict:
+    if rng.random() < 0.05:
+        return {}
+    profile = {}
+    for key in FEATURE_KEYS:
+        if rng.random() < 0.15:
+            continue
+        stats = {"mean": rng.uniform(0, 150), "std": rng.choice([0, 0.0, rng.uniform(0.1, 30), rng.uniform(0.1, 30)])}
+        if rng.random() < 0.05:
+            stats["mean"] = None
+        if rng.random() < 0.05:
+            del stats["std"]
+        # 模型的鍵理應是小寫，偶爾放入大寫鍵 (兩種函式都不會對到)
+        profile[key.lower() if rng.random() < 0.9 else key.upper()] = stats
+    return profile
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matrix_matches_single_comparison(seed):
+    rng = random.Random(seed)
+    features_list = [_random_features(rng) for _ in range(rng.randint(1, 15))]
+    profiles_data = [_random_profile(rng) for _ in range(rng.randint(1, 10))]
+
+    final_scores = score_records_against_profiles(features_list, profiles_data).final_scores
+    batch = calculate_scores_from_comparison_batch(features_list, profiles_data)
+    for i, features in enumerate(features_list):
+        for m, profile_data in enumerate(profiles_data):
+            expected = calculate_score_from_comparison(features, profile_data)
+            assert int(final_scores[i, m]) == expected[0], (features, profile_data)
+            assert batch[i][m] == expected, (features, profile_data)
+
+
+def test_non_numeric_values_are_skipped():
+    profile = {"stride_length": {"mean": 100.0, "std": 0}, "trunk_tilt": {"mean": 30.0, "std": 5.0}}
+    features_list = [{"stride_length": "n/a", "trunk_tilt": 35.0}, {"stride_length": True, "trunk_tilt": None}]
+
+    final_scores = score_records_against_profiles(features_list, [profile]).final_scores
+    assert final_scores[:, 0].tolist() == [75, 0]
+    assert calculate_score_from_comparison(features_list[0], profile) == (75, {
+        "trunk_tilt": {"user_value": 35.0, "mean": 30.0, "std": 5.0, "z_score": 1.0, "score": 75}})
+    assert calculate_score_from_comparison(features_list[1], profile) == (0, {})
@@ -0,0 +1,171 @@
+# 檔案: track_store.py
+# 職責: 將一次分析的原始推論結果 (Pose API 骨架、Ball API 球路) 與影片資訊打包成精簡的二進位格式，
+#       隨 PitchAnalyses 一起保存；之後修正演算法時可直接由軌跡重新計算，不必重新上傳影片與推論。
+#
+#   檔頭 (固定 16 bytes)
+#       magic "PTRK" | 格式版本 uint8 | 保留 uint8 x3 | meta 長度 uint32 | 骨架長度 uint32
+#   meta        UTF-8 JSON：影片 fps / 尺寸 / 幀數、Ball API 的其他欄位 (例如 predicted_pitch_type)
+#   骨架        keypoint_codec 格式 (第一個人的關節點與信心分數)
+#   其餘 (zlib) 骨架 bbox float32 (N, 4)、bbox 分數 float32 (N,)、球路 float64 (M, 5) = frame_idx, x1, y1, x2, y2
+
+import json
+import struct
+import zlib
+from functools import cached_property
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from keypoint_codec import KeypointSequence, keypoints_from_json
+from pose_stream import PoseTrack
+
+MAGIC = b"PTRK"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<4sB3xII")
+
+
+def probe_video(video_path: str) -> Dict:
+    """讀取影片的 fps、尺寸與幀數 (只讀檔頭，不解碼畫面)。"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return {}
+        return {
+            "fps": cap.get(cv2.CAP_PROP_FPS),
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        }
+    finally:
+        cap.release()
+
+
+def _first_bbox(bbox_data) -> Optional[list]:
+    # 與 Drawingfunction.draw_pitcher_on_frame 相同：bbox 可能包了好幾層串列
+    while isinstance(bbox_data, list) and len(bbox_data) > 0 and isinstance(bbox_data[0], list):
+        bbox_data = bbox_data[0]
+    if bbox_data and len(bbox_data) == 4 and all(isinstance(c, (int, float)) for c in bbox_data):
+        return bbox_data
+    return None
+
+
+def _pose_arrays(pose_data):
+    """回傳 (frame_idx, keypoints (N, K, 2), scores 或 None, bboxes (N, 4), bbox_scores (N,))。"""
+    if isinstance(pose_data, PoseTrack):
+        scores = pose_data.keypoint_scores
+        if np.isnan(scores).all():
+            scores = None
+        return (pose_data.frame_idx, pose_data.keypoints[:, :, :2], scores,
+                pose_data.bboxes, pose_data.bbox_scores)
+
+    frame_idx, keypoints, scores = keypoints_from_json(pose_data)
+    # bbox 與骨架幀一一對應 (keypoints_from_json 略過沒有人的幀，這裡用同樣的條件)
+    bboxes, bbox_scores = [], []
+    for frame in pose_data.get("frames", []):
+        predictions = frame.get("predictions") or []
+        if not predictions or not predictions[0].get("keypoints"):
+            continue
+        bbox = _first_bbox(predictions[0].get("bbox"))
+        bboxes.append(bbox if bbox is not None else [np.nan] * 4)
+        bbox_score = predictions[0].get("bbox_score")
+        while isinstance(bbox_score, list) and bbox_score:
+            bbox_score = bbox_score[0]
+        bbox_scores.append(bbox_score if isinstance(bbox_score, (int, float)) else np.nan)
+    return frame_idx, keypoints, scores, bboxes, bbox_scores
+
+
+def encode_tracks(pose_data, ball_data: Dict, video_meta: Optional[Dict] = None) -> bytes:
+    """pose_data 可以是 Pose API 回應的 dict 或串流解析的 PoseTrack。"""
+    frame_idx, keypoints, scores, bboxes, bbox_scores = _pose_arrays(pose_data)
+    pose_blob = KeypointSequence.from_arrays(frame_idx, keypoints, scores).to_bytes()
+
+    ball_rows = []
+    for item in ball_data.get("results", []):
+        coords = item[1]
+        if coords is not None and len(coords) == 4 and all(c is not None for c in coords):
+            ball_rows.append([item[0], *coords])
+        else:
+            ball_rows.append([item[0], np.nan, np.nan, np.nan, np.nan])
+
+    meta = {
+        "video": video_meta or {},
+        "ball": {key: value for key, value in ball_data.items() if key != "results"},
+        "ball_frames": len(ball_rows),
+    }
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    payload = b"".join([
+        np.asarray(bboxes, dtype="<f4").reshape(-1, 4).tobytes(),
+        np.asarray(bbox_scores, dtype="<f4").tobytes(),
+        np.asarray(ball_rows, dtype="<f8").reshape(-1, 5).tobytes(),
+    ])
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(meta_bytes), len(pose_blob))
+    return header + meta_bytes + pose_blob + zlib.compress(payload, 6)
+
+
+class AnalysisTracks:
+    """保存的軌跡。建立時只解析檔頭與 meta，骨架與球路陣列在第一次使用時才解壓縮。"""
+
+    def __init__(self, blob: bytes):
+        if len(blob) < _HEADER.size:
+            raise ValueError("軌跡資料長度不足")
+        magic, version, meta_len, pose_len = _HEADER.unpack_from(blob)
+        if magic != MAGIC:
+            raise ValueError("不是軌跡資料格式")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"不支援的軌跡格式版本：{version}")
+        self.version = version
+        offset = _HEADER.size
+        self.meta = json.loads(bytes(blob[offset:offset + meta_len]).decode("utf-8"))
+        offset += meta_len
+        self.pose = KeypointSequence(bytes(blob[offset:offset + pose_len]))
+        self._payload = blob[offset + pose_len:]
+
+    @property
+    def video(self) -> Dict:
+        return self.meta.get("video", {})
+
+    @cached_property
+    def _arrays(self):
+        payload = zlib.decompress(self._payload)
+        n, m = self.pose.n_frames, self.meta.get("ball_frames", 0)
+        bboxes = np.frombuffer(payload, dtype="<f4", count=n * 4).reshape(n, 4)
+        bbox_scores = np.frombuffer(payload, dtype="<f4", count=n, offset=bboxes.nbytes)
+        ball = np.frombuffer(payload, dtype="<f8", count=m * 5,
+                             offset=bboxes.nbytes + bbox_scores.nbytes).reshape(m, 5)
+        return bboxes, bbox_scores, ball
+
+    @property
+    def pose_bboxes(self) -> np.ndarray:
+        return self._arrays[0]
+
+    @property
+    def ball(self) -> np.ndarray:
+        """(M, 5)：frame_idx, x1, y1, x2, y2；沒偵測到球的幀座標為 NaN。"""
+        return self._arrays[2]
+
+    def to_pose_json(self) -> Dict:
+        """還原成 Pose API 的回應格式 (只含有偵測到人的幀)，可直接交給 KinematicsModule / Drawingfunction。"""
+        bboxes, bbox_scores, _ = self._arrays
+        keypoints = self.pose.keypoints.astype(np.float64)
+        scores = self.pose.scores
+        frames = []
+        for i, frame_idx in enumerate(self.pose.frame_idx):
+            prediction = {"keypoints": keypoints[i].tolist()}
+            if scores is not None:
+                prediction["keypoint_scores"] = scores[i].astype(np.float64).tolist()
+            if not np.isnan(bboxes[i]).any():
+                prediction["bbox"] = [bboxes[i].astype(np.float64).tolist()]
+            if not np.isnan(bbox_scores[i]):
+                prediction["bbox_score"] = float(bbox_scores[i])
+            frames.append({"frame_idx": int(frame_idx), "predictions": [prediction]})
+        return {"frames": frames}
+
+    def to_ball_json(self) -> Dict:
+        """還原成 Ball API 的回應格式。"""
+        results = []
+        for row in self.ball:
+            box = None if np.isnan(row[1:]).any() else row[1:].tolist()
+            results.append([int(row[0]), box])
+        return {"results": results, **self.meta.get("ball", {})}
@@ -0,0 +1,311 @@
+# 檔案: video_proxy.py
+# 職責: 呼叫遠端推論前，在本機把上傳的影片轉成較小的「分析用代理影片」，並把推論結果換算回原始影片。
+#
+#   手機常拍 4K / 120 fps，原本整個檔案原封不動送給 Pose API 與 Ball API，上傳量與推論時間都跟著放大。
+#   代理影片：
+#   - 解析度上限 (高度，等比例縮小)
+#   - 幀率上限：每 step 幀取一幀 (step 為整數，代理第 i 幀 = 原始第 start + i * step 幀)
+#   - 可只取 [start, end) 片段
+#   推論結果 (骨架、球框) 會換算回原始影片的幀編號與座標，之後的特徵計算、渲染、保存的軌跡都以原始影片為準。
+
+import bisect
+import logging
+import math
+import os
+import struct
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional
+
+import cv2
+
+from mp4_packaging import extract_fragments, keyframe_samples
+from pose_stream import PoseTrack
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class VideoProxy:
+    """代理影片與原始影片的對應關係。path 與 source_path 相同時代表沒有轉檔。"""
+    path: str
+    source_path: str
+    start_frame: int = 0
+    step: int = 1
+    scale: float = 1.0                  # 代理影片尺寸 / 原始尺寸
+    frame_count: int = 0                # 代理影片幀數
+    fps: float = 0.0                    # 代理影片 fps
+    source_meta: Dict = field(default_factory=dict)
+
+    @property
+    def is_original(self) -> bool:
+        return self.path == self.source_path
+
+    def to_original_frame(self, frame_idx):
+        """代理影片的幀編號 (int 或陣列) 換算成原始影片的幀編號。"""
+        return self.start_frame + frame_idx * self.step
+
+    def map_pose(self, pose: PoseTrack) -> PoseTrack:
+        if self.is_original:
+            return pose
+        keypoints = pose.keypoints.copy()
+        keypoints[:, :, :2] /= self.scale
+        return replace(
+            pose,
+            frame_idx=self.to_original_frame(pose.frame_idx),
+            keypoints=keypoints,
+            bboxes=pose.bboxes / self.scale,
+            total_frames=self.source_meta.get("frame_count") or pose.total_frames,
+        )
+
+    def map_ball(self, ball_data: Dict) -> Dict:
+        if self.is_original:
+            return ball_data
+        results = []
+        for frame_idx, box in ball_data.get("results", []):
+            if box is not None and len(box) == 4 and all(c is not None for c in box):
+                box = [c / self.scale for c in box]
+            results.append([int(self.to_original_frame(frame_idx)), box])
+        return {**ball_data, "results": results}
+
+    def cleanup(self):
+        if not self.is_original and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _open_writer(path: str, fps: float, size):
+    for codec in ("avc1", "mp4v"):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            return writer
+    raise RuntimeError(f"無法建立代理影片：{path}")
+
+
+def build_proxy(source_path: str,
+                source_meta: Dict,
+                max_height: int = 720,
+                max_fps: Optional[float] = None,
+                start_frame: int = 0,
+                end_frame: Optional[int] = None,
+                output_path: Optional[str] = None) -> VideoProxy:
+    """
+    產生代理影片。原始影片已在上限內且不需要裁切時直接使用原檔；
+    只有縮小解析度 (沒有減少幀數) 但轉檔後反而比原檔大時也改用原檔。
+    """
+    width, height = source_meta.get("width", 0), source_meta.get("height", 0)
+    fps, frame_count = source_meta.get("fps") or 0.0, source_meta.get("frame_count", 0)
+    identity = VideoProxy(path=source_path, source_path=source_path, frame_count=frame_count, fps=fps,
+                          source_meta=source_meta)
+    if not width or not height or not fps:
+        return identity
+
+    start_frame = max(0, int(start_frame))
+    if end_frame is not None and frame_count:
+        end_frame = min(int(end_frame), frame_count)
+    step = max(1, math.ceil(fps / max_fps - 1e-6)) if max_fps else 1
+    out_height = min(height, max_height) if max_height else height
+    out_height -= out_height % 2
+    scale = out_height / height
+    out_width = width if scale == 1.0 else max(2, int(round(width * scale / 2)) * 2)
+    trimmed = start_frame > 0 or (end_frame is not None and end_frame < frame_count)
+    if step == 1 and scale == 1.0 and not trimmed:
+        return identity
+
+    base, _ = os.path.splitext(source_path)
+    output_path = output_path or f"{base}_proxy.mp4"
+    cap = cv2.VideoCapture(source_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"無法開啟影片：{source_path}")
+    writer = _open_writer(output_path, fps / step, (out_width, out_height))
+    written = 0
+    try:
+        if start_frame:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start_frame:
+                # 無法精確跳轉時逐幀前進，確保幀編號對應正確
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                for _ in range(start_frame):
+                    if not cap.grab():
+                        break
+        frame_idx = start_frame
+        while end_frame is None or frame_idx < end_frame:
+            if (frame_idx - start_frame) % step:
+                if not cap.grab():
+                    break
+            else:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if scale != 1.0:
+                    frame = cv2.resize(frame, (out_width, out_height), interpolation=cv2.INTER_AREA)
+                writer.write(frame)
+                written += 1
+            frame_idx += 1
+    finally:
+        cap.release()
+        writer.release()
+
+    if step == 1 and not trimmed and os.path.getsize(output_path) >= os.path.getsize(source_path):
+        logger.info("代理影片沒有比原檔小，改送原始影片")
+        os.remove(output_path)
+        return identity
+
+    logger.info(f"代理影片：{width}x{height}@{fps:.1f} {frame_count} 幀 → {out_width}x{out_height}@{fps / step:.1f} "
+                f"{written} 幀 ({os.path.getsize(source_path)} → {os.path.getsize(output_path)} bytes)")
+    return VideoProxy(path=output_path, source_path=source_path, start_frame=start_frame, step=step, scale=scale,
+                      frame_count=written, fps=fps / step, source_meta=source_meta)
+
+
+@dataclass
+class VideoChunk:
+    """長影片切成的片段。keep_start / keep_end 為去除重疊後由此片段負責的幀範圍 (皆為來源影片的幀編號)。"""
+    path: str
+    start_frame: int
+    frame_count: int
+    keep_start: int
+    keep_end: int
+
+
+def plan_chunks(frame_count: int, chunk_frames: int, overlap_frames: int):
+    """
+    回傳 [(start, end, keep_start, keep_end)]。相鄰片段重疊 overlap_frames 幀，
+    重疊區由中點切開，兩邊各保留離自己片段邊緣較遠的一半 (推論結果在片段開頭 / 結尾較不穩定)。
+    片段數只有一個時代表不需要切割。
+    """
+    overlap_frames = max(0, min(overlap_frames, chunk_frames // 2))
+    stride = chunk_frames - overlap_frames
+    spans = []
+    start = 0
+    while True:
+        end = start + chunk_frames
+        # 剩下不到半個片段就併入目前這段，避免最後一段太短
+        if end + stride // 2 >= frame_count:
+            spans.append((start, frame_count))
+            break
+        spans.append((start, end))
+        start += stride
+    plan = []
+    for i, (start, end) in enumerate(spans):
+        keep_start = 0 if i == 0 else (start + spans[i - 1][1]) // 2
+        keep_end = frame_count if i == len(spans) - 1 else (spans[i + 1][0] + end) // 2
+        plan.append((start, end, keep_start, keep_end))
+    return plan
+
+
+def split_video(source_path: str, plan, fps: float, output_prefix: Optional[str] = None):
+    """
+    依 plan_chunks 的結果把影片切成多個檔案，回傳 [VideoChunk]。
+    優先在關鍵幀直接切開 MP4 (不重新編碼，片段起點往前、終點往後對齊到關鍵幀)；
+    不是 MP4、關鍵幀太稀疏或樣本數與幀數對不上時，才解碼後重新編碼。
+    """
+    if output_prefix is None:
+        output_prefix = os.path.splitext(source_path)[0]
+    try:
+        chunks = _split_at_keyframes(source_path, plan, output_prefix)
+    except (ValueError, struct.error) as e:
+        logger.info(f"無法在關鍵幀切割影片，改為重新編碼: {e}")
+        chunks = None
+    if chunks is None:
+        chunks = _split_reencode(source_path, plan, fps, output_prefix)
+    return chunks
+
+
+def _split_at_keyframes(source_path: str, plan, output_prefix: str):
+    keyframes, sample_count = keyframe_samples(source_path)
+    if not keyframes or keyframes[0] != 0 or sample_count != plan[-1][1]:
+        return None
+    spans = []
+    for start, end, _, _ in plan:
+        snapped_start = keyframes[bisect.bisect_right(keyframes, start) - 1]
+        i = bisect.bisect_left(keyframes, end)
+        snapped_end = keyframes[i] if i < len(keyframes) else sample_count
+        if snapped_end - snapped_start > 1.5 * (end - start):
+            return None                 # 關鍵幀間隔太長，對齊後片段會大很多
+        spans.append((snapped_start, snapped_end))
+    if len(set(spans)) != len(spans):
+        return None
+
+    chunks = []
+    for i, (data, (start, end)) in enumerate(zip(extract_fragments(source_path, spans), spans)):
+        # 對齊後重疊區改變，重新以中點分配
+        keep_start = 0 if i == 0 else (start + spans[i - 1][1]) // 2
+        keep_end = sample_count if i == len(spans) - 1 else (spans[i + 1][0] + end) // 2
+        chunk = VideoChunk(path=f"{output_prefix}_part{i:03d}.mp4", start_frame=start, frame_count=end - start,
+                           keep_start=keep_start, keep_end=keep_end)
+        with open(chunk.path, "wb") as f:
+            f.write(data)
+        chunks.append(chunk)
+    return chunks
+
+
+def _split_reencode(source_path: str, plan, fps: float, output_prefix: str):
+    """解碼一次，重疊的幀同時寫進兩個片段。"""
+    cap = cv2.VideoCapture(source_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"無法開啟影片：{source_path}")
+    chunks = [VideoChunk(path=f"{output_prefix}_part{i:03d}.mp4", start_frame=start, frame_count=0,
+                         keep_start=keep_start, keep_end=keep_end)
+              for i, (start, _, keep_start, keep_end) in enumerate(plan)]
+    ends = [end for _, end, _, _ in plan]
+    writers = {}
+    frame_idx = 0
+    try:
+        while frame_idx < ends[-1]:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            for i, chunk in enumerate(chunks):
+                if chunk.start_frame <= frame_idx < ends[i]:
+                    if i not in writers:
+                        writers[i] = _open_writer(chunk.path, fps, (frame.shape[1], frame.shape[0]))
+                    writers[i].write(frame)
+                    chunk.frame_count += 1
+                elif frame_idx >= ends[i] and i in writers:
+                    writers.pop(i).release()
+            frame_idx += 1
+    except Exception:
+        for chunk in chunks:
+            if os.path.exists(chunk.path):
+                os.remove(chunk.path)
+        raise
+    finally:
+        cap.release()
+        for writer in writers.values():
+            writer.release()
+    return [chunk for chunk in chunks if chunk.frame_count]
+
+
+def cut_clip(source_path: str, start_frame: int, end_frame: int, fps: float, output_path: str) -> VideoChunk:
+    """
+    把來源影片的 [start_frame, end_frame) 切成獨立的影片檔 (長時間練投影片切出單次投球)，回傳 VideoChunk。
+    跳到起點解碼後重新編碼：片段邊界由動作偵測決定，不一定落在關鍵幀上，
+    而之後的代理影片、球速與渲染都依幀數計算，片段必須正好從 start_frame 開始。
+    """
+    cap = cv2.VideoCapture(source_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"無法開啟影片：{source_path}")
+    writer = None
+    written = 0
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start_frame:
+            # 無法精確跳轉時逐幀前進，確保幀編號對應正確
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            for _ in range(start_frame):
+                if not cap.grab():
+                    break
+        while start_frame + written < end_frame:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if writer is None:
+                writer = _open_writer(output_path, fps, (frame.shape[1], frame.shape[0]))
+            writer.write(frame)
+            written += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    if not written:
+        raise RuntimeError(f"無法讀取影片片段：{source_path} [{start_frame}, {end_frame})")
+    return VideoChunk(path=output_path, start_frame=start_frame, frame_count=written,
+                      keep_start=start_frame, keep_end=start_frame + written)
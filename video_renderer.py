@@ -0,0 +1,208 @@
+# 檔案: video_renderer.py
+# 職責: 延遲渲染。分析時只保存原始影片與軌跡，第一次有人要看影片時才渲染、上傳，並把網址快取在分析紀錄上。
+#
+#   - 分析時選擇的渲染設定 (video_render_profile) 快取在 video_path / hls_url，其他設定各自快取在 rendered_videos，
+#     不會互相覆蓋
+#   - 原始影片由儲存空間取回，骨架與球路使用 PitchAnalyses.tracks_blob，不再呼叫推論 API
+#   - 同一筆紀錄、同一個渲染設定同時有多個請求時只渲染一次：同一行程內共用同一個 Task，
+#     其他工作行程由資料庫 (single_flight) 的租約得知已有行程在渲染，輪詢到完成後取得同一個網址；
+#     第一個請求中途斷線不會中斷渲染，其他請求仍會拿到結果
+#   - 上傳前視設定把 MP4 轉成 faststart，並可另外輸出 HLS 分段 (分段並行上傳，播放清單最後上傳)
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+
+from config import GCS_BUCKET_NAME, HLS_SEGMENT_SECONDS, HLS_UPLOAD_CONCURRENCY, VIDEO_FASTSTART, VIDEO_HLS
+from config import SCRATCH_RENDER_RESERVE_MB
+from database import SessionLocal, PitchAnalyses
+from Drawingfunction import RenderProfile, render_video_with_pose_and_max_ball_speed
+from gcs_utils import download_from_gcs, upload_video_to_gcs
+from mp4_packaging import make_faststart, segment_hls
+from scratch_space import ScratchSpace
+from single_flight import DatabaseFlightStore, SingleFlight
+from track_store import AnalysisTracks
+
+logger = logging.getLogger(__name__)
+
+# 進行中的渲染 (key 為分析紀錄 + 渲染設定)，跨工作行程以資料庫租約協調
+render_flight = SingleFlight("render_video", store=DatabaseFlightStore())
+# 完成後保留網址的秒數：在寫回紀錄前就讀出分析紀錄的請求直接取得結果，不會再渲染一次
+RENDER_RESULT_KEEP_SECONDS = 60.0
+
+
+def source_blob_name(filename: str) -> str:
+    """原始影片在儲存空間中的路徑 (加上隨機前綴，同名檔案不會互相覆蓋)。"""
+    return f"source_videos/{uuid.uuid4().hex}_{os.path.basename(filename)}"
+
+
+def rendered_blob_name(analysis_id: int, source_blob: str, profile: RenderProfile) -> str:
+    filename = os.path.basename(source_blob).split("_", 1)[-1]
+    prefix = "rendered_" if profile.name == "full" else f"rendered_{profile.name}_"
+    return f"render_videos/{prefix}{analysis_id}_{filename}"
+
+
+def _upload_hls(pool: ThreadPoolExecutor, rendered_path: str, destination_blob_name: str) -> str:
+    # 分段寫在渲染影片旁邊 (請求自己的暫存目錄)
+    hls_dir = tempfile.mkdtemp(prefix="hls_", dir=os.path.dirname(os.path.abspath(rendered_path)))
+    try:
+        *segments, playlist = segment_hls(rendered_path, hls_dir, HLS_SEGMENT_SECONDS)
+        prefix = f"{os.path.splitext(destination_blob_name)[0]}_hls"
+        uploads = [pool.submit(upload_video_to_gcs, GCS_BUCKET_NAME, path, f"{prefix}/{os.path.basename(path)}")
+                   for path in segments]
+        for upload in uploads:
+            upload.result()
+        # 播放清單最後上傳：拿得到清單時所有分段都已經存在
+        return upload_video_to_gcs(GCS_BUCKET_NAME, playlist, f"{prefix}/{os.path.basename(playlist)}")
+    finally:
+        shutil.rmtree(hls_dir, ignore_errors=True)
+
+
+def publish_rendered_video(rendered_path: str, destination_blob_name: str) -> Tuple[str, Optional[str]]:
+    """
+    上傳渲染好的影片，回傳 (MP4 網址, HLS 播放清單網址或 None) (在執行緒中執行)。
+    faststart / HLS 失敗時仍上傳原本的 MP4。
+    """
+    if VIDEO_FASTSTART:
+        try:
+            make_faststart(rendered_path)
+        except Exception as e:
+            logger.warning(f"faststart 轉換失敗，上傳原始 MP4: {e}", exc_info=True)
+
+    hls_url = None
+    with ThreadPoolExecutor(max_workers=max(1, HLS_UPLOAD_CONCURRENCY)) as pool:
+        mp4_upload = pool.submit(upload_video_to_gcs, GCS_BUCKET_NAME, rendered_path, destination_blob_name)
+        if VIDEO_HLS:
+            try:
+                hls_url = _upload_hls(pool, rendered_path, destination_blob_name)
+            except Exception as e:
+                logger.warning(f"HLS 輸出失敗，只提供 MP4: {e}", exc_info=True)
+        video_url = mp4_upload.result()
+    return video_url, hls_url
+
+
+def render_from_storage(analysis_id: int, source_blob: str, tracks_blob: bytes,
+                        key_frames: Optional[Dict], profile: RenderProfile,
+                        work_dir: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    下載原始影片、以保存的軌跡渲染並上傳，回傳 (影片網址, HLS 網址) (在執行緒中執行)。
+    work_dir 由呼叫端提供時由呼叫端負責刪除，否則自行建立暫存目錄。
+    """
+    owns_work_dir = work_dir is None
+    if owns_work_dir:
+        work_dir = tempfile.mkdtemp(prefix=f"render_{analysis_id}_")
+    try:
+        local_source = os.path.join(work_dir, os.path.basename(source_blob))
+        download_from_gcs(GCS_BUCKET_NAME, source_blob, local_source)
+        tracks = AnalysisTracks(tracks_blob)
+        rendered_path, _ = render_video_with_pose_and_max_ball_speed(
+            input_video_path=local_source,
+            pose_json=tracks.to_pose_json(),
+            ball_json=tracks.to_ball_json(),
+            key_frames=key_frames,
+            profile=profile,
+            output_dir=work_dir
+        )
+        try:
+            return publish_rendered_video(rendered_path, rendered_blob_name(analysis_id, source_blob, profile))
+        finally:
+            if os.path.exists(rendered_path):
+                os.remove(rendered_path)
+    finally:
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _store_rendered_video(db, analysis_id: int, profile: RenderProfile, is_primary: bool,
+                          video_url: str, hls_url: Optional[str]):
+    rendered_at = datetime.now(timezone.utc)
+    if is_primary:
+        db.execute(
+            update(PitchAnalyses)
+            .where(PitchAnalyses.id == analysis_id)
+            .values(video_path=video_url, hls_url=hls_url, video_rendered_at=rendered_at)
+        )
+        return
+    # 其他設定寫進 rendered_videos (讀出、加入這個設定後整個寫回；鎖住該列以免同時完成的設定互相蓋掉)
+    analysis = db.query(PitchAnalyses).filter(PitchAnalyses.id == analysis_id).with_for_update().first()
+    if analysis is None:
+        return
+    analysis.rendered_videos = {
+        **(analysis.rendered_videos or {}),
+        profile.name: {"video_url": video_url, "hls_url": hls_url, "rendered_at": rendered_at.isoformat()},
+    }
+
+
+async def _render_and_store(analysis_id: int, source_blob: str, tracks_blob: bytes,
+                            key_frames: Optional[Dict], profile: RenderProfile, is_primary: bool,
+                            session_factory, scratch: Optional[ScratchSpace]) -> Dict:
+    logger.info(f"延遲渲染：開始渲染分析紀錄 {analysis_id} (設定 {profile.name})")
+    if scratch is None:
+        video_url, hls_url = await asyncio.to_thread(render_from_storage, analysis_id, source_blob, tracks_blob,
+                                                     key_frames, profile)
+    else:
+        async with await scratch.open(f"render_{analysis_id}", int(SCRATCH_RENDER_RESERVE_MB * 1024 * 1024)) as work:
+            video_url, hls_url = await asyncio.to_thread(render_from_storage, analysis_id, source_blob, tracks_blob,
+                                                         key_frames, profile, work.path)
+    # 請求層級的 Session 可能已經關閉 (第一個請求斷線)，寫回時使用自己的 Session
+    db = session_factory()
+    try:
+        _store_rendered_video(db, analysis_id, profile, is_primary, video_url, hls_url)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"延遲渲染：分析紀錄 {analysis_id} 完成 {video_url}")
+    return {"video_url": video_url, "hls_url": hls_url}
+
+
+def _is_primary_profile(analysis: PitchAnalyses, profile: RenderProfile) -> bool:
+    """是否為分析時選擇的渲染設定 (舊紀錄在分析時就以完整設定渲染)。"""
+    return (analysis.video_render_profile or "full") == profile.name
+
+
+def _cached_video(analysis: PitchAnalyses, profile: RenderProfile) -> Optional[Dict]:
+    """紀錄上已快取的同一渲染設定影片 {"video_url", "hls_url"}，沒有時回傳 None。"""
+    if _is_primary_profile(analysis, profile) or not analysis.source_video_blob:
+        # 沒有原始影片的舊紀錄無法以其他設定渲染，一律回傳既有影片
+        if analysis.video_path:
+            return {"video_url": analysis.video_path, "hls_url": analysis.hls_url}
+        return None
+    cached = (analysis.rendered_videos or {}).get(profile.name)
+    if cached and cached.get("video_url"):
+        return {"video_url": cached["video_url"], "hls_url": cached.get("hls_url")}
+    return None
+
+
+async def get_or_render_video(analysis: PitchAnalyses, profile: RenderProfile,
+                              session_factory=SessionLocal, scratch: Optional[ScratchSpace] = None) -> Dict:
+    """
+    回傳 {"video_url", "hls_url", "cached"}。沒有原始影片或軌跡可以渲染時拋出 ValueError。
+    scratch 提供時在其中建立渲染用的暫存目錄 (計入配額)，配額不足時拋出 ScratchQuotaExceeded。
+    """
+    cached = _cached_video(analysis, profile)
+    if cached is not None:
+        return {**cached, "cached": True}
+    if not analysis.source_video_blob or analysis.tracks_blob is None:
+        raise ValueError("此分析紀錄沒有保存原始影片或軌跡，無法渲染影片")
+
+    features = analysis.biomechanics_features or {}
+    key_frames = {"release": features.get("release_frame"), "landing": features.get("landing_frame")}
+
+    def start():
+        return _render_and_store(analysis.id, analysis.source_video_blob, analysis.tracks_blob, key_frames, profile,
+                                 _is_primary_profile(analysis, profile), session_factory, scratch)
+
+    # 等待中的請求被取消時不影響渲染本身 (SingleFlight 以 shield 等待)
+    result, _ = await render_flight.run([(f"render:{analysis.id}:{profile.name}", RENDER_RESULT_KEEP_SECONDS)], start)
+    return {**result, "cached": False}